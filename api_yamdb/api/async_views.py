@@ -0,0 +1,199 @@
+"""Асинхронные версии частых запросов на чтение.
+
+В Django 3.2 нет асинхронного ORM, поэтому вся работа с базой одного
+ответа - фильтры, страница, её ``count`` и проверка родительского объекта
+- выполняется одним вызовом ``sync_to_async`` в общем потоке синхронного
+кода. Там же Django открывает и закрывает соединения по ``CONN_MAX_AGE``
+в начале и конце запроса, поэтому постоянное соединение переиспользуется,
+а цикл событий тем временем обслуживает другие запросы. Под WSGI эти
+представления тоже работают, но выигрыш появляется только под
+ASGI-сервером.
+
+Ответы совпадают с ответами ``TitlesViewSet``, ``ReviewsViewSet`` и
+``CommentsViewSet`` с постраничной пагинацией, но без кеша ответов и
+условных запросов. Список произведений применяет те же фильтры, что и
+``TitlesViewSet``: ``genre``, ``category``, ``name``, ``year``,
+``search`` и ``ordering``.
+"""
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.http import HttpRequest, HttpResponseNotAllowed, JsonResponse
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from reviews.models import Comment, Genre, Review, Title
+
+from .pagination import cached_count
+from .serializers import (
+    CommentsSerializer,
+    ReviewsSerializer,
+    TitleDetailSerializer,
+    TitlesSerializer,
+)
+from .views import TitlesViewSet
+
+READ_METHODS = ('GET', 'HEAD')
+PAGE_QUERY_PARAM = 'page'
+NOT_FOUND_MESSAGE = 'Страница не найдена.'
+INVALID_PAGE_MESSAGE = 'Неправильная страница.'
+
+AsyncView = Callable[..., Awaitable[Any]]
+
+
+def run_query(func: Callable[..., Any]) -> Callable[..., Awaitable[Any]]:
+    """Выполняет функцию с запросами к базе в потоке синхронного кода.
+
+    Функция должна сделать все запросы ответа: каждый вызов - переход
+    между потоками, а отдельные потоки пула открывали бы свои
+    соединения.
+    """
+    return sync_to_async(func, thread_sensitive=True)
+
+
+def read_only(view: AsyncView) -> AsyncView:
+    @wraps(view)
+    async def wrapper(
+        request: HttpRequest,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        if request.method not in READ_METHODS:
+            return HttpResponseNotAllowed(READ_METHODS)
+        return await view(request, *args, **kwargs)
+
+    return wrapper
+
+
+def json_response(data: Any, status: int = 200) -> JsonResponse:
+    return JsonResponse(
+        data,
+        status=status,
+        safe=False,
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+def not_found(message: str = NOT_FOUND_MESSAGE) -> JsonResponse:
+    return json_response({'detail': message}, status=404)
+
+
+def serialize(
+    queryset: QuerySet,
+    serializer_class: serializers.SerializerMetaclass,
+) -> Any:
+    return serializer_class(queryset, many=True).data
+
+
+def page_link(url: str, number: int) -> str:
+    if number == 1:
+        return remove_query_param(url, PAGE_QUERY_PARAM)
+    return replace_query_param(url, PAGE_QUERY_PARAM, number)
+
+
+def paginated_response(
+    request: HttpRequest,
+    queryset: QuerySet,
+    serializer_class: serializers.SerializerMetaclass,
+    parent: Optional[QuerySet] = None,
+) -> JsonResponse:
+    """Страница ``queryset`` в формате ``CustomPagination``.
+
+    Если передан ``parent``, сначала проверяется, что родительский объект
+    существует.
+    """
+    try:
+        number = int(request.GET.get(PAGE_QUERY_PARAM, 1))
+    except ValueError:
+        return not_found(INVALID_PAGE_MESSAGE)
+    if number < 1:
+        return not_found(INVALID_PAGE_MESSAGE)
+    if parent is not None and not parent.exists():
+        return not_found()
+    size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    offset = (number - 1) * size
+    results = serialize(queryset[offset:offset + size], serializer_class)
+    if number > 1 and not results:
+        return not_found(INVALID_PAGE_MESSAGE)
+    count = cached_count(queryset)
+
+    url = request.build_absolute_uri()
+    return json_response(
+        {
+            'count': count,
+            'next': (
+                page_link(url, number + 1)
+                if offset + size < count else None
+            ),
+            'previous': page_link(url, number - 1) if number > 1 else None,
+            'results': results,
+        },
+    )
+
+
+def titles_page(request: HttpRequest) -> JsonResponse:
+    view = TitlesViewSet(
+        request=Request(request),
+        action='list',
+        args=(),
+        kwargs={},
+        format_kwarg=None,
+    )
+    try:
+        queryset = view.filter_queryset(view.get_queryset().order_by('id'))
+    except ValidationError as error:
+        return json_response(error.detail, status=400)
+    return paginated_response(request, queryset, TitlesSerializer)
+
+
+def title_detail_page(request: HttpRequest, title_id: int) -> JsonResponse:
+    title = Title.objects.select_related('category').filter(
+        pk=title_id,
+    ).first()
+    if title is None:
+        return not_found()
+    title.genre_list = list(Genre.objects.filter(genre=title_id))
+    return json_response(TitleDetailSerializer(title).data)
+
+
+@read_only
+async def title_list(request: HttpRequest) -> JsonResponse:
+    return await run_query(titles_page)(request)
+
+
+@read_only
+async def title_detail(request: HttpRequest, title_id: int) -> JsonResponse:
+    return await run_query(title_detail_page)(request, title_id)
+
+
+@read_only
+async def review_list(request: HttpRequest, title_id: int) -> JsonResponse:
+    return await run_query(paginated_response)(
+        request,
+        Review.objects.filter(title_id=title_id).select_related(
+            'author',
+        ).order_by('id'),
+        ReviewsSerializer,
+        Title.objects.filter(pk=title_id),
+    )
+
+
+@read_only
+async def comment_list(
+    request: HttpRequest,
+    title_id: int,
+    review_id: int,
+) -> JsonResponse:
+    return await run_query(paginated_response)(
+        request,
+        Comment.objects.filter(review_id=review_id).select_related(
+            'author',
+        ).order_by('id'),
+        CommentsSerializer,
+        Review.objects.filter(pk=review_id, title_id=title_id),
+    )
@@ -0,0 +1,138 @@
+"""JWT-аутентификация без запроса пользователя на каждый запрос.
+
+Права доступа в ``api.permissions`` смотрят только на ``id``,
+``username`` и ``role``. Токены, выданные ``MyTokenObtainPairSerializer``,
+несут ``username`` и ``role`` в claims, и в безопасных запросах
+пользователь собирается прямо из токена. Для токенов без этих claims
+пользователь берётся из кеша процесса с коротким временем жизни, который
+сбрасывается при сохранении и удалении ``User``. Кеш хранит не больше
+``AUTH_USER_CACHE_MAX_SIZE`` пользователей и вытесняет тех, к кому
+дольше всего не обращались.
+
+Запросы, меняющие данные, всегда читают пользователя из базы: удалённый
+или деактивированный пользователь теряет право записи сразу, а права
+проверяются по текущей роли. В безопасных запросах смена роли попадает
+в claims только с новым токеном, то есть не позже истечения
+``ACCESS_TOKEN_LIFETIME``, а кеш процесса в других процессах живёт не
+дольше ``AUTH_USER_CACHE_TIMEOUT``.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.request import Request
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+
+from reviews.models import User
+
+from .metrics import cache_event
+
+PRINCIPAL_CLAIMS = ('username', 'role')
+
+_user_cache: 'OrderedDict[Any, Tuple[float, User]]' = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+
+def token_principal(validated_token: Token) -> User:
+    """Несохраняемый ``User`` с полями из claims токена.
+
+    Годится для проверки прав и как значение внешнего ключа, но
+    остальные поля пусты: там, где нужен профиль целиком, пользователя
+    надо загрузить из базы.
+    """
+    user = User(
+        id=validated_token[api_settings.USER_ID_CLAIM],
+        username=validated_token['username'],
+        role=validated_token['role'],
+    )
+    user._state.adding = False
+    user._state.db = 'default'
+    return user
+
+
+def cached_user(user_id: Any) -> User:
+    now = time.monotonic()
+    with _user_cache_lock:
+        entry = _user_cache.get(user_id)
+        hit = entry is not None and entry[0] > now
+        if hit:
+            _user_cache.move_to_end(user_id)
+    cache_event('auth_user', hit)
+    if hit:
+        return entry[1]
+    return load_user(user_id)
+
+
+def load_user(user_id: Any) -> User:
+    """Читает пользователя из базы и обновляет им кеш процесса."""
+    now = time.monotonic()
+    try:
+        user = User.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+    except User.DoesNotExist:
+        raise AuthenticationFailed(
+            'Пользователь не найден.',
+            code='user_not_found',
+        )
+    with _user_cache_lock:
+        _user_cache[user_id] = (now + settings.AUTH_USER_CACHE_TIMEOUT, user)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > settings.AUTH_USER_CACHE_MAX_SIZE:
+            _user_cache.popitem(last=False)
+    return user
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender: Any, instance: User, **kwargs: Any) -> None:
+    with _user_cache_lock:
+        _user_cache.pop(getattr(instance, api_settings.USER_ID_FIELD), None)
+
+
+def clear_user_cache() -> None:
+    with _user_cache_lock:
+        _user_cache.clear()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    safe_request = True
+
+    def authenticate(
+        self: 'CachedJWTAuthentication',
+        request: Request,
+    ) -> Optional[Tuple[User, Token]]:
+        self.safe_request = request.method in SAFE_METHODS
+        return super().authenticate(request)
+
+    def get_user(
+        self: 'CachedJWTAuthentication',
+        validated_token: Token,
+    ) -> User:
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(
+                'В токене нет идентификатора пользователя.',
+            )
+        if not self.safe_request:
+            user = load_user(user_id)
+        elif all(claim in validated_token for claim in PRINCIPAL_CLAIMS):
+            return token_principal(validated_token)
+        else:
+            user = cached_user(user_id)
+        if not user.is_active:
+            raise AuthenticationFailed(
+                'Пользователь неактивен.',
+                code='user_inactive',
+            )
+        return user
@@ -1,8 +1,32 @@
+from hashlib import md5
+from typing import Any, Callable, Dict, Optional, Tuple, Type
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Model
+from django.utils.cache import patch_vary_headers
+from django.utils.http import (
+    http_date,
+    parse_etags,
+    parse_http_date_safe,
+    quote_etag,
+)
 from rest_framework import (
     mixins,
+    pagination,
+    status,
     viewsets,
 )
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from reviews.db import may_be_stale
+from reviews.versions import get_versions, version_key, version_snapshot
+
+from .metrics import cache_event
+from .pagination import KeysetPagination
+
+RESPONSE_KEY_PREFIX = 'response:'
 
 
 class ViewSet(
@@ -12,3 +36,190 @@ class ViewSet(
     viewsets.GenericViewSet,
 ):
     pass
+
+
+class KeysetPaginationMixin:
+    """Включает курсорную пагинацию по ``?pagination=cursor``.
+
+    Ссылки ``next``/``previous`` курсорной страницы содержат параметр
+    ``cursor``, поэтому его наличие тоже переключает режим.
+    """
+
+    keyset_pagination_class = KeysetPagination
+    pagination_query_param = 'pagination'
+
+    @property
+    def paginator(
+        self: 'KeysetPaginationMixin',
+    ) -> Optional[pagination.BasePagination]:
+        if not hasattr(self, '_paginator'):
+            params = self.request.query_params
+            if (
+                params.get(self.pagination_query_param) == 'cursor'
+                or self.keyset_pagination_class.cursor_query_param in params
+            ):
+                self._paginator = self.keyset_pagination_class()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
+
+class VersionedResponseMixin:
+    """Кеш ответов и условные GET-запросы на основе версий моделей.
+
+    ``cache_models`` включает серверный кеш данных ответа: ключ строится
+    из полного адреса запроса со схемой и хостом (ссылки
+    ``next``/``previous`` в ответе абсолютные) и версий этих моделей.
+    ``etag_models`` добавляет к ответу ``ETag``, ``Last-Modified`` и
+    ``Vary: Accept`` и отвечает ``304 Not Modified`` без обращения к
+    базе, если версии не менялись. Версии меняют сигналы моделей при
+    записи, поэтому проверка не требует запросов к таблицам. Сразу после
+    записи ответ, прочитанный с реплики, отдаётся без кеша и валидаторов
+    (``reviews.db.may_be_stale``).
+    """
+
+    cache_models: Tuple[Type[Model], ...] = ()
+    etag_models: Tuple[Type[Model], ...] = ()
+
+    def versioned_response(
+        self: 'VersionedResponseMixin',
+        handler: Callable[..., Response],
+        request: Request,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Response:
+        versions = get_versions(set(self.cache_models + self.etag_models))
+        if may_be_stale(versions):
+            return handler(request, *args, **kwargs)
+        etag = last_modified = None
+        if self.etag_models:
+            etag, last_modified = self.get_validators(request, versions)
+            if self.is_not_modified(request, etag, last_modified):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                return self.set_validators(response, etag, last_modified)
+
+        key = None
+        if self.cache_models:
+            key = self.response_cache_key(request, versions)
+            data = cache.get(key)
+            cache_event('response', data is not None)
+            if data is not None:
+                return self.set_validators(
+                    self.resolved_response(request, Response(data)),
+                    etag,
+                    last_modified,
+                )
+
+        with version_snapshot(versions):
+            response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            if key is not None:
+                cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+            response = self.resolved_response(request, response)
+            self.set_validators(response, etag, last_modified)
+        return response
+
+    @staticmethod
+    def resolved_response(request: Request, response: Response) -> Response:
+        """``304`` на ``If-None-Match: *``, когда объект уже найден.
+
+        ``*`` означает «любая версия существующего ресурса», поэтому до
+        обработки запроса он не проверяется: для несуществующего объекта
+        ответ должен остаться ``404``.
+        """
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None and '*' in parse_etags(if_none_match):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return response
+
+    def response_cache_key(
+        self: 'VersionedResponseMixin',
+        request: Request,
+        versions: Dict[str, int],
+    ) -> str:
+        return RESPONSE_KEY_PREFIX + md5(
+            repr(
+                (
+                    request.build_absolute_uri(),
+                    sorted(
+                        (key, versions[key])
+                        for key in map(version_key, self.cache_models)
+                    ),
+                ),
+            ).encode(),
+        ).hexdigest()
+
+    def get_validators(
+        self: 'VersionedResponseMixin',
+        request: Request,
+        versions: Dict[str, int],
+    ) -> Tuple[str, int]:
+        etag_versions = sorted(
+            (key, versions[key])
+            for key in map(version_key, self.etag_models)
+        )
+        digest = md5(
+            repr(
+                (
+                    request.build_absolute_uri(),
+                    request.accepted_renderer.format,
+                    etag_versions,
+                ),
+            ).encode(),
+        ).hexdigest()
+        last_modified = max(version for _, version in etag_versions)
+        return quote_etag(digest), last_modified // 10 ** 9
+
+    @staticmethod
+    def is_not_modified(
+        request: Request,
+        etag: str,
+        last_modified: int,
+    ) -> bool:
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match is not None:
+            return etag in parse_etags(if_none_match)
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''),
+        )
+        return (
+            if_modified_since is not None
+            and last_modified <= if_modified_since
+        )
+
+    @staticmethod
+    def set_validators(
+        response: Response,
+        etag: Optional[str],
+        last_modified: Optional[int],
+    ) -> Response:
+        if etag is not None:
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class VersionedListMixin(VersionedResponseMixin):
+    def list(
+        self: 'VersionedListMixin',
+        request: Request,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Response:
+        return self.versioned_response(super().list, request, *args, **kwargs)
+
+
+class VersionedRetrieveMixin(VersionedResponseMixin):
+    def retrieve(
+        self: 'VersionedRetrieveMixin',
+        request: Request,
+        *args: Any,
+        **kwargs: Any,
+    ) -> Response:
+        return self.versioned_response(
+            super().retrieve,
+            request,
+            *args,
+            **kwargs,
+        )
@@ -1,6 +1,17 @@
+import json
+from typing import Any, List
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, IntegerField, When
+from django.db.models.expressions import RawSQL
+from django.db.models.query import QuerySet
 from django_filters import rest_framework as filter_
+from rest_framework.filters import BaseFilterBackend
+from rest_framework.request import Request
 
 from reviews.models import Title
+from reviews.search import search_titles
 
 
 class TitleFilter(filter_.FilterSet):
@@ -15,3 +26,70 @@ class TitleFilter(filter_.FilterSet):
     class Meta:
         model = Title
         fields = ('genre', 'category', 'name', 'year')
+
+
+class TitleSearchFilter(BaseFilterBackend):
+    """Полнотекстовый поиск ``?search=`` по индексу ``reviews.search``.
+
+    Результаты упорядочены по релевантности, их число ограничено
+    ``SEARCH_MAX_RESULTS``. На SQLite и PostgreSQL найденные ``id``
+    передаются в запрос одним параметром, а не отдельным параметром на
+    каждое произведение в ``IN`` и ``CASE``.
+    """
+
+    search_param = 'search'
+
+    def filter_queryset(
+        self: 'TitleSearchFilter',
+        request: Request,
+        queryset: QuerySet,
+        view: Any,
+    ) -> QuerySet:
+        query = request.query_params.get(self.search_param, '').strip()
+        if not query:
+            return queryset
+        title_ids = search_titles(query, settings.SEARCH_MAX_RESULTS)
+        if not title_ids:
+            return queryset.none()
+        return self.ranked(queryset, title_ids)
+
+    @staticmethod
+    def ranked(queryset: QuerySet, title_ids: List[int]) -> QuerySet:
+        """Оставляет произведения из ``title_ids`` в порядке списка."""
+        connection = connections[queryset.db]
+        opts = queryset.model._meta
+        column = (
+            f'{connection.ops.quote_name(opts.db_table)}.'
+            f'{connection.ops.quote_name(opts.pk.column)}'
+        )
+        if connection.vendor == 'postgresql':
+            return queryset.filter(
+                pk__in=RawSQL('SELECT unnest(%s::integer[])', (title_ids,)),
+            ).order_by(
+                RawSQL(
+                    f'array_position(%s::integer[], {column})',
+                    (title_ids,),
+                ),
+            )
+        if connection.vendor == 'sqlite':
+            # Позиция ",id," в строке растёт вместе с позицией в списке.
+            return queryset.filter(
+                pk__in=RawSQL(
+                    'SELECT value FROM json_each(%s)',
+                    (json.dumps(title_ids),),
+                ),
+            ).order_by(
+                RawSQL(
+                    f"instr(%s, ',' || {column} || ',')",
+                    (',' + ','.join(map(str, title_ids)) + ',',),
+                ),
+            )
+        return queryset.filter(pk__in=title_ids).order_by(
+            Case(
+                *(
+                    When(pk=pk, then=position)
+                    for position, pk in enumerate(title_ids)
+                ),
+                output_field=IntegerField(),
+            ),
+        )
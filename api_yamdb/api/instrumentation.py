@@ -0,0 +1,266 @@
+"""Замеры запросов: число SQL-запросов, время базы, сериализации и кода.
+
+``RequestMetricsMiddleware`` замеряет долю ``REQUEST_METRICS_SAMPLE_RATE``
+запросов. Для них ответ получает заголовок ``Server-Timing``, а в лог
+``api.instrumentation`` пишется строка JSON с теми же значениями. Если
+включён ``METRICS_ENABLED``, число запросов к базе и время считаются для
+всех запросов и попадают в метрики ``api.metrics``; без подписей
+запросов это счётчик и сумма. Иначе запросы вне выборки обходятся одной
+проверкой ``ContextVar`` на каждый SQL-запрос.
+
+Запросы к базе считает обёртка из ``execute_wrappers``, которая ставится
+на каждое соединение (сигнал ``connection_created``): так учитываются и
+соединения потоков, в которых под ASGI выполняются синхронные
+представления и запросы ``api.async_views``. Время сериализации - это
+отрисовка ответа ``TimedJSONRenderer``.
+
+Одинаковые с точностью до параметров запросы, повторённые в одном
+запросе ``REQUEST_METRICS_DUPLICATE_THRESHOLD`` раз и больше, - признак
+N+1: они попадают в строку лога, а для каждой пары эндпоинт и запрос
+один раз пишется предупреждение.
+"""
+import asyncio
+import json
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from asgiref.sync import markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from .metrics import observe_request
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+
+current_stats: ContextVar[Optional['RequestStats']] = ContextVar(
+    'request_stats',
+    default=None,
+)
+
+_flagged: Dict[str, Set[str]] = {}
+_flagged_lock = threading.Lock()
+
+
+def query_signature(sql: str) -> str:
+    """SQL без различий в длине списков ``IN``."""
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+class RequestStats:
+    """Замеры одного запроса; подписи SQL копятся только при ``detailed``."""
+
+    def __init__(self: 'RequestStats', detailed: bool = True) -> None:
+        self.lock = threading.Lock()
+        self.detailed = detailed
+        self.started = time.perf_counter()
+        self.count = 0
+        self.queries: Counter = Counter()
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+
+    def add_query(self: 'RequestStats', sql: str, duration: float) -> None:
+        signature = query_signature(sql) if self.detailed else None
+        with self.lock:
+            self.count += 1
+            self.db_time += duration
+            if signature is not None:
+                self.queries[signature] += 1
+
+    def add_serialize(self: 'RequestStats', duration: float) -> None:
+        with self.lock:
+            self.serialize_time += duration
+
+    def duplicates(self: 'RequestStats') -> List[Tuple[str, int]]:
+        return [
+            (signature, count)
+            for signature, count in self.queries.most_common()
+            if count >= settings.REQUEST_METRICS_DUPLICATE_THRESHOLD
+        ]
+
+
+def record_query(
+    execute: Callable[..., Any],
+    sql: str,
+    params: Any,
+    many: bool,
+    context: Dict[str, Any],
+) -> Any:
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_recorder(
+    sender: Any,
+    connection: BaseDatabaseWrapper,
+    **kwargs: Any,
+) -> None:
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    def render(
+        self: 'TimedJSONRenderer',
+        data: Any,
+        accepted_media_type: Optional[str] = None,
+        renderer_context: Optional[Dict[str, Any]] = None,
+    ) -> bytes:
+        stats = current_stats.get()
+        if stats is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        started = time.perf_counter()
+        try:
+            return super().render(data, accepted_media_type, renderer_context)
+        finally:
+            stats.add_serialize(time.perf_counter() - started)
+
+
+def endpoint_name(request: HttpRequest) -> str:
+    match = getattr(request, 'resolver_match', None)
+    view_name = match.view_name if match is not None else 'unresolved'
+    return f'{request.method} {view_name}'
+
+
+def flag_duplicates(
+    endpoint: str,
+    duplicates: List[Tuple[str, int]],
+) -> None:
+    for signature, count in duplicates:
+        with _flagged_lock:
+            seen = _flagged.setdefault(endpoint, set())
+            if signature in seen:
+                continue
+            seen.add(signature)
+        logger.warning(
+            'Повторяющийся запрос (N+1) в %s, %d раз: %s',
+            endpoint,
+            count,
+            signature,
+        )
+
+
+def clear_flagged() -> None:
+    with _flagged_lock:
+        _flagged.clear()
+
+
+def milliseconds(seconds: float) -> float:
+    return round(seconds * 1000, 2)
+
+
+def report(
+    request: HttpRequest,
+    response: HttpResponse,
+    stats: RequestStats,
+) -> HttpResponse:
+    total = time.perf_counter() - stats.started
+    if settings.METRICS_ENABLED:
+        observe_request(request, response, total, stats.count, stats.db_time)
+    if not stats.detailed:
+        return response
+    view = max(total - stats.db_time - stats.serialize_time, 0.0)
+    count = stats.count
+    response['Server-Timing'] = ', '.join(
+        (
+            f'db;dur={milliseconds(stats.db_time)};desc="{count} queries"',
+            f'serialize;dur={milliseconds(stats.serialize_time)}',
+            f'view;dur={milliseconds(view)}',
+            f'total;dur={milliseconds(total)}',
+        ),
+    )
+    endpoint = endpoint_name(request)
+    duplicates = stats.duplicates()
+    logger.info(
+        json.dumps(
+            {
+                'endpoint': endpoint,
+                'path': request.path,
+                'status': response.status_code,
+                'queries': count,
+                'db_ms': milliseconds(stats.db_time),
+                'serialize_ms': milliseconds(stats.serialize_time),
+                'view_ms': milliseconds(view),
+                'total_ms': milliseconds(total),
+                'duplicates': [
+                    {'sql': signature, 'count': repeats}
+                    for signature, repeats in duplicates
+                ],
+            },
+            ensure_ascii=False,
+        ),
+    )
+    flag_duplicates(endpoint, duplicates)
+    return response
+
+
+def start_stats() -> Optional[RequestStats]:
+    sampled = random.random() < settings.REQUEST_METRICS_SAMPLE_RATE
+    if not (sampled or settings.METRICS_ENABLED):
+        return None
+    return RequestStats(detailed=sampled)
+
+
+class RequestMetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(
+        self: 'RequestMetricsMiddleware',
+        get_response: Callable[[HttpRequest], Any],
+    ) -> None:
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Соединения, открытые до импорта модуля, сигнал не застал.
+        for connection in connections.all():
+            install_query_recorder(None, connection)
+
+    def __call__(
+        self: 'RequestMetricsMiddleware',
+        request: HttpRequest,
+    ) -> Any:
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.acall(request)
+        stats = start_stats()
+        if stats is None:
+            return self.get_response(request)
+        token = current_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return report(request, response, stats)
+
+    async def acall(
+        self: 'RequestMetricsMiddleware',
+        request: HttpRequest,
+    ) -> HttpResponse:
+        stats = start_stats()
+        if stats is None:
+            return await self.get_response(request)
+        token = current_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        return report(request, response, stats)
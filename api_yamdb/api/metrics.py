@@ -0,0 +1,352 @@
+"""Метрики в формате Prometheus: запросы, задержки, SQL и кеши.
+
+Значения копятся в файлах каталога ``METRICS_DIR``: у каждого потока
+каждого процесса свой файл ``<pid>-<поток>.db``, отображённый в память
+(``mmap``). В файл пишет только его поток, поэтому на горячем пути нет
+блокировок и общей памяти между воркерами. ``/metrics`` читает и
+складывает файлы всех процессов, не мешая им писать.
+
+Формат файла: 8 байт заголовка с числом занятых байт, затем записи
+«длина ключа, ключ, выравнивание до 8 байт, значение ``double``». Ключ -
+JSON с именем сэмпла и метками. Новая запись сначала дописывается, а
+потом увеличивается заголовок, так что читатель не увидит её
+наполовину.
+
+Файлы завершившихся процессов удаляет ``remove_dead_files`` при старте
+(``wsgi.py``, ``asgi.py``); их счётчики при этом сбрасываются, что
+Prometheus воспринимает как перезапуск.
+"""
+import json
+import math
+import mmap
+import os
+import struct
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse
+
+Labels = Tuple[Tuple[str, str], ...]
+
+HEADER_SIZE = 8
+INITIAL_SIZE = 64 * 1024
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, math.inf,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, math.inf)
+
+COUNTERS = {
+    'yamdb_http_requests_total': 'Число HTTP-запросов.',
+    'yamdb_cache_requests_total': 'Обращения к кешам: попадания и промахи.',
+}
+HISTOGRAMS = {
+    'yamdb_http_request_duration_seconds': (
+        DURATION_BUCKETS,
+        'Время обработки HTTP-запроса.',
+    ),
+    'yamdb_db_queries_per_request': (
+        QUERY_BUCKETS,
+        'Число SQL-запросов за HTTP-запрос.',
+    ),
+    'yamdb_db_duration_seconds': (
+        DURATION_BUCKETS,
+        'Время SQL-запросов за HTTP-запрос.',
+    ),
+}
+CACHE_RATIO = 'yamdb_cache_hit_ratio'
+
+
+class MmapFile:
+    """Значения одного потока, отображённые в память."""
+
+    def __init__(self: 'MmapFile', path: Path) -> None:
+        self.file = open(path, 'a+b')
+        if os.fstat(self.file.fileno()).st_size < HEADER_SIZE:
+            self.file.truncate(INITIAL_SIZE)
+        self.capacity = os.fstat(self.file.fileno()).st_size
+        self.mmap = mmap.mmap(self.file.fileno(), self.capacity)
+        self.used = struct.unpack_from('<i', self.mmap, 0)[0] or HEADER_SIZE
+        self.positions = {
+            key: position
+            for key, position, _ in read_entries(self.mmap, self.used)
+        }
+
+    def add(self: 'MmapFile', key: str, amount: float) -> None:
+        position = self.positions.get(key)
+        if position is None:
+            position = self.append(key)
+        value = struct.unpack_from('<d', self.mmap, position)[0]
+        struct.pack_into('<d', self.mmap, position, value + amount)
+
+    def append(self: 'MmapFile', key: str) -> int:
+        encoded = key.encode()
+        value_offset = align(4 + len(encoded))
+        entry = (
+            struct.pack('<i', len(encoded))
+            + encoded.ljust(value_offset - 4, b' ')
+            + struct.pack('<d', 0.0)
+        )
+        while self.used + len(entry) > self.capacity:
+            self.grow()
+        self.mmap[self.used:self.used + len(entry)] = entry
+        position = self.used + value_offset
+        self.used += len(entry)
+        struct.pack_into('<i', self.mmap, 0, self.used)
+        self.positions[key] = position
+        return position
+
+    def close(self: 'MmapFile') -> None:
+        self.mmap.close()
+        self.file.close()
+
+    def grow(self: 'MmapFile') -> None:
+        self.mmap.close()
+        self.capacity *= 2
+        self.file.truncate(self.capacity)
+        self.mmap = mmap.mmap(self.file.fileno(), self.capacity)
+
+
+def align(offset: int) -> int:
+    return (offset + 7) // 8 * 8
+
+
+def read_entries(
+    data: Any,
+    used: int,
+) -> Iterator[Tuple[str, int, float]]:
+    position = HEADER_SIZE
+    while position < used:
+        length = struct.unpack_from('<i', data, position)[0]
+        key = bytes(data[position + 4:position + 4 + length]).decode()
+        value_position = position + align(4 + length)
+        yield key, value_position, struct.unpack_from(
+            '<d',
+            data,
+            value_position,
+        )[0]
+        position = value_position + 8
+
+
+_local = threading.local()
+
+
+def thread_file() -> MmapFile:
+    """Файл текущего потока; после ``fork`` открывается заново."""
+    directory = Path(settings.METRICS_DIR)
+    owner = (os.getpid(), directory)
+    if getattr(_local, 'owner', None) != owner:
+        if hasattr(_local, 'file'):
+            _local.file.close()
+        directory.mkdir(parents=True, exist_ok=True)
+        _local.file = MmapFile(
+            directory / f'{os.getpid()}-{threading.get_ident()}.db',
+        )
+        _local.owner = owner
+    return _local.file
+
+
+def sample_key(name: str, labels: Dict[str, str]) -> str:
+    return json.dumps([name, sorted(labels.items())], ensure_ascii=False)
+
+
+def inc(name: str, labels: Dict[str, str], amount: float = 1) -> None:
+    if settings.METRICS_ENABLED:
+        thread_file().add(sample_key(name, labels), amount)
+
+
+def observe(name: str, labels: Dict[str, str], value: float) -> None:
+    if not settings.METRICS_ENABLED:
+        return
+    buckets, _ = HISTOGRAMS[name]
+    bound = next(bound for bound in buckets if value <= bound)
+    values = thread_file()
+    values.add(
+        sample_key(f'{name}_bucket', {**labels, 'le': format_value(bound)}),
+        1,
+    )
+    values.add(sample_key(f'{name}_sum', labels), value)
+    values.add(sample_key(f'{name}_count', labels), 1)
+
+
+def cache_event(cache_name: str, hit: bool) -> None:
+    inc(
+        'yamdb_cache_requests_total',
+        {'cache': cache_name, 'result': 'hit' if hit else 'miss'},
+    )
+
+
+def view_label(request: HttpRequest) -> str:
+    """``Класс.действие`` для DRF, имя функции для остальных."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view = match.func
+    view_class = getattr(view, 'cls', None) or getattr(
+        view,
+        'view_class',
+        None,
+    )
+    if view_class is None:
+        module = view.__module__.rsplit('.', 1)[-1]
+        return f'{module}.{view.__name__}'
+    method = request.method.lower()
+    action = (getattr(view, 'actions', None) or {}).get(method, method)
+    return f'{view_class.__name__}.{action}'
+
+
+def observe_request(
+    request: HttpRequest,
+    response: HttpResponse,
+    duration: float,
+    queries: int,
+    db_time: float,
+) -> None:
+    labels = {'view': view_label(request)}
+    inc(
+        'yamdb_http_requests_total',
+        {
+            **labels,
+            'method': request.method,
+            'status': str(response.status_code),
+        },
+    )
+    observe('yamdb_http_request_duration_seconds', labels, duration)
+    observe('yamdb_db_queries_per_request', labels, queries)
+    observe('yamdb_db_duration_seconds', labels, db_time)
+
+
+def collect() -> Dict[Tuple[str, Labels], float]:
+    """Сумма значений из файлов всех процессов."""
+    totals: Dict[Tuple[str, Labels], float] = defaultdict(float)
+    directory = Path(settings.METRICS_DIR)
+    if not directory.is_dir():
+        return totals
+    for path in directory.glob('*.db'):
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            continue
+        if len(data) < HEADER_SIZE:
+            continue
+        used = struct.unpack_from('<i', data, 0)[0]
+        for key, _, value in read_entries(data, used):
+            name, labels = json.loads(key)
+            totals[name, tuple(map(tuple, labels))] += value
+    return totals
+
+
+def remove_dead_files() -> None:
+    directory = Path(settings.METRICS_DIR)
+    if not directory.is_dir():
+        return
+    for path in directory.glob('*.db'):
+        pid = int(path.name.split('-', 1)[0])
+        if pid != os.getpid() and not process_alive(pid):
+            path.unlink(missing_ok=True)
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        (name, value.replace('\\', r'\\').replace('"', r'\"').replace(
+            '\n',
+            r'\n',
+        ))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def histogram_lines(
+    name: str,
+    totals: Dict[Tuple[str, Labels], float],
+) -> List[str]:
+    buckets, _ = HISTOGRAMS[name]
+    lines = []
+    label_sets = sorted(
+        labels for sample, labels in totals if sample == f'{name}_count'
+    )
+    for labels in label_sets:
+        cumulative = 0.0
+        for bound in buckets:
+            le = (('le', format_value(bound)),)
+            cumulative += totals.get(
+                (f'{name}_bucket', tuple(sorted(labels + le))),
+                0.0,
+            )
+            lines.append(
+                f'{name}_bucket{format_labels(labels + le)} {cumulative}',
+            )
+        for suffix in ('_sum', '_count'):
+            lines.append(
+                f'{name}{suffix}{format_labels(labels)} '
+                f'{totals[name + suffix, labels]}',
+            )
+    return lines
+
+
+def cache_ratio_lines(totals: Dict[Tuple[str, Labels], float]) -> List[str]:
+    events: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for (sample, labels), value in totals.items():
+        if sample == 'yamdb_cache_requests_total':
+            labels = dict(labels)
+            events[labels['cache']][labels['result']] = value
+    lines = []
+    for cache_name, results in sorted(events.items()):
+        hits = results.get('hit', 0.0)
+        ratio = hits / (hits + results.get('miss', 0.0))
+        lines.append(
+            f'{CACHE_RATIO}{format_labels((("cache", cache_name),))} {ratio}',
+        )
+    return lines
+
+
+def render(totals: Optional[Dict[Tuple[str, Labels], float]] = None) -> str:
+    if totals is None:
+        totals = collect()
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [
+            f'{sample}{format_labels(labels)} {value}'
+            for (sample, labels), value in sorted(totals.items())
+            if sample == name
+        ]
+    for name, (_, help_text) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        lines += histogram_lines(name, totals)
+    lines += [
+        f'# HELP {CACHE_RATIO} Доля попаданий в кеш.',
+        f'# TYPE {CACHE_RATIO} gauge',
+    ]
+    lines += cache_ratio_lines(totals)
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    token = settings.METRICS_TOKEN
+    if token and request.META.get('HTTP_AUTHORIZATION') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(render(), content_type=CONTENT_TYPE)
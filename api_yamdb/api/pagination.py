@@ -1,10 +1,132 @@
-from typing import Any
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from hashlib import md5
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
 
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Model, Q
+from django.db.models.query import QuerySet
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from reviews.db import may_be_stale
+from reviews.versions import get_versions
+
+from .metrics import cache_event
+
+COUNT_KEY_PREFIX = 'count:'
+
+
+@lru_cache(maxsize=None)
+def tables_to_models() -> Dict[str, Type[Model]]:
+    return {model._meta.db_table: model for model in apps.get_models()}
+
+
+def query_models(queryset: QuerySet) -> Set[Type[Model]]:
+    tables = tables_to_models()
+    models = {queryset.model}
+    for alias in queryset.query.alias_map.values():
+        if alias.table_name in tables:
+            models.add(tables[alias.table_name])
+    return models
+
+
+def cached_count(queryset: QuerySet) -> int:
+    """Возвращает ``COUNT(*)`` запроса, кешируя его на короткое время.
+
+    Ключ включает SQL с параметрами и версии всех таблиц запроса, так что
+    запись в любую из них делает закешированное значение недоступным.
+    """
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    versions = get_versions(query_models(queryset))
+    key = COUNT_KEY_PREFIX + md5(
+        repr((queryset.db, sql, params, sorted(versions.items()))).encode(),
+    ).hexdigest()
+    count = cache.get(key)
+    cache_event('count', count is not None)
+    if count is None:
+        count = approximate_count(queryset)
+        if count is None:
+            count = queryset.count()
+        if not may_be_stale(versions):
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def approximate_count(queryset: QuerySet) -> Optional[int]:
+    """Оценка числа строк таблицы по статистике СУБД.
+
+    Используется только для списков без фильтров, если включён
+    ``PAGINATION_APPROXIMATE_COUNT`` и таблица больше порога: на
+    небольших таблицах точный подсчёт дешевле неточности.
+    """
+    query = queryset.query
+    if (
+        not settings.PAGINATION_APPROXIMATE_COUNT
+        or query.where
+        or query.distinct
+        or query.low_mark
+        or query.high_mark is not None
+        or len(query_models(queryset)) > 1
+    ):
+        return None
+    estimate = table_estimate(queryset)
+    if (
+        estimate is None
+        or estimate < settings.PAGINATION_APPROXIMATE_COUNT_THRESHOLD
+    ):
+        return None
+    return estimate
+
+
+def table_estimate(queryset: QuerySet) -> Optional[int]:
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'sqlite':
+        sql = (
+            "SELECT CAST(substr(stat, 1, instr(stat || ' ', ' ') - 1) "
+            'AS INTEGER) FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+        )
+    else:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class CachedCountPaginator(Paginator):
+    @cached_property
+    def count(self: 'CachedCountPaginator') -> int:
+        if isinstance(self.object_list, QuerySet):
+            return cached_count(self.object_list)
+        return super().count
 
 
 class CustomPagination(pagination.PageNumberPagination):
+    django_paginator_class = CachedCountPaginator
+
     def get_paginated_response(
         self: 'CustomPagination',
         data: Any,
@@ -17,3 +139,119 @@ class CustomPagination(pagination.PageNumberPagination):
                 'results': data,
             },
         )
+
+
+class KeysetPagination(pagination.BasePagination):
+    """Курсорная пагинация по паре ``(pub_date, id)``, от новых к старым.
+
+    Страница выбирается условием по ключу последней записи, а не
+    OFFSET, поэтому глубокие страницы не дороже первой. ``count``
+    считается только по запросу ``?count=true``.
+    """
+
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self: 'KeysetPagination') -> None:
+        self.page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+        self.base_url: Optional[str] = None
+        self.count: Optional[int] = None
+        self.next_position: Optional[Tuple[str, int]] = None
+        self.previous_position: Optional[Tuple[str, int]] = None
+
+    def paginate_queryset(
+        self: 'KeysetPagination',
+        queryset: QuerySet,
+        request: Request,
+        view: Any = None,
+    ) -> List[Model]:
+        self.base_url = request.build_absolute_uri()
+        position, reverse = self.decode_cursor(request)
+        if request.query_params.get(self.count_query_param) == 'true':
+            self.count = cached_count(queryset)
+
+        if reverse:
+            queryset = queryset.order_by('pub_date', 'id')
+        else:
+            queryset = queryset.order_by('-pub_date', '-id')
+        if position is not None:
+            pub_date, pk = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(pub_date__gt=pub_date) | Q(pub_date=pub_date, id__gt=pk),
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk),
+                )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+        if not results:
+            return results
+
+        first, last = self.key(results[0]), self.key(results[-1])
+        if reverse:
+            self.next_position = last
+            self.previous_position = first if has_more else None
+        else:
+            self.next_position = last if has_more else None
+            self.previous_position = first if position is not None else None
+        return results
+
+    def get_paginated_response(
+        self: 'KeysetPagination',
+        data: Any,
+    ) -> Response:
+        return Response(
+            {
+                'count': self.count,
+                'next': self.get_link(self.next_position, reverse=False),
+                'previous': self.get_link(
+                    self.previous_position,
+                    reverse=True,
+                ),
+                'results': data,
+            },
+        )
+
+    def get_link(
+        self: 'KeysetPagination',
+        position: Optional[Tuple[str, int]],
+        reverse: bool,
+    ) -> Optional[str]:
+        if position is None:
+            return None
+        cursor = urlsafe_b64encode(
+            json.dumps([position[0], position[1], reverse]).encode(),
+        ).decode()
+        return replace_query_param(
+            self.base_url,
+            self.cursor_query_param,
+            cursor,
+        )
+
+    def decode_cursor(
+        self: 'KeysetPagination',
+        request: Request,
+    ) -> Tuple[Optional[Tuple[Any, int]], bool]:
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            pub_date, pk, reverse = json.loads(urlsafe_b64decode(encoded))
+            pub_date = parse_datetime(pub_date)
+            pk = int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if pub_date is None:
+            raise NotFound(self.invalid_cursor_message)
+        return (pub_date, pk), bool(reverse)
+
+    @staticmethod
+    def key(obj: Model) -> Tuple[str, int]:
+        return obj.pub_date.isoformat(), obj.pk
@@ -18,6 +18,15 @@ class IsAdminOrReadOnly(permissions.BasePermission):
         return False
 
 
+class IsAdmin(permissions.BasePermission):
+    def has_permission(
+        self: 'IsAdmin',
+        request: Request,
+        view: Type[View],
+    ) -> bool:
+        return request.user.is_authenticated and request.user.is_admin
+
+
 class IsModerator(permissions.BasePermission):
     def has_object_permission(
         self: 'IsModerator',
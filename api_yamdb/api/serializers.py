@@ -1,16 +1,30 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
 
+from django.conf import settings
 from django.core.validators import (
     EmailValidator,
     MaxLengthValidator,
     RegexValidator,
 )
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Q
 from rest_framework import exceptions, serializers, status
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.validators import UniqueValidator
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.tokens import RefreshToken
 
-from reviews.models import Categorie, Comment, Genre, Review, Title, User
+from reviews.models import (
+    Categorie,
+    Comment,
+    Genre,
+    Review,
+    Title,
+    TitleReviewSummary,
+    User,
+)
+from reviews.signals import titles_bulk_saved
 
 
 class ReviewsSerializer(serializers.ModelSerializer):
@@ -24,18 +38,56 @@ class ReviewsSerializer(serializers.ModelSerializer):
         model = Review
         fields = '__all__'
 
-    def validate(
+    def create(
         self: 'ReviewsSerializer',
-        data: Dict[str, Any],
-    ) -> Dict[str, Any]:
-        if self.context['request'].method != 'POST':
-            return data
-        if Review.objects.filter(
-            author=self.context['request'].user,
-            title__id=self.context['view'].kwargs.get('title_id'),
-        ).exists():
-            raise serializers.ValidationError('Отзыв можно оставить единожды')
-        return data
+        validated_data: Dict[str, Any],
+    ) -> Review:
+        """Второй отзыв автора отсекает ограничение ``unique_review``.
+
+        Отдельная проверка ``exists()`` стоила бы лишнего запроса и всё
+        равно пропускала бы одновременные запросы одного автора. Наличие
+        отзыва проверяется только после ошибки записи: остальные
+        нарушения целостности пробрасываются как есть.
+        """
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            if not Review.objects.filter(
+                author=validated_data['author'],
+                title=validated_data['title'],
+            ).exists():
+                raise
+            raise serializers.ValidationError(
+                {
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        'Отзыв можно оставить единожды',
+                    ],
+                },
+            )
+
+
+class TitleReviewSummarySerializer(serializers.ModelSerializer):
+    count = serializers.IntegerField(source='title.rating_count')
+    score_sum = serializers.IntegerField(source='title.rating_sum')
+    latest_reviews = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TitleReviewSummary
+        fields = ('title', 'count', 'score_sum', 'histogram', 'latest_reviews')
+
+    def get_latest_reviews(
+        self: 'TitleReviewSummarySerializer',
+        summary: TitleReviewSummary,
+    ) -> List[Dict[str, Any]]:
+        reviews = Review.objects.select_related('author').in_bulk(
+            summary.latest,
+        )
+        return ReviewsSerializer(
+            [reviews[pk] for pk in summary.latest if pk in reviews],
+            many=True,
+            context=self.context,
+        ).data
 
 
 class CommentsSerializer(serializers.ModelSerializer):
@@ -65,8 +117,7 @@ class CatigoriesSerializer(serializers.ModelSerializer):
 class TitlesSerializer(serializers.ModelSerializer):
     category = CatigoriesSerializer(many=False, read_only=True)
     genre = GenresSerializer(many=True, read_only=True)
-    rating = serializers.IntegerField(source='reviews__score__avg',
-                                      read_only=True)
+    rating = serializers.IntegerField(read_only=True)
 
     class Meta:
         fields = (
@@ -82,6 +133,15 @@ class TitlesSerializer(serializers.ModelSerializer):
         model = Title
 
 
+class TitleDetailSerializer(TitlesSerializer):
+    """``TitlesSerializer`` с жанрами, загруженными отдельным запросом.
+
+    Список жанров кладётся в атрибут ``genre_list`` произведения.
+    """
+
+    genre = GenresSerializer(source='genre_list', many=True, read_only=True)
+
+
 class TitleWriteSerializer(serializers.ModelSerializer):
     category = serializers.SlugRelatedField(
         queryset=Categorie.objects.all(),
@@ -98,7 +158,179 @@ class TitleWriteSerializer(serializers.ModelSerializer):
         model = Title
 
 
+class TitleBulkListSerializer(serializers.ListSerializer):
+    """Пакетное создание и изменение произведений.
+
+    Все slug категорий и жанров разрешаются двумя запросами, новые
+    произведения и связи с жанрами пишутся через ``bulk_create`` в одной
+    транзакции. Ошибки возвращаются списком по индексам элементов.
+    """
+
+    def to_internal_value(
+        self: 'TitleBulkListSerializer',
+        data: Any,
+    ) -> List[Dict[str, Any]]:
+        max_items = settings.TITLES_BULK_MAX_ITEMS
+        if isinstance(data, list) and len(data) > max_items:
+            raise serializers.ValidationError(
+                {
+                    'non_field_errors': [
+                        f'Не больше {max_items} произведений за запрос.',
+                    ],
+                },
+            )
+        if not isinstance(data, list):
+            return super().to_internal_value(data)
+
+        items, errors = [], []
+        for item in data:
+            try:
+                items.append(self.child.run_validation(item))
+                errors.append({})
+            except serializers.ValidationError as exc:
+                items.append(None)
+                errors.append(exc.detail)
+        valid = [item for item in items if item is not None]
+        self.categories = Categorie.objects.in_bulk(
+            {item['category'] for item in valid},
+            field_name='slug',
+        )
+        self.genres = Genre.objects.in_bulk(
+            {slug for item in valid for slug in item['genre']},
+            field_name='slug',
+        )
+        ids = [item['id'] for item in valid if 'id' in item]
+        self.existing = Title.objects.in_bulk(ids) if ids else {}
+
+        for item, item_errors in zip(items, errors):
+            if item is not None:
+                item_errors.update(self.item_errors(item, ids))
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return items
+
+    def item_errors(
+        self: 'TitleBulkListSerializer',
+        item: Dict[str, Any],
+        ids: List[int],
+    ) -> Dict[str, List[str]]:
+        errors = {}
+        if 'id' in item:
+            if item['id'] not in self.existing:
+                errors['id'] = ['Произведение не найдено.']
+            elif ids.count(item['id']) > 1:
+                errors['id'] = ['Произведение указано в запросе дважды.']
+        if item['category'] not in self.categories:
+            errors['category'] = [
+                f'Категория «{item["category"]}» не найдена.',
+            ]
+        missing = [slug for slug in item['genre'] if slug not in self.genres]
+        if missing:
+            errors['genre'] = [
+                f'Жанр «{slug}» не найден.' for slug in missing
+            ]
+        return errors
+
+    def create(
+        self: 'TitleBulkListSerializer',
+        validated_data: List[Dict[str, Any]],
+    ) -> List[Title]:
+        titles, created, updated = [], [], []
+        if not validated_data:
+            return titles
+        for item in validated_data:
+            title = self.existing.get(item.get('id')) or Title()
+            title.name = item['name']
+            title.year = item['year']
+            title.description = item.get('description')
+            title.category = self.categories[item['category']]
+            title.genre_slugs = list(dict.fromkeys(item['genre']))
+            titles.append(title)
+            (updated if title.pk else created).append(title)
+
+        with transaction.atomic():
+            if created:
+                self.insert(created)
+            if updated:
+                Title.objects.bulk_update(
+                    updated,
+                    ['name', 'year', 'description', 'category'],
+                )
+                Title.genre.through.objects.filter(
+                    title__in=updated,
+                ).delete()
+            Title.genre.through.objects.bulk_create(
+                Title.genre.through(
+                    title_id=title.pk,
+                    genre_id=self.genres[slug].pk,
+                )
+                for title in titles
+                for slug in title.genre_slugs
+            )
+            titles_bulk_saved(titles)
+        return titles
+
+    @staticmethod
+    def insert(titles: List[Title]) -> None:
+        connection = connections[router.db_for_write(Title)]
+        if connection.features.can_return_rows_from_bulk_insert:
+            Title.objects.bulk_create(titles)
+            return
+        # Django 3.2 не получает id из bulk_create на SQLite, поэтому id
+        # назначаются заранее. Запись первой берёт блокировку базы до
+        # конца транзакции: никто не вставит строки между чтением
+        # последнего id и вставкой. Последний id берётся и из
+        # sqlite_sequence, чтобы не выдать заново id удалённых строк.
+        table = Title._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET id = id '
+                f'WHERE id = (SELECT MAX(id) FROM {table})',
+            )
+            cursor.execute(
+                'SELECT MAX(coalesce(('
+                'SELECT seq FROM sqlite_sequence WHERE name = %s'
+                f'), 0), coalesce((SELECT MAX(id) FROM {table}), 0))',
+                [table],
+            )
+            last = cursor.fetchone()[0]
+        for pk, title in enumerate(titles, last + 1):
+            title.pk = pk
+        Title.objects.bulk_create(titles)
+
+
+class TitleBulkSerializer(serializers.ModelSerializer):
+    id = serializers.IntegerField(required=False)
+    category = serializers.SlugField()
+    genre = serializers.ListField(child=serializers.SlugField())
+
+    class Meta:
+        fields = ('id', 'name', 'description', 'year', 'category', 'genre')
+        model = Title
+        list_serializer_class = TitleBulkListSerializer
+
+    def to_representation(
+        self: 'TitleBulkSerializer',
+        instance: Title,
+    ) -> Dict[str, Any]:
+        return {
+            'id': instance.pk,
+            'name': instance.name,
+            'description': instance.description,
+            'year': instance.year,
+            'category': instance.category.slug,
+            'genre': instance.genre_slugs,
+        }
+
+
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
+    @classmethod
+    def get_token(cls: Any, user: User) -> RefreshToken:
+        token = super().get_token(user)
+        token['username'] = user.username
+        token['role'] = user.role
+        return token
+
     def validate(
         self: 'MyTokenObtainPairSerializer',
         attrs: Dict[str, Any],
@@ -117,6 +349,74 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         return super().validate(attrs)
 
 
+class SignUpSerializer(serializers.Serializer):
+    """Регистрация и повторный запрос кода подтверждения.
+
+    Существующего пользователя и конфликты по ``username`` и ``email``
+    находит один запрос. Новый пользователь сохраняется одним INSERT,
+    у существующего обновляется только ``confirmation_code``.
+    """
+
+    email = serializers.EmailField(
+        validators=[EmailValidator(), MaxLengthValidator(254)],
+    )
+    username = serializers.CharField(
+        validators=[
+            RegexValidator(r'^[\w.@+-]+\Z'),
+            MaxLengthValidator(150),
+        ],
+    )
+
+    def validate_username(self: 'SignUpSerializer', value: str) -> str:
+        if value.lower() == 'me':
+            raise serializers.ValidationError(
+                'Использовать имя "me" запрещено.',
+            )
+        return value
+
+    def validate(
+        self: 'SignUpSerializer',
+        data: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        username, email = data['username'], data['email']
+        matches = list(
+            User.objects.filter(Q(username=username) | Q(email=email))[:2],
+        )
+        for user in matches:
+            if user.username == username and user.email == email:
+                self.instance = user
+                return data
+        errors = {}
+        for user in matches:
+            if user.username == username:
+                errors['username'] = (
+                    'Пользователь с таким username уже существует.'
+                )
+            if user.email == email:
+                errors['email'] = 'Пользователь с таким email уже существует.'
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data
+
+    def create(
+        self: 'SignUpSerializer',
+        validated_data: Dict[str, Any],
+    ) -> User:
+        user = User(**validated_data)
+        user.generate_confirmation_code()
+        user.save()
+        return user
+
+    def update(
+        self: 'SignUpSerializer',
+        instance: User,
+        validated_data: Dict[str, Any],
+    ) -> User:
+        instance.generate_confirmation_code()
+        instance.save(update_fields=['confirmation_code'])
+        return instance
+
+
 class UserSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(
         validators=[
@@ -1,7 +1,7 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from . import views
+from . import async_views, views
 
 router = DefaultRouter()
 
@@ -23,4 +23,32 @@ router.register('users', views.UserViewSet, basename='users')
 
 app_name = 'api'
 
-urlpatterns = [path('v1/', include((router.urls, 'api')))]
+urlpatterns = [
+    path('v1/export/<str:table>/', views.ExportView.as_view(), name='export'),
+    path(
+        'v1/autocomplete/',
+        views.AutocompleteView.as_view(),
+        name='autocomplete',
+    ),
+    path(
+        'v1/async/titles/',
+        async_views.title_list,
+        name='async-titles-list',
+    ),
+    path(
+        'v1/async/titles/<int:title_id>/',
+        async_views.title_detail,
+        name='async-titles-detail',
+    ),
+    path(
+        'v1/async/titles/<int:title_id>/reviews/',
+        async_views.review_list,
+        name='async-review-list',
+    ),
+    path(
+        'v1/async/titles/<int:title_id>/reviews/<int:review_id>/comments/',
+        async_views.comment_list,
+        name='async-comment-list',
+    ),
+    path('v1/', include((router.urls, 'api'))),
+]
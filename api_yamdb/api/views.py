@@ -1,11 +1,11 @@
-from typing import Any, Optional, Union
+from typing import Any, List, Optional, Union
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.db import router
 from django.db.models.query import QuerySet
-from django.db.models import Avg
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.functional import cached_property
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import (
     filters,
@@ -15,96 +15,211 @@ from rest_framework import (
     viewsets,
 )
 from rest_framework.decorators import action
-from rest_framework.exceptions import MethodNotAllowed
+from rest_framework.exceptions import (
+    MethodNotAllowed,
+    NotFound,
+    ValidationError,
+)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework_simplejwt.views import TokenObtainPairView
 
-from reviews.models import Categorie, Comment, Genre, Review, Title, User
+from reviews.autocomplete import KINDS, autocomplete_index
+from reviews.exporter import EXPORTS, FORMATS, export_lines, parse_since
+from reviews.models import (
+    Categorie,
+    Comment,
+    Genre,
+    Review,
+    Title,
+    TitleReviewSummary,
+    User,
+)
+from reviews.outbox import enqueue_email
 
-from .filters import TitleFilter
+from .filters import TitleFilter, TitleSearchFilter
 from .pagination import CustomPagination
-from .permissions import IsAdminOrReadOnly, IsOwnerOrReadOnly, IsSelfOrAdmin
+from .permissions import (
+    IsAdmin,
+    IsAdminOrReadOnly,
+    IsOwnerOrReadOnly,
+    IsSelfOrAdmin,
+)
 from .serializers import (
     CatigoriesSerializer,
     CommentsSerializer,
     GenresSerializer,
     MyTokenObtainPairSerializer,
     ReviewsSerializer,
+    SignUpSerializer,
+    TitleBulkSerializer,
+    TitleReviewSummarySerializer,
     TitlesSerializer,
     TitleWriteSerializer,
     UserSerializer,
 )
-from .core import ViewSet
+from .core import (
+    KeysetPaginationMixin,
+    VersionedListMixin,
+    VersionedRetrieveMixin,
+    ViewSet,
+)
 
 
-class ReviewsViewSet(viewsets.ModelViewSet):
+class ReviewsViewSet(
+    KeysetPaginationMixin,
+    VersionedListMixin,
+    VersionedRetrieveMixin,
+    viewsets.ModelViewSet,
+):
     serializer_class = ReviewsSerializer
     permission_classes = (IsOwnerOrReadOnly,)
+    etag_models = (Review, Title, User)
     pagination_class = CustomPagination
 
+    @cached_property
     def title(self: 'ReviewsViewSet') -> Title:
         return get_object_or_404(Title, id=self.kwargs.get('title_id'))
 
     def get_queryset(self: 'ReviewsViewSet') -> QuerySet[Review]:
-        return Review.objects.filter(title=self.title())
+        return Review.objects.filter(title=self.title)
 
     def perform_create(
         self: 'ReviewsViewSet',
         serializer: serializers.ModelSerializer,
     ) -> None:
-        serializer.save(author=self.request.user, title=self.title())
+        serializer.save(author=self.request.user, title=self.title)
 
 
-class TitlesViewSet(viewsets.ModelViewSet):
-    queryset = Title.objects.all().annotate(Avg('reviews__score'))
+class TitlesViewSet(
+    VersionedListMixin,
+    VersionedRetrieveMixin,
+    viewsets.ModelViewSet,
+):
+    queryset = Title.objects.select_related('category').prefetch_related(
+        'genre',
+    )
     permission_classes = (IsAdminOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
+    cache_models = etag_models = (
+        Title,
+        Title.genre.through,
+        Categorie,
+        Genre,
+    )
+    filter_backends = (
+        DjangoFilterBackend,
+        TitleSearchFilter,
+        filters.OrderingFilter,
+    )
     filterset_class = TitleFilter
     pagination_class = CustomPagination
-    search_fields = ('title_id',)
 
     def get_serializer_class(
         self: 'TitlesViewSet',
     ) -> serializers.ModelSerializer:
         if self.action in ('list', 'retrieve'):
             return TitlesSerializer
+        if self.action == 'bulk':
+            return TitleBulkSerializer
         return TitleWriteSerializer
 
+    @action(detail=False, methods=['post'])
+    def bulk(self: 'TitlesViewSet', request: Request) -> Response:
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True)
+    def summary(self: 'TitlesViewSet', request: Request, pk: str) -> Response:
+        """Гистограмма оценок и последние отзывы из ``TitleReviewSummary``.
 
-class CommentsViewSet(viewsets.ModelViewSet):
+        Два запроса при любом числе отзывов: строка сводки и последние
+        отзывы. Сводка, которой ещё нет, пересчитывается один раз.
+        """
+        try:
+            title_id = int(pk)
+        except ValueError:
+            raise NotFound
+        summaries = TitleReviewSummary.objects.select_related(
+            'title',
+        ).filter(title_id=title_id)
+        summary = summaries.first()
+        if summary is None:
+            get_object_or_404(Title, pk=title_id)
+            TitleReviewSummary.objects.rebuild([title_id])
+            # Реплика могла ещё не получить пересчитанную сводку.
+            summary = summaries.using(
+                router.db_for_write(TitleReviewSummary),
+            ).first()
+        return Response(
+            TitleReviewSummarySerializer(
+                summary,
+                context=self.get_serializer_context(),
+            ).data,
+        )
+
+
+class CommentsViewSet(
+    KeysetPaginationMixin,
+    VersionedListMixin,
+    VersionedRetrieveMixin,
+    viewsets.ModelViewSet,
+):
     serializer_class = CommentsSerializer
     permission_classes = (IsOwnerOrReadOnly,)
+    etag_models = (Comment, Review, Title, User)
     pagination_class = CustomPagination
 
+    @cached_property
     def review(self: 'CommentsViewSet') -> Review:
-        return get_object_or_404(Review, id=self.kwargs.get('review_id'))
+        return get_object_or_404(
+            Review,
+            id=self.kwargs.get('review_id'),
+            title_id=self.kwargs.get('title_id'),
+        )
 
     def get_queryset(self: 'CommentsViewSet') -> QuerySet[Comment]:
-        return self.review().comment.all()
+        return Comment.objects.filter(
+            review_id=self.kwargs.get('review_id'),
+            review__title_id=self.kwargs.get('title_id'),
+        ).select_related('author')
+
+    def paginate_queryset(
+        self: 'CommentsViewSet',
+        queryset: QuerySet[Comment],
+    ) -> Optional[List[Comment]]:
+        page = super().paginate_queryset(queryset)
+        if not page:
+            # Пустая страница: отзыва может не быть, тогда ответ 404.
+            self.review
+        return page
 
     def perform_create(
         self: 'CommentsViewSet',
         serializer: serializers.ModelSerializer,
     ) -> None:
-        serializer.save(author=self.request.user, review=self.review())
+        serializer.save(author=self.request.user, review=self.review)
 
 
-class CategoriesViewSet(ViewSet):
+class CategoriesViewSet(VersionedListMixin, ViewSet):
     queryset = Categorie.objects.all()
     serializer_class = CatigoriesSerializer
     permission_classes = (IsAdminOrReadOnly,)
+    cache_models = etag_models = (Categorie,)
     pagination_class = CustomPagination
     filter_backends = [filters.SearchFilter]
     search_fields = ('name',)
     lookup_field = 'slug'
 
 
-class GenresViewSet(ViewSet):
+class GenresViewSet(VersionedListMixin, ViewSet):
     queryset = Genre.objects.all()
     serializer_class = GenresSerializer
     permission_classes = (IsAdminOrReadOnly,)
+    cache_models = etag_models = (Genre,)
     pagination_class = CustomPagination
     filter_backends = [filters.SearchFilter]
     search_fields = ('name',)
@@ -112,7 +227,7 @@ class GenresViewSet(ViewSet):
 
 
 class SignUpViewSet(generics.CreateAPIView):
-    serializer_class = UserSerializer
+    serializer_class = SignUpSerializer
 
     def create(
         self: 'SignUpViewSet',
@@ -120,35 +235,15 @@ class SignUpViewSet(generics.CreateAPIView):
         *args: Any,
         **kwargs: Any,
     ) -> Response:
-        username = request.data.get('username')
-        email = request.data.get('email')
-
-        try:
-            user = User.objects.get(username=username, email=email)
-            confirmation_code = user.generate_confirmation_code()
-            user.save()
-        except User.DoesNotExist:
-            serializer = self.get_serializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            user = User.objects.create(username=username, email=email)
-            confirmation_code = user.generate_confirmation_code()
-            user.save()
-
-        send_mail(
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.save()
+        enqueue_email(
             'Код подверждения.',
-            f'Ваш код подверждения: {confirmation_code}',
-            settings.EMAIL_FROM,
-            [user.email],
-            fail_silently=False,
-        )
-
-        return Response(
-            {
-                'email': user.email,
-                'username': user.username,
-            },
-            status=status.HTTP_200_OK,
+            f'Ваш код подверждения: {user.confirmation_code}',
+            user.email,
         )
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 class MyTokenObtainPairView(TokenObtainPairView):
@@ -258,19 +353,115 @@ class UserViewSet(viewsets.ModelViewSet):
         if request.method == 'DELETE':
             raise MethodNotAllowed('DELETE')
         if request.user.is_authenticated:
+            # В request.user только поля из токена, профиль читаем из базы.
+            user = get_object_or_404(User, pk=request.user.pk)
             if request.method == 'PATCH':
                 serializer = self.get_serializer(
                     data=request.data,
-                    instance=request.user,
+                    instance=user,
                     partial=True,
                     context={'change_self': True},
                 )
                 serializer.is_valid(raise_exception=True)
                 serializer.save()
                 return Response(serializer.data)
-            serializer = self.get_serializer(request.user)
+            serializer = self.get_serializer(user)
             return Response(serializer.data)
         return Response(
             {'detail': 'Пользователь не авторизован.'},
             status=status.HTTP_401_UNAUTHORIZED,
         )
+
+
+class ExportView(APIView):
+    permission_classes = (IsAdmin,)
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+    }
+
+    def get(
+        self: 'ExportView',
+        request: Request,
+        table: str,
+    ) -> StreamingHttpResponse:
+        if table not in EXPORTS:
+            raise ValidationError(
+                {'table': f'Доступные таблицы: {", ".join(sorted(EXPORTS))}.'},
+            )
+        output = request.query_params.get('output', 'csv')
+        if output not in FORMATS:
+            raise ValidationError(
+                {'output': f'Доступные форматы: {", ".join(FORMATS)}.'},
+            )
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = parse_since(since)
+            except ValueError:
+                raise ValidationError(
+                    {
+                        'since': (
+                            'Укажите дату или дату и время в формате '
+                            'ISO 8601.'
+                        ),
+                    },
+                )
+        response = StreamingHttpResponse(
+            export_lines(table, output=output, since=since),
+            content_type=self.content_types[output],
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{table}.{output}"'
+        )
+        return response
+
+
+class AutocompleteView(APIView):
+    """Подсказки по началу слова в названиях без обращения к базе."""
+
+    default_limit = 10
+
+    def get(self: 'AutocompleteView', request: Request) -> Response:
+        query = request.query_params.get('q', '')
+        try:
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            raise ValidationError({'limit': 'Укажите целое число.'})
+        if not 0 < limit <= settings.AUTOCOMPLETE_MAX_LIMIT:
+            raise ValidationError(
+                {
+                    'limit': (
+                        'Допустимы значения от 1 до '
+                        f'{settings.AUTOCOMPLETE_MAX_LIMIT}.'
+                    ),
+                },
+            )
+        kinds = tuple(
+            kind
+            for kind in request.query_params.get('type', '').split(',')
+            if kind
+        ) or tuple(KINDS)
+        unknown = set(kinds) - KINDS.keys()
+        if unknown:
+            raise ValidationError(
+                {'type': f'Доступные типы: {", ".join(KINDS)}.'},
+            )
+        return Response(
+            [
+                {
+                    'type': suggestion.kind,
+                    'name': suggestion.name,
+                    ('id' if suggestion.kind == 'title' else 'slug'): (
+                        int(suggestion.lookup)
+                        if suggestion.kind == 'title'
+                        else suggestion.lookup
+                    ),
+                }
+                for suggestion in autocomplete_index.suggest(
+                    query,
+                    limit,
+                    kinds,
+                )
+            ],
+        )
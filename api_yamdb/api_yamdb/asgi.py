@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_yamdb.settings')
 
 application = get_asgi_application()
+
+from api.metrics import remove_dead_files  # noqa: E402
+from reviews.autocomplete import warm_up  # noqa: E402
+
+remove_dead_files()
+warm_up()
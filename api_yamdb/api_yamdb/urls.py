@@ -2,6 +2,7 @@ from django.contrib import admin
 from django.urls import include, path
 from django.views.generic import TemplateView
 
+from api.metrics import metrics_view
 from api.views import MyTokenObtainPairView, SignUpViewSet
 
 urlpatterns = [
@@ -18,4 +19,5 @@ urlpatterns = [
         name='token_obtain_pair',
     ),
     path('api/', include('api.urls'), name='api'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_yamdb.settings')
 
 application = get_wsgi_application()
+
+from api.metrics import remove_dead_files  # noqa: E402
+from reviews.autocomplete import warm_up  # noqa: E402
+
+remove_dead_files()
+warm_up()
@@ -1,8 +1,9 @@
 from django.contrib import admin
 
-from .models import Categorie, Genre, Title, Review
+from .models import Categorie, Genre, OutboxEmail, Title, Review
 
 admin.site.register(Title)
 admin.site.register(Genre)
 admin.site.register(Categorie)
 admin.site.register(Review)
+admin.site.register(OutboxEmail)
@@ -0,0 +1,164 @@
+"""Автодополнение названий произведений, жанров и категорий.
+
+Названия хранятся в памяти процесса в отсортированном списке ключей:
+ключ - название, начиная с каждого слова, так что «ор» находит
+«Крепкий орешек». Поиск по префиксу - это ``bisect`` и просмотр соседних
+ключей, база при этом не читается. Список строится при старте процесса
+(``warm_up``) или при первом обращении, обновляется сигналами
+(``reviews.signals``) и перестраивается, если названия изменил другой
+процесс: сигналы и ``load_csv`` меняют версию области ``VERSION_SCOPE``.
+"""
+from bisect import bisect_left, insort
+from typing import Callable, Dict, List, NamedTuple, Tuple, Type
+
+from django.db import DatabaseError, models
+
+from .models import Categorie, Genre, Title
+from .search import tokenize
+from .versions import ProcessIndex, bump_versions
+
+VERSION_SCOPE = 'autocomplete'
+KINDS: Dict[str, Type[models.Model]] = {
+    'title': Title,
+    'genre': Genre,
+    'category': Categorie,
+}
+KIND_BY_MODEL = {model: kind for kind, model in KINDS.items()}
+# Сколько совпадений по префиксу просматривается для ранжирования.
+SCAN_FACTOR = 10
+
+
+class Suggestion(NamedTuple):
+    kind: str
+    name: str
+    lookup: str
+    position: int
+
+
+def keys_for(name: str) -> List[Tuple[str, int]]:
+    words = tokenize(name)
+    return [(' '.join(words[idx:]), idx) for idx in range(len(words))]
+
+
+class PrefixIndex(ProcessIndex):
+    """Отсортированный список ``(ключ, позиция слова, тип, pk)``.
+
+    ``names`` хранит для каждой пары ``(тип, pk)`` название и значение
+    для ссылки на объект: ``id`` произведения или ``slug`` жанра и
+    категории.
+    """
+
+    version_sources = (VERSION_SCOPE,)
+
+    def __init__(self: 'PrefixIndex') -> None:
+        super().__init__()
+        self.entries: List[Tuple[str, int, str, int]] = []
+        self.names: Dict[Tuple[str, int], Tuple[str, str]] = {}
+
+    def load(self: 'PrefixIndex') -> Callable[[], None]:
+        names = {}
+        for kind, model in KINDS.items():
+            lookup = 'pk' if model is Title else 'slug'
+            for pk, name, value in model.objects.values_list(
+                'pk',
+                'name',
+                lookup,
+            ).iterator():
+                names[kind, pk] = (name, str(value))
+        entries = sorted(
+            (key, position, kind, pk)
+            for (kind, pk), (name, _) in names.items()
+            for key, position in keys_for(name)
+        )
+
+        def replace() -> None:
+            self.entries = entries
+            self.names = names
+
+        return replace
+
+    def update(self: 'PrefixIndex', instance: models.Model) -> None:
+        if not self.built:
+            return
+        kind = KIND_BY_MODEL[type(instance)]
+        lookup = instance.pk if kind == 'title' else instance.slug
+        with self.lock:
+            self.discard(kind, instance.pk)
+            self.names[kind, instance.pk] = (instance.name, str(lookup))
+            for key, position in keys_for(instance.name):
+                insort(self.entries, (key, position, kind, instance.pk))
+        self.changed()
+
+    def remove(self: 'PrefixIndex', instance: models.Model) -> None:
+        if not self.built:
+            return
+        with self.lock:
+            self.discard(KIND_BY_MODEL[type(instance)], instance.pk)
+        self.changed()
+
+    def discard(self: 'PrefixIndex', kind: str, pk: int) -> None:
+        old = self.names.pop((kind, pk), None)
+        if old is None:
+            return
+        for key, position in keys_for(old[0]):
+            idx = bisect_left(self.entries, (key, position, kind, pk))
+            if (
+                idx < len(self.entries)
+                and self.entries[idx] == (key, position, kind, pk)
+            ):
+                del self.entries[idx]
+
+    def suggest(
+        self: 'PrefixIndex',
+        query: str,
+        limit: int,
+        kinds: Tuple[str, ...] = tuple(KINDS),
+    ) -> List[Suggestion]:
+        """Названия, в которых какое-либо слово начинается с ``query``.
+
+        Выше стоят совпадения с начала названия, затем более короткие
+        названия. Ранжируются только первые ``limit * SCAN_FACTOR``
+        совпадений в порядке ключей.
+        """
+        prefix = ' '.join(tokenize(query))
+        if not prefix:
+            return []
+        self.ensure_current()
+        best: Dict[Tuple[str, int], int] = {}
+        with self.lock:
+            idx = bisect_left(self.entries, (prefix,))
+            scanned = 0
+            while (
+                idx < len(self.entries)
+                and scanned < limit * SCAN_FACTOR
+                and self.entries[idx][0].startswith(prefix)
+            ):
+                _, position, kind, pk = self.entries[idx]
+                idx += 1
+                if kind not in kinds:
+                    continue
+                scanned += 1
+                if position < best.get((kind, pk), position + 1):
+                    best[kind, pk] = position
+            found = [
+                Suggestion(kind, *self.names[kind, pk], position)
+                for (kind, pk), position in best.items()
+            ]
+        found.sort(key=lambda item: (item.position, len(item.name), item.name))
+        return found[:limit]
+
+
+autocomplete_index = PrefixIndex()
+
+
+def names_changed() -> None:
+    """Сообщает индексам других процессов, что названия изменились."""
+    bump_versions([VERSION_SCOPE])
+
+
+def warm_up() -> None:
+    """Строит индекс при старте процесса, если таблицы уже созданы."""
+    try:
+        autocomplete_index.rebuild()
+    except DatabaseError:
+        pass
@@ -0,0 +1,209 @@
+"""Настройка соединений с базой данных.
+
+SQLite получает прагмы из ``SQLITE_PRAGMAS`` при каждом новом
+соединении: журнал WAL позволяет читать во время записи, а
+``synchronous=normal`` в режиме WAL безопасен и заметно ускоряет
+коммиты.
+
+В Django 3.2 нет ``CONN_HEALTH_CHECKS`` (появился в 4.1), поэтому при
+``DB_CONN_HEALTH_CHECKS`` постоянные соединения (``CONN_MAX_AGE > 0``)
+проверяются в начале запроса и закрываются, если сервер их разорвал.
+
+Реплики (``DATABASE_REPLICAS``) обслуживают только чтение в безопасных
+HTTP-запросах: ``ReplicaRoutingMiddleware`` разрешает его, а
+``PrimaryReplicaRouter`` выбирает реплику. Всё остальное - запись,
+небезопасные запросы, команды управления - идёт в ``default``. После
+своей записи пользователь ``REPLICA_STICKY_SECONDS`` читает с основной
+базы, чтобы не увидеть данные до собственной правки. Закрепление
+хранится в общем кеше ``shared`` и видно всем воркерам.
+"""
+import asyncio
+import random
+import time
+from contextvars import ContextVar
+from hashlib import md5
+from typing import Any, Callable, Dict, Optional, Type
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import BaseCache, caches
+from django.core.signals import request_started
+from django.db import DEFAULT_DB_ALIAS, connections, models
+from django.db.backends.base.base import BaseDatabaseWrapper
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpRequest, HttpResponse
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+PIN_KEY_PREFIX = 'primary-pin:'
+SHARED_CACHE_ALIAS = 'shared'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+replica_reads: ContextVar[bool] = ContextVar('replica_reads', default=False)
+
+
+@receiver(connection_created)
+def set_sqlite_pragmas(
+    sender: Any,
+    connection: BaseDatabaseWrapper,
+    **kwargs: Any,
+) -> None:
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(request_started)
+def close_broken_connections(sender: Any, **kwargs: Any) -> None:
+    if not settings.DB_CONN_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if (
+            connection.connection is not None
+            and connection.settings_dict['CONN_MAX_AGE']
+            and not connection.in_atomic_block
+            and not connection.is_usable()
+        ):
+            connection.close()
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(
+        self: 'PrimaryReplicaRouter',
+        model: Type[models.Model],
+        **hints: Any,
+    ) -> Optional[str]:
+        if replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(
+        self: 'PrimaryReplicaRouter',
+        model: Type[models.Model],
+        **hints: Any,
+    ) -> str:
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(
+        self: 'PrimaryReplicaRouter',
+        obj1: models.Model,
+        obj2: models.Model,
+        **hints: Any,
+    ) -> bool:
+        return True
+
+    def allow_migrate(
+        self: 'PrimaryReplicaRouter',
+        db: str,
+        app_label: str,
+        **hints: Any,
+    ) -> bool:
+        return db == DEFAULT_DB_ALIAS
+
+
+def shared_cache() -> BaseCache:
+    return caches[SHARED_CACHE_ALIAS]
+
+
+def pin_key(request: HttpRequest) -> str:
+    """Ключ закрепления клиента за основной базой.
+
+    Клиент - пользователь из JWT, чтобы закрепление переживало
+    обновление токена, а без токена - сессия или IP-адрес. Токен только
+    проверяется по подписи, без запросов к базе.
+    """
+    try:
+        client = f'user:{token_user_id(request)}'
+    except (KeyError, TokenError):
+        session = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if session:
+            client = f'session:{session}'
+        else:
+            client = f'ip:{request.META.get("REMOTE_ADDR", "")}'
+    return PIN_KEY_PREFIX + md5(client.encode()).hexdigest()
+
+
+def token_user_id(request: HttpRequest) -> Any:
+    authorization = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(authorization) != 2 or authorization[0] not in (
+        jwt_settings.AUTH_HEADER_TYPES
+    ):
+        raise KeyError('HTTP_AUTHORIZATION')
+    return AccessToken(authorization[1])[jwt_settings.USER_ID_CLAIM]
+
+
+class ReplicaRoutingMiddleware:
+    """Разрешает чтение с реплик в безопасных запросах.
+
+    Работает и под WSGI, и под ASGI: в асинхронной цепочке middleware
+    запрос не переключается в поток ради синхронного ``__call__``.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(
+        self: 'ReplicaRoutingMiddleware',
+        get_response: Callable[[HttpRequest], Any],
+    ) -> None:
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(
+        self: 'ReplicaRoutingMiddleware',
+        request: HttpRequest,
+    ) -> Any:
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.acall(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = pin_key(request)
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            shared_cache().set(key, True, settings.REPLICA_STICKY_SECONDS)
+            return response
+        token = replica_reads.set(not shared_cache().get(key))
+        try:
+            return self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+    async def acall(
+        self: 'ReplicaRoutingMiddleware',
+        request: HttpRequest,
+    ) -> HttpResponse:
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        key = pin_key(request)
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            await sync_to_async(shared_cache().set)(
+                key,
+                True,
+                settings.REPLICA_STICKY_SECONDS,
+            )
+            return response
+        pinned = await sync_to_async(shared_cache().get)(key)
+        token = replica_reads.set(not pinned)
+        try:
+            return await self.get_response(request)
+        finally:
+            replica_reads.reset(token)
+
+
+def may_be_stale(versions: Dict[str, int]) -> bool:
+    """Прочитанное с реплики могло отстать от записей с такими версиями.
+
+    Пока последняя запись моложе ``REPLICA_STICKY_SECONDS``, ответ с
+    реплики не кешируется и не получает ``ETag``, иначе устаревшие
+    данные закрепились бы под новой версией.
+    """
+    if not (replica_reads.get() and settings.DATABASE_REPLICAS and versions):
+        return False
+    age = time.time_ns() - max(versions.values())
+    return age < settings.REPLICA_STICKY_SECONDS * 10 ** 9
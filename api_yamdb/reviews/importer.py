@@ -0,0 +1,590 @@
+"""Импорт CSV-выгрузок из static/data.
+
+Строки читаются потоково, а разбор и проверка значений по ограничениям
+полей моделей выполняются пачками в пуле процессов. Запись идёт в
+основном процессе в порядке зависимостей таблиц: через ``bulk_create``
+либо через ``executemany`` без создания экземпляров моделей. Строка,
+не прошедшая проверку, отбрасывается и попадает в отчёт, не прерывая
+загрузку остальных.
+"""
+import csv
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from pathlib import Path
+from typing import (
+    Any,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+)
+
+import django
+from django.apps import apps
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.db import (
+    DEFAULT_DB_ALIAS,
+    IntegrityError,
+    connection,
+    connections,
+    models,
+    transaction,
+)
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+from .versions import bump_versions
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class CsvTable(NamedTuple):
+    filename: str
+    model_label: str
+    columns: Dict[str, str]
+    references: Dict[str, str]
+
+    @property
+    def model(self: 'CsvTable') -> Type[models.Model]:
+        return apps.get_model(self.model_label)
+
+
+class Rejected(NamedTuple):
+    filename: str
+    line: int
+    reason: str
+
+
+class TableReport(NamedTuple):
+    filename: str
+    loaded: int
+    rejected: int
+    seconds: float
+
+    @property
+    def rows_per_second(self: 'TableReport') -> float:
+        return self.loaded / self.seconds if self.seconds else 0.0
+
+
+TABLES = (
+    CsvTable(
+        'users.csv',
+        'reviews.User',
+        {
+            'id': 'id',
+            'username': 'username',
+            'email': 'email',
+            'role': 'role',
+            'bio': 'bio',
+            'first_name': 'first_name',
+            'last_name': 'last_name',
+        },
+        {},
+    ),
+    CsvTable(
+        'category.csv',
+        'reviews.Categorie',
+        {'id': 'id', 'name': 'name', 'slug': 'slug'},
+        {},
+    ),
+    CsvTable(
+        'genre.csv',
+        'reviews.Genre',
+        {'id': 'id', 'name': 'name', 'slug': 'slug'},
+        {},
+    ),
+    CsvTable(
+        'titles.csv',
+        'reviews.Title',
+        {
+            'id': 'id',
+            'name': 'name',
+            'year': 'year',
+            'categories_id': 'category_id',
+        },
+        {'category_id': 'reviews.Categorie'},
+    ),
+    CsvTable(
+        'genre_title.csv',
+        'reviews.Title_genre',
+        {'id': 'id', 'title_id': 'title_id', 'genre_id': 'genre_id'},
+        {'title_id': 'reviews.Title', 'genre_id': 'reviews.Genre'},
+    ),
+    CsvTable(
+        'review.csv',
+        'reviews.Review',
+        {
+            'id': 'id',
+            'title_id': 'title_id',
+            'text': 'text',
+            'author': 'author_id',
+            'score': 'score',
+            'pub_date': 'pub_date',
+        },
+        {'title_id': 'reviews.Title', 'author_id': 'reviews.User'},
+    ),
+    CsvTable(
+        'comments.csv',
+        'reviews.Comment',
+        {
+            'id': 'id',
+            'review_id': 'review_id',
+            'text': 'text',
+            'author': 'author_id',
+            'pub_date': 'pub_date',
+        },
+        {'review_id': 'reviews.Review', 'author_id': 'reviews.User'},
+    ),
+)
+TABLES_BY_FILENAME = {table.filename: table for table in TABLES}
+
+
+def batched(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def numbered(reader: Any) -> Iterator[Tuple[int, List[str]]]:
+    start = reader.line_num + 1
+    for row in reader:
+        yield start, row
+        start = reader.line_num + 1
+
+
+@contextmanager
+def keep_auto_now_values(model: Type[models.Model]) -> Iterator[None]:
+    """Не даёт auto_now_add затереть даты, пришедшие из CSV."""
+    fields = [
+        field
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now_add', False)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def init_worker() -> None:
+    if not apps.ready:
+        django.setup()
+
+
+def convert_chunk(
+    filename: str,
+    positions: List[int],
+    rows: List[Tuple[int, List[str]]],
+    prepare: bool,
+) -> Tuple[List[Tuple[Any, ...]], List[Rejected]]:
+    """Приводит строки CSV к значениям полей и проверяет их валидаторами.
+
+    Выполняется в процессе пула. Номера столбцов ``positions`` считает
+    основной процесс по заголовку файла. При ``prepare`` значения сразу
+    переводятся в формат базы данных для ``executemany``.
+    """
+    table = TABLES_BY_FILENAME[filename]
+    fields = [
+        table.model._meta.get_field(attname)
+        for attname in table.columns.values()
+    ]
+    db = connections[DEFAULT_DB_ALIAS] if prepare else None
+    converted = []
+    rejected = []
+    for line, row in rows:
+        try:
+            values = tuple(
+                convert_value(field, row[position], db)
+                for field, position in zip(fields, positions)
+            )
+        except (IndexError, ValidationError) as error:
+            rejected.append(Rejected(filename, line, describe(error)))
+            continue
+        converted.append((line, values))
+    return converted, rejected
+
+
+def convert_value(
+    field: models.Field,
+    raw: str,
+    db: Optional[BaseDatabaseWrapper],
+) -> Any:
+    if raw == '' and field.null:
+        value = None
+    else:
+        value = field.to_python(raw)
+        if value in field.empty_values and not field.blank:
+            raise ValidationError(f'{field.attname}: пустое значение')
+        if value is None:
+            raise ValidationError(f'{field.attname}: пустое значение')
+        field.run_validators(value)
+        if field.choices and value not in dict(field.flatchoices):
+            raise ValidationError(
+                f'{field.attname}: недопустимое значение {value!r}',
+            )
+    if db is not None:
+        return field.get_db_prep_save(value, db)
+    return value
+
+
+def key_value(values: Tuple[Any, ...], positions: List[int]) -> Any:
+    if len(positions) == 1:
+        return values[positions[0]]
+    return tuple(values[position] for position in positions)
+
+
+def describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return '; '.join(error.messages)
+    return 'неверное количество столбцов'
+
+
+class CsvImporter:
+    def __init__(
+        self: 'CsvImporter',
+        path: Path,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = 0,
+        fast: bool = False,
+    ) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.workers = workers
+        self.fast = fast
+        self.rejected: List[Rejected] = []
+        self.reports: List[TableReport] = []
+        self.known_ids: Dict[str, Set[Any]] = {}
+        self.unique_keys: Dict[Tuple[str, Tuple[str, ...]], Set[Any]] = {}
+
+    def missing_files(self: 'CsvImporter') -> List[str]:
+        return [
+            table.filename
+            for table in TABLES
+            if not (self.path / table.filename).is_file()
+        ]
+
+    def missing_columns(self: 'CsvImporter') -> Dict[str, List[str]]:
+        missing = {}
+        for table in TABLES:
+            header = self.read_header(table)
+            absent = [
+                column for column in table.columns if column not in header
+            ]
+            if absent:
+                missing[table.filename] = absent
+        return missing
+
+    def read_header(self: 'CsvImporter', table: CsvTable) -> List[str]:
+        with open(
+            self.path / table.filename,
+            encoding='utf-8',
+            newline='',
+        ) as csv_file:
+            return next(csv.reader(csv_file), [])
+
+    def run(self: 'CsvImporter') -> List[TableReport]:
+        executor = (
+            ProcessPoolExecutor(self.workers, initializer=init_worker)
+            if self.workers > 1
+            else None
+        )
+        try:
+            with transaction.atomic():
+                for table in TABLES:
+                    self.reports.append(self.load_table(table, executor))
+                self.reset_sequences()
+                apps.get_model('reviews.Title').objects.rebuild_ratings()
+                apps.get_model(
+                    'reviews.TitleReviewSummary',
+                ).objects.rebuild()
+                self.refresh_indexes()
+                bump_versions(table.model for table in TABLES)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return self.reports
+
+    @staticmethod
+    def refresh_indexes() -> None:
+        # Модели импортируются только после django.setup() в процессах
+        # пула, поэтому индексы подключаются здесь, а не на уровне модуля.
+        from .autocomplete import names_changed
+        from .search import documents_changed, search_index
+
+        search_index().rebuild()
+        documents_changed()
+        names_changed()
+
+    def load_table(
+        self: 'CsvImporter',
+        table: CsvTable,
+        executor: Optional[Executor],
+    ) -> TableReport:
+        started = time.perf_counter()
+        rejected_before = len(self.rejected)
+        loaded = 0
+        for rows in self.converted_chunks(table, executor):
+            loaded += self.write(table, self.check_rows(table, rows))
+        return TableReport(
+            table.filename,
+            loaded,
+            len(self.rejected) - rejected_before,
+            time.perf_counter() - started,
+        )
+
+    def converted_chunks(
+        self: 'CsvImporter',
+        table: CsvTable,
+        executor: Optional[Executor],
+    ) -> Iterator[List[Tuple[int, Tuple[Any, ...]]]]:
+        with open(
+            self.path / table.filename,
+            encoding='utf-8',
+            newline='',
+        ) as csv_file:
+            reader = csv.reader(csv_file)
+            header = next(reader, [])
+            positions = [header.index(column) for column in table.columns]
+            rows = numbered(reader)
+            pending: Deque[Future] = deque()
+            for chunk in batched(rows, self.batch_size):
+                if executor is None:
+                    yield self.collect(
+                        convert_chunk(
+                            table.filename,
+                            positions,
+                            chunk,
+                            self.fast,
+                        ),
+                    )
+                    continue
+                pending.append(
+                    executor.submit(
+                        convert_chunk,
+                        table.filename,
+                        positions,
+                        chunk,
+                        self.fast,
+                    ),
+                )
+                if len(pending) > self.workers * 2:
+                    yield self.collect(pending.popleft().result())
+            while pending:
+                yield self.collect(pending.popleft().result())
+
+    def collect(
+        self: 'CsvImporter',
+        result: Tuple[List[Tuple[int, Tuple[Any, ...]]], List[Rejected]],
+    ) -> List[Tuple[int, Tuple[Any, ...]]]:
+        converted, rejected = result
+        self.rejected.extend(rejected)
+        return converted
+
+    def check_rows(
+        self: 'CsvImporter',
+        table: CsvTable,
+        rows: List[Tuple[int, Tuple[Any, ...]]],
+    ) -> List[Tuple[int, Tuple[Any, ...]]]:
+        """Проверяет внешние ключи и уникальность по id в памяти.
+
+        Ключи записанных строк попадают в общие наборы только в
+        ``record``: внешние ключи проверяются при COMMIT, и id строки,
+        которую не удалось вставить, не должен пропустить ссылки на неё.
+        Повторы внутри пачки ловят её собственные наборы.
+        """
+        attnames = list(table.columns.values())
+        references = [
+            (attnames.index(attname), self.ids_of(label))
+            for attname, label in table.references.items()
+        ]
+        unique_keys = [
+            (positions, seen, set(), key)
+            for positions, seen, key in self.unique_positions(table)
+        ]
+        accepted = []
+        for line, values in rows:
+            reason = self.reject_reason(values, references, unique_keys)
+            if reason:
+                self.rejected.append(Rejected(table.filename, line, reason))
+                continue
+            for positions, _, pending, _ in unique_keys:
+                pending.add(key_value(values, positions))
+            accepted.append((line, values))
+        return accepted
+
+    @staticmethod
+    def reject_reason(
+        values: Tuple[Any, ...],
+        references: List[Tuple[int, Set[Any]]],
+        unique_keys: List[
+            Tuple[List[int], Set[Any], Set[Any], Tuple[str, ...]]
+        ],
+    ) -> Optional[str]:
+        for position, ids in references:
+            if values[position] is not None and values[position] not in ids:
+                return f'нет связанного объекта {values[position]}'
+        for positions, seen, pending, key in unique_keys:
+            value = key_value(values, positions)
+            if value in seen or value in pending:
+                return f'повтор значения {", ".join(key)}'
+        return None
+
+    def unique_positions(
+        self: 'CsvImporter',
+        table: CsvTable,
+    ) -> List[Tuple[List[int], Set[Any], Tuple[str, ...]]]:
+        attnames = list(table.columns.values())
+        return [
+            (
+                [attnames.index(attname) for attname in key],
+                self.seen_values(table, key),
+                key,
+            )
+            for key in self.unique_together(table)
+            if all(attname in attnames for attname in key)
+        ]
+
+    def record(
+        self: 'CsvImporter',
+        table: CsvTable,
+        rows: List[Tuple[Any, ...]],
+    ) -> None:
+        for positions, seen, _ in self.unique_positions(table):
+            seen.update(key_value(values, positions) for values in rows)
+
+    def ids_of(self: 'CsvImporter', label: str) -> Set[Any]:
+        if label not in self.known_ids:
+            model = apps.get_model(label)
+            self.known_ids[label] = set(
+                model.objects.values_list('pk', flat=True),
+            )
+        return self.known_ids[label]
+
+    @staticmethod
+    def unique_together(table: CsvTable) -> List[Tuple[str, ...]]:
+        opts = table.model._meta
+        keys = [
+            (field.attname,)
+            for field in opts.concrete_fields
+            if field.unique
+        ]
+        keys.extend(
+            tuple(opts.get_field(name).attname for name in constraint.fields)
+            for constraint in opts.constraints
+            if isinstance(constraint, models.UniqueConstraint)
+            and constraint.condition is None
+        )
+        keys.extend(
+            tuple(opts.get_field(name).attname for name in fields)
+            for fields in opts.unique_together
+        )
+        return keys
+
+    def seen_values(
+        self: 'CsvImporter',
+        table: CsvTable,
+        key: Tuple[str, ...],
+    ) -> Set[Any]:
+        if key == (table.model._meta.pk.attname,):
+            return self.ids_of(table.model_label)
+        cache_key = (table.model_label, key)
+        if cache_key not in self.unique_keys:
+            self.unique_keys[cache_key] = set(
+                table.model.objects.values_list(*key, flat=len(key) == 1),
+            )
+        return self.unique_keys[cache_key]
+
+    def write(
+        self: 'CsvImporter',
+        table: CsvTable,
+        rows: List[Tuple[int, Tuple[Any, ...]]],
+    ) -> int:
+        if not rows:
+            return 0
+        values_list = [values for _, values in rows]
+        try:
+            with transaction.atomic():
+                self.insert(table, values_list)
+            self.record(table, values_list)
+            return len(rows)
+        except IntegrityError:
+            pass
+        loaded = 0
+        for line, values in rows:
+            try:
+                with transaction.atomic():
+                    self.insert(table, [values])
+            except IntegrityError as error:
+                self.rejected.append(
+                    Rejected(table.filename, line, str(error)),
+                )
+                continue
+            self.record(table, [values])
+            loaded += 1
+        return loaded
+
+    def insert(
+        self: 'CsvImporter',
+        table: CsvTable,
+        rows: List[Tuple[Any, ...]],
+    ) -> None:
+        model = table.model
+        attnames = list(table.columns.values())
+        if self.fast:
+            opts = model._meta
+            fields = [opts.get_field(attname) for attname in attnames]
+            defaults = [
+                field
+                for field in opts.concrete_fields
+                if field not in fields and not field.primary_key
+            ]
+            default_values = tuple(
+                field.get_db_prep_save(field.get_default(), connection)
+                for field in defaults
+            )
+            quote = connection.ops.quote_name
+            columns = ', '.join(
+                quote(field.column) for field in fields + defaults
+            )
+            placeholders = ', '.join(['%s'] * (len(fields) + len(defaults)))
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {quote(opts.db_table)} ({columns}) '
+                    f'VALUES ({placeholders})',
+                    [values + default_values for values in rows],
+                )
+            return
+        with keep_auto_now_values(model):
+            model.objects.bulk_create(
+                [model(**dict(zip(attnames, values))) for values in rows],
+                batch_size=self.batch_size,
+            )
+
+    def reset_sequences(self: 'CsvImporter') -> None:
+        statements = connection.ops.sequence_reset_sql(
+            no_style(),
+            [table.model for table in TABLES],
+        )
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def default_workers() -> int:
+    return os.cpu_count() or 1
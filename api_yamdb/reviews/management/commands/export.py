@@ -0,0 +1,57 @@
+import sys
+from typing import Any
+
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.exporter import (
+    DEFAULT_CHUNK_SIZE,
+    EXPORTS,
+    FORMATS,
+    export_lines,
+    parse_since,
+)
+
+
+class Command(BaseCommand):
+    help = 'Выгружает произведения, отзывы или комментарии в CSV/NDJSON.'
+
+    def add_arguments(self: 'Command', parser: Any) -> None:
+        parser.add_argument('table', choices=sorted(EXPORTS))
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument(
+            '--since',
+            help='Выгрузить только записи с pub_date не раньше даты (ISO).',
+        )
+        parser.add_argument(
+            '--output',
+            help='Файл для выгрузки; по умолчанию stdout.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            default=DEFAULT_CHUNK_SIZE,
+            type=int,
+        )
+
+    def handle(self: 'Command', *args: Any, **options: Any) -> None:
+        since = None
+        if options['since']:
+            try:
+                since = parse_since(options['since'])
+            except ValueError:
+                raise CommandError('--since должен быть датой в формате ISO.')
+        lines = export_lines(
+            options['table'],
+            output=options['format'],
+            since=since,
+            chunk_size=options['chunk_size'],
+        )
+        if not options['output']:
+            sys.stdout.writelines(lines)
+            return
+        with open(
+            options['output'],
+            'w',
+            encoding='utf-8',
+            newline='',
+        ) as export_file:
+            export_file.writelines(lines)
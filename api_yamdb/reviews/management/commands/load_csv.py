@@ -0,0 +1,87 @@
+import csv
+from pathlib import Path
+from typing import Any
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from reviews.importer import DEFAULT_BATCH_SIZE, CsvImporter, default_workers
+
+MAX_REPORTED_REJECTS = 20
+
+
+class Command(BaseCommand):
+    help = 'Загружает данные из CSV-файлов static/data в базу данных.'
+
+    def add_arguments(self: 'Command', parser: Any) -> None:
+        parser.add_argument(
+            '--path',
+            default=settings.BASE_DIR / 'static' / 'data',
+            type=Path,
+            help='Каталог с CSV-файлами.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            default=DEFAULT_BATCH_SIZE,
+            type=int,
+            help='Количество строк в одном INSERT.',
+        )
+        parser.add_argument(
+            '--workers',
+            default=default_workers(),
+            type=int,
+            help='Число процессов для разбора строк; 1 - без пула.',
+        )
+        parser.add_argument(
+            '--fast',
+            action='store_true',
+            help='Писать через executemany, минуя экземпляры моделей.',
+        )
+        parser.add_argument(
+            '--rejects',
+            type=Path,
+            help='CSV-файл для отброшенных строк.',
+        )
+
+    def handle(self: 'Command', *args: Any, **options: Any) -> None:
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        importer = CsvImporter(
+            options['path'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            fast=options['fast'],
+        )
+        missing = importer.missing_files()
+        if missing:
+            raise CommandError(f'Не найдены файлы: {", ".join(missing)}')
+        missing_columns = importer.missing_columns()
+        if missing_columns:
+            raise CommandError(
+                'Не найдены столбцы: '
+                + '; '.join(
+                    f'{filename} - {", ".join(columns)}'
+                    for filename, columns in missing_columns.items()
+                ),
+            )
+
+        for report in importer.run():
+            self.stdout.write(
+                f'{report.filename}: загружено {report.loaded}, '
+                f'отброшено {report.rejected}, '
+                f'{report.rows_per_second:.0f} строк/с',
+            )
+        for rejected in importer.rejected[:MAX_REPORTED_REJECTS]:
+            self.stderr.write(
+                f'{rejected.filename}:{rejected.line}: {rejected.reason}',
+            )
+        if options['rejects']:
+            self.write_rejects(options['rejects'], importer.rejected)
+        self.stdout.write(self.style.SUCCESS('Загрузка завершена.'))
+
+    @staticmethod
+    def write_rejects(path: Path, rejected: list) -> None:
+        with open(path, 'w', encoding='utf-8', newline='') as rejects_file:
+            writer = csv.writer(rejects_file)
+            writer.writerow(('file', 'line', 'reason'))
+            writer.writerows(rejected)
@@ -0,0 +1,22 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from reviews.models import Title, TitleReviewSummary
+from reviews.versions import bump_versions
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает сохранённые рейтинги и сводки отзывов произведений.'
+    )
+
+    def handle(self: 'Command', *args: Any, **options: Any) -> None:
+        with transaction.atomic():
+            updated = Title.objects.rebuild_ratings()
+            TitleReviewSummary.objects.rebuild()
+            bump_versions([Title])
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитано произведений: {updated}'),
+        )
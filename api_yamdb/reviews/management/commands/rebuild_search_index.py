@@ -0,0 +1,22 @@
+from typing import Any
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from reviews.search import documents_changed, search_index
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает полнотекстовый индекс произведений.'
+
+    def handle(self: 'Command', *args: Any, **options: Any) -> None:
+        index = search_index()
+        with transaction.atomic():
+            index.rebuild()
+            # Индексы в памяти других процессов перестроятся сами.
+            documents_changed()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Индекс перестроен: {type(index).__name__}',
+            ),
+        )
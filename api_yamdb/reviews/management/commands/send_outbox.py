@@ -0,0 +1,44 @@
+import time
+from typing import Any
+
+from django.core.management.base import BaseCommand
+
+from reviews.outbox import deliver_outbox
+
+DEFAULT_BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из очереди OutboxEmail.'
+
+    def add_arguments(self: 'Command', parser: Any) -> None:
+        parser.add_argument(
+            '--batch-size',
+            default=DEFAULT_BATCH_SIZE,
+            type=int,
+            help='Сколько писем отправлять через одно соединение.',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Работать постоянно, опрашивая очередь.',
+        )
+        parser.add_argument(
+            '--interval',
+            default=1.0,
+            type=float,
+            help='Пауза между опросами пустой очереди, в секундах.',
+        )
+
+    def handle(self: 'Command', *args: Any, **options: Any) -> None:
+        sent = failed = 0
+        while True:
+            report = deliver_outbox(options['batch_size'])
+            sent += report.sent
+            failed += report.failed
+            if report.sent or report.failed:
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(f'Отправлено писем: {sent}, ошибок: {failed}')
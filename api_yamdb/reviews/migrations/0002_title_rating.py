@@ -0,0 +1,56 @@
+# Generated by Django 3.2 on 2026-10-18 18:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_ratings(apps, schema_editor):
+    Title = apps.get_model('reviews', 'Title')
+    Review = apps.get_model('reviews', 'Review')
+    reviews = Review.objects.filter(title=OuterRef('pk')).order_by()
+    Title.objects.update(
+        rating_sum=Coalesce(
+            Subquery(
+                reviews.values('title').annotate(total=Sum('score'))
+                .values('total'),
+            ),
+            Value(0),
+        ),
+        rating_count=Coalesce(
+            Subquery(
+                reviews.values('title').annotate(total=Count('id'))
+                .values('total'),
+            ),
+            Value(0),
+        ),
+    )
+    Title.objects.filter(rating_count__gt=0).update(
+        rating=models.F('rating_sum') / models.F('rating_count'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='title',
+            name='rating',
+            field=models.PositiveSmallIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='title',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='title',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+from django.db import migrations
+from django.db.utils import OperationalError
+
+
+def create_search_table(apps, schema_editor):
+    """Создаёт таблицу FTS5, если база - SQLite с поддержкой FTS5.
+
+    На других базах таблица не нужна: поиск работает по индексу в памяти.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                'CREATE VIRTUAL TABLE reviews_title_search '
+                'USING fts5(name, description, reviews)',
+            )
+        except OperationalError:
+            return
+        cursor.execute(
+            'INSERT INTO reviews_title_search '
+            '(rowid, name, description, reviews) '
+            "SELECT t.id, t.name, coalesce(t.description, ''), "
+            'coalesce((SELECT group_concat(r.text, char(10)) '
+            'FROM reviews_review r WHERE r.title_id = t.id), '
+            "'') FROM reviews_title t",
+        )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS reviews_title_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0004_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+
+
+def split_search_table(apps, schema_editor):
+    """Выносит тексты отзывов в отдельную таблицу FTS5, строка на отзыв.
+
+    Таблицы ``reviews_title_search`` нет, если FTS5 недоступна: тогда
+    поиск работает по индексу в памяти и миграция ничего не делает.
+    """
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    if 'reviews_title_search' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE reviews_title_search')
+        cursor.execute(
+            'CREATE VIRTUAL TABLE reviews_title_search '
+            'USING fts5(name, description)',
+        )
+        cursor.execute(
+            'CREATE VIRTUAL TABLE reviews_review_search '
+            'USING fts5(text, title_id UNINDEXED)',
+        )
+        cursor.execute(
+            'INSERT INTO reviews_title_search (rowid, name, description) '
+            "SELECT id, name, coalesce(description, '') FROM reviews_title",
+        )
+        cursor.execute(
+            'INSERT INTO reviews_review_search (rowid, text, title_id) '
+            'SELECT id, text, title_id FROM reviews_review',
+        )
+
+
+def merge_search_tables(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    if 'reviews_review_search' not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('DROP TABLE reviews_review_search')
+        cursor.execute('DROP TABLE reviews_title_search')
+        cursor.execute(
+            'CREATE VIRTUAL TABLE reviews_title_search '
+            'USING fts5(name, description, reviews)',
+        )
+        cursor.execute(
+            'INSERT INTO reviews_title_search '
+            '(rowid, name, description, reviews) '
+            "SELECT t.id, t.name, coalesce(t.description, ''), "
+            'coalesce((SELECT group_concat(r.text, char(10)) '
+            'FROM reviews_review r WHERE r.title_id = t.id), '
+            "'') FROM reviews_title t",
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0006_titlereviewsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(split_search_table, merge_search_tables),
+    ]
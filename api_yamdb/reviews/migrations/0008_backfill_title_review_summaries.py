@@ -0,0 +1,73 @@
+# Generated by Django 3.2 on 2026-10-18 19:03
+
+from django.db import migrations
+from django.db.models import Count
+
+# Значения на момент миграции: код моделей и настройки могут измениться.
+SCORES = 10
+LATEST_REVIEWS = 5
+
+
+def fill_summaries(apps, schema_editor):
+    """Заполняет сводки по отзывам, написанным до появления сводок.
+
+    Сводка пересчитывается здесь же, без ``TitleReviewSummaryQuerySet``,
+    чтобы миграция не зависела от текущего кода. Если
+    ``TITLE_SUMMARY_LATEST_REVIEWS`` отличается от ``LATEST_REVIEWS``,
+    списки последних отзывов выровняются при следующих записях.
+    """
+    db = schema_editor.connection.alias
+    Title = apps.get_model('reviews', 'Title')
+    Review = apps.get_model('reviews', 'Review')
+    TitleReviewSummary = apps.get_model('reviews', 'TitleReviewSummary')
+    reviews = Review.objects.using(db).order_by()
+    histograms = {
+        pk: [0] * SCORES
+        for pk in Title.objects.using(db).values_list('pk', flat=True)
+    }
+    latest = {pk: [] for pk in histograms}
+    counts = reviews.values('title_id', 'score').annotate(
+        total=Count('id'),
+    ).values_list('title_id', 'score', 'total')
+    for title_id, score, total in counts:
+        if title_id in histograms and 1 <= score <= SCORES:
+            histograms[title_id][score - 1] += total
+    for title_id, pk in reviews.order_by(
+        'title_id',
+        '-pub_date',
+        '-id',
+    ).values_list('title_id', 'pk').iterator():
+        if title_id in latest and len(latest[title_id]) < LATEST_REVIEWS:
+            latest[title_id].append(pk)
+    summaries = TitleReviewSummary.objects.using(db)
+    summaries.all().delete()
+    summaries.bulk_create(
+        (
+            TitleReviewSummary(
+                title_id=pk,
+                histogram=histogram,
+                latest=latest[pk],
+            )
+            for pk, histogram in histograms.items()
+        ),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0007_review_search'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='titlereviewsummary',
+            name='count',
+        ),
+        migrations.RemoveField(
+            model_name='titlereviewsummary',
+            name='score_sum',
+        ),
+        migrations.RunPython(fill_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,58 @@
+from django.db import migrations
+
+
+def create_search_tables(apps, schema_editor):
+    """Создаёт таблицы поиска с ``tsvector`` и индексами GIN на PostgreSQL.
+
+    На SQLite поиск работает по таблицам FTS5, на остальных базах - по
+    индексу в памяти.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TABLE reviews_title_search ('
+            'title_id integer PRIMARY KEY, document tsvector NOT NULL)',
+        )
+        cursor.execute(
+            'CREATE TABLE reviews_review_search ('
+            'review_id integer PRIMARY KEY, title_id integer NOT NULL, '
+            'document tsvector NOT NULL)',
+        )
+        cursor.execute(
+            'CREATE INDEX reviews_title_search_document '
+            'ON reviews_title_search USING gin (document)',
+        )
+        cursor.execute(
+            'CREATE INDEX reviews_review_search_document '
+            'ON reviews_review_search USING gin (document)',
+        )
+        cursor.execute(
+            'INSERT INTO reviews_title_search (title_id, document) '
+            "SELECT id, setweight(to_tsvector('simple', name), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(description, '')), "
+            "'B') FROM reviews_title",
+        )
+        cursor.execute(
+            'INSERT INTO reviews_review_search '
+            '(review_id, title_id, document) '
+            "SELECT id, title_id, setweight(to_tsvector('simple', text), "
+            "'D') FROM reviews_review",
+        )
+
+
+def drop_search_tables(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP TABLE IF EXISTS reviews_review_search')
+        schema_editor.execute('DROP TABLE IF EXISTS reviews_title_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reviews', '0009_modelversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_tables, drop_search_tables),
+    ]
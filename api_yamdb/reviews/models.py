@@ -1,11 +1,27 @@
 import secrets
-from typing import Any
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Type
 from datetime import datetime
 
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import UniqueConstraint
+from django.db import models, router, transaction
+from django.db.models import (
+    BigIntegerField,
+    Case,
+    Count,
+    F,
+    Func,
+    IntegerField,
+    OuterRef,
+    Subquery,
+    Sum,
+    UniqueConstraint,
+    Value,
+    When,
+)
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -30,6 +46,24 @@ class User(AbstractUser):
     )
     confirmation_code = models.CharField(max_length=12, null=True, blank=True)
 
+    _loaded_username: Optional[str] = None
+
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['role'], name='user_role_idx'),
+        ]
+
+    @classmethod
+    def from_db(
+        cls: Type['User'],
+        db: str,
+        field_names: Iterable[str],
+        values: Iterable[Any],
+    ) -> 'User':
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_username = instance.__dict__.get('username')
+        return instance
+
     @property
     def is_admin(self):
         return self.role == self.ROLE_ADMIN
@@ -38,9 +72,10 @@ class User(AbstractUser):
     def is_moderator(self):
         return self.role == self.ROLE_MODERATOR
 
-    def generate_confirmation_code(self: 'User') -> None:
+    def generate_confirmation_code(self: 'User') -> str:
+        """Задаёт новый код подтверждения, сохранять нужно отдельно."""
         self.confirmation_code = secrets.token_hex(6)
-        self.save()
+        return self.confirmation_code
 
     def save(self: 'User', *args: Any, **kwargs: Any) -> None:
         if self.is_superuser:
@@ -64,6 +99,47 @@ class Genre(models.Model):
         return self.name
 
 
+class TitleQuerySet(models.QuerySet):
+    def apply_review_delta(
+        self: 'TitleQuerySet',
+        score_delta: int,
+        count_delta: int,
+    ) -> int:
+        new_sum = F('rating_sum') + score_delta
+        new_count = F('rating_count') + count_delta
+        return self.update(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating=Case(
+                When(rating_count=-count_delta, then=Value(None)),
+                default=new_sum / new_count,
+                output_field=IntegerField(),
+            ),
+        )
+
+    def rebuild_ratings(self: 'TitleQuerySet') -> int:
+        reviews = Review.objects.filter(title=OuterRef('pk')).order_by()
+        review_sum = reviews.values('title').annotate(total=Sum('score'))
+        review_count = reviews.values('title').annotate(total=Count('id'))
+        self.update(
+            rating_sum=Coalesce(
+                Subquery(review_sum.values('total')),
+                Value(0),
+            ),
+            rating_count=Coalesce(
+                Subquery(review_count.values('total')),
+                Value(0),
+            ),
+        )
+        return self.update(
+            rating=Case(
+                When(rating_count=0, then=Value(None)),
+                default=F('rating_sum') / F('rating_count'),
+                output_field=IntegerField(),
+            ),
+        )
+
+
 class Title(models.Model):
     name = models.CharField(max_length=256)
     year = models.PositiveIntegerField(validators=[MaxValueValidator(
@@ -83,6 +159,25 @@ class Title(models.Model):
         blank=True,
         verbose_name='Описание',
     )
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating = models.PositiveSmallIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    objects = TitleQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['year'], name='title_year_idx'),
+            models.Index(fields=['name'], name='title_name_idx'),
+            models.Index(
+                fields=['category', 'year'],
+                name='title_category_year_idx',
+            ),
+        ]
 
     def __str__(self: 'Title') -> str:
         return self.name
@@ -107,10 +202,29 @@ class Review(models.Model):
     )
     pub_date = models.DateTimeField(auto_now_add=True)
 
+    _loaded_score: Optional[int] = None
+
     class Meta:
         constraints = [
             UniqueConstraint(fields=['author', 'title'], name='unique_review'),
         ]
+        indexes = [
+            models.Index(
+                fields=['title', 'pub_date', 'id'],
+                name='review_title_pub_date_idx',
+            ),
+        ]
+
+    @classmethod
+    def from_db(
+        cls: Type['Review'],
+        db: str,
+        field_names: Iterable[str],
+        values: Iterable[Any],
+    ) -> 'Review':
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_score = instance.__dict__.get('score')
+        return instance
 
     def __str__(self: 'Review') -> str:
         return self.text
@@ -130,5 +244,314 @@ class Comment(models.Model):
     )
     pub_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['review', 'pub_date', 'id'],
+                name='comment_review_pub_date_idx',
+            ),
+        ]
+
     def __str__(self: 'Comment') -> str:
         return self.tex
+
+
+SCORES = range(1, 11)
+
+
+def empty_histogram() -> List[int]:
+    return [0] * len(SCORES)
+
+
+class HistogramDelta(Func):
+    """``histogram`` с прибавленными к столбцам оценок ``deltas``.
+
+    Считается внутри ``UPDATE``, поэтому строку сводки не нужно читать:
+    на SQLite через ``json_set``, на PostgreSQL через ``jsonb_set``.
+    """
+
+    def __init__(
+        self: 'HistogramDelta',
+        deltas: Dict[int, int],
+    ) -> None:
+        super().__init__(F('histogram'), output_field=models.JSONField())
+        self.deltas = {
+            score - 1: delta
+            for score, delta in deltas.items()
+            if delta and score in SCORES
+        }
+
+    def as_sql(
+        self: 'HistogramDelta',
+        compiler: Any,
+        connection: Any,
+        **extra_context: Any,
+    ) -> Tuple[str, List[Any]]:
+        column, params = compiler.compile(self.source_expressions[0])
+        if not self.deltas:
+            return column, params
+        pairs = ', '.join(
+            f"'$[{index}]', json_extract({column}, '$[{index}]') + %s"
+            for index in self.deltas
+        )
+        return (
+            f'json_set({column}, {pairs})',
+            [*params, *self.deltas.values()],
+        )
+
+    def as_postgresql(
+        self: 'HistogramDelta',
+        compiler: Any,
+        connection: Any,
+        **extra_context: Any,
+    ) -> Tuple[str, List[Any]]:
+        column, params = compiler.compile(self.source_expressions[0])
+        sql = column
+        for index in self.deltas:
+            sql = (
+                f"jsonb_set({sql}, '{{{index}}}', "
+                f'to_jsonb(({column} ->> {index})::integer + %s))'
+            )
+        return sql, [*params, *self.deltas.values()]
+
+
+class LatestReviews(Func):
+    """JSON-массив ``id`` последних отзывов произведения, от новых к старым.
+
+    Подзапрос идёт по индексу ``review_title_pub_date_idx`` и читает не
+    больше ``TITLE_SUMMARY_LATEST_REVIEWS`` строк.
+    """
+
+    template = '(SELECT json_group_array(id) FROM %(expressions)s latest)'
+
+    def __init__(self: 'LatestReviews', title_id: int) -> None:
+        super().__init__(
+            Subquery(
+                Review.objects.filter(title_id=title_id).order_by(
+                    '-pub_date',
+                    '-id',
+                ).values('pk', 'pub_date')[
+                    :settings.TITLE_SUMMARY_LATEST_REVIEWS
+                ],
+            ),
+            output_field=models.JSONField(),
+        )
+
+    def as_postgresql(
+        self: 'LatestReviews',
+        compiler: Any,
+        connection: Any,
+        **extra_context: Any,
+    ) -> Tuple[str, List[Any]]:
+        return self.as_sql(
+            compiler,
+            connection,
+            template=(
+                '(SELECT coalesce(jsonb_agg(id ORDER BY pub_date DESC, '
+                "id DESC), '[]') FROM %(expressions)s latest)"
+            ),
+            **extra_context,
+        )
+
+
+class TitleReviewSummaryQuerySet(models.QuerySet):
+    def rebuild(
+        self: 'TitleReviewSummaryQuerySet',
+        title_ids: Optional[Iterable[int]] = None,
+    ) -> int:
+        """Пересчитывает сводки по отзывам, ``None`` - для всех произведений.
+
+        Проходит по всем отзывам произведений, поэтому нужна после
+        загрузок в обход сигналов, а не на каждый запрос. Читает и пишет
+        базу для записи, даже если запрос разрешил чтение с реплики:
+        сводка по устаревшей реплике затёрла бы свежие данные.
+        """
+        db = self._db or router.db_for_write(self.model)
+        titles = Title._base_manager.using(db).order_by()
+        reviews = Review._base_manager.using(db).order_by()
+        summaries = self.using(db)
+        if title_ids is not None:
+            title_ids = list(title_ids)
+            titles = titles.filter(pk__in=title_ids)
+            reviews = reviews.filter(title_id__in=title_ids)
+        histograms = {
+            pk: empty_histogram()
+            for pk in titles.values_list('pk', flat=True)
+        }
+        latest: Dict[int, List[int]] = {pk: [] for pk in histograms}
+        counts = reviews.values('title_id', 'score').annotate(
+            total=Count('id'),
+        ).values_list('title_id', 'score', 'total')
+        for title_id, score, total in counts:
+            if title_id in histograms and score in SCORES:
+                histograms[title_id][score - 1] += total
+        limit = settings.TITLE_SUMMARY_LATEST_REVIEWS
+        for title_id, pk in reviews.order_by(
+            'title_id',
+            '-pub_date',
+            '-id',
+        ).values_list('title_id', 'pk').iterator():
+            if title_id in latest and len(latest[title_id]) < limit:
+                latest[title_id].append(pk)
+        with transaction.atomic(using=db):
+            if title_ids is None:
+                summaries.delete()
+            else:
+                summaries.filter(title_id__in=title_ids).delete()
+            summaries.bulk_create(
+                (
+                    self.model(
+                        title_id=pk,
+                        histogram=histogram,
+                        latest=latest[pk],
+                    )
+                    for pk, histogram in histograms.items()
+                ),
+                batch_size=500,
+                ignore_conflicts=True,
+            )
+        return len(histograms)
+
+    def review_added(
+        self: 'TitleReviewSummaryQuerySet',
+        review: 'Review',
+    ) -> None:
+        self.apply_change(review.title_id, {review.score: 1}, latest=True)
+
+    def review_deleted(
+        self: 'TitleReviewSummaryQuerySet',
+        review: 'Review',
+        score: int,
+    ) -> None:
+        self.apply_change(
+            review.title_id,
+            {score: -1},
+            latest=True,
+            rebuild=False,
+        )
+
+    def score_changed(
+        self: 'TitleReviewSummaryQuerySet',
+        review: 'Review',
+        old_score: int,
+    ) -> None:
+        self.apply_change(review.title_id, {old_score: -1, review.score: 1})
+
+    def apply_change(
+        self: 'TitleReviewSummaryQuerySet',
+        title_id: int,
+        deltas: Dict[int, int],
+        latest: bool = False,
+        rebuild: bool = True,
+    ) -> None:
+        """Обновляет сводку произведения одним ``UPDATE``.
+
+        Гистограмма меняется выражением над самим столбцом, а список
+        последних отзывов перечитывается подзапросом по индексу, так что
+        параллельные записи не затирают друг друга. Если сводки ещё нет,
+        она пересчитывается целиком; при удалении отзыва - нет, потому что
+        вместе с отзывами может удаляться и само произведение.
+        """
+        summaries = self.using(self._db or router.db_for_write(self.model))
+        changes = {'histogram': HistogramDelta(deltas)}
+        if latest:
+            changes['latest'] = LatestReviews(title_id)
+        updated = summaries.filter(title_id=title_id).update(**changes)
+        if not updated and rebuild:
+            summaries.rebuild([title_id])
+
+
+class TitleReviewSummary(models.Model):
+    """Сводка отзывов произведения: гистограмма оценок и последние отзывы.
+
+    ``histogram[i]`` - число отзывов с оценкой ``i + 1``, ``latest`` -
+    ``id`` последних ``TITLE_SUMMARY_LATEST_REVIEWS`` отзывов, от новых к
+    старым. Число отзывов и сумма оценок уже хранятся в
+    ``Title.rating_count`` и ``Title.rating_sum``. Сводка обновляется
+    сигналами отзывов, а строка создаётся вместе с произведением.
+    """
+
+    title = models.OneToOneField(
+        Title,
+        primary_key=True,
+        related_name='review_summary',
+        on_delete=models.CASCADE,
+    )
+    histogram = models.JSONField(default=empty_histogram)
+    latest = models.JSONField(default=list)
+
+    objects = TitleReviewSummaryQuerySet.as_manager()
+
+    def __str__(self: 'TitleReviewSummary') -> str:
+        return f'Сводка отзывов: {self.title_id}'
+
+
+class OutboxEmail(models.Model):
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=254)
+    to = models.EmailField(max_length=254)
+    created = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['sent_at', 'next_attempt_at'],
+                name='outbox_pending_idx',
+            ),
+        ]
+
+    def __str__(self: 'OutboxEmail') -> str:
+        return f'{self.to}: {self.subject}'
+
+
+class ModelVersionQuerySet(models.QuerySet):
+    def current(
+        self: 'ModelVersionQuerySet',
+        keys: List[str],
+    ) -> Dict[str, int]:
+        """Версии ``keys``; у ещё не менявшихся данных версия ``0``."""
+        versions = dict.fromkeys(keys, 0)
+        versions.update(
+            self.filter(key__in=keys).values_list('key', 'version'),
+        )
+        return versions
+
+    def bump(self: 'ModelVersionQuerySet', keys: List[str], now: int) -> None:
+        """Атомарно увеличивает версии ``keys`` не меньше чем до ``now``.
+
+        Недостающие строки сначала вставляются с версией ``0`` и затем
+        увеличиваются тем же ``UPDATE``: если строку одновременно
+        вставил другой запрос, его увеличение не потеряется.
+        """
+        keys = sorted(keys)
+        versions = self.filter(key__in=keys)
+        version = Greatest(
+            F('version') + 1,
+            Value(now, output_field=BigIntegerField()),
+        )
+        if versions.update(version=version) < len(keys):
+            self.bulk_create(
+                [self.model(key=key, version=0) for key in keys],
+                ignore_conflicts=True,
+            )
+            versions.update(version=version)
+
+
+class ModelVersion(models.Model):
+    """Версия данных модели или области для кешей и ``ETag``.
+
+    Подробнее в ``reviews.versions``.
+    """
+
+    key = models.CharField(max_length=100, primary_key=True)
+    version = models.BigIntegerField()
+
+    objects = ModelVersionQuerySet.as_manager()
+
+    def __str__(self: 'ModelVersion') -> str:
+        return f'{self.key}: {self.version}'
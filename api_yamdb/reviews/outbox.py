@@ -0,0 +1,100 @@
+"""Очередь исходящих писем.
+
+Запрос только сохраняет письмо в таблицу ``OutboxEmail`` и сразу
+возвращает ответ. Письма отправляет команда ``send_outbox``: она
+забирает их пачками, отправляет через одно соединение с почтовым
+бэкендом и при ошибке откладывает повтор с экспоненциальной задержкой.
+"""
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+class DeliveryReport(NamedTuple):
+    sent: int
+    failed: int
+
+
+def enqueue_email(subject: str, body: str, to: str) -> OutboxEmail:
+    return OutboxEmail.objects.create(
+        subject=subject,
+        body=body,
+        from_email=settings.EMAIL_FROM,
+        to=to,
+    )
+
+
+def retry_delay(attempts: int) -> timedelta:
+    seconds = settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(
+        seconds=min(seconds, settings.EMAIL_OUTBOX_MAX_RETRY_DELAY),
+    )
+
+
+def schedule_retry(
+    email: OutboxEmail,
+    error: Exception,
+    now: datetime,
+) -> None:
+    email.last_error = repr(error)
+    email.next_attempt_at = now + retry_delay(email.attempts)
+
+
+def deliver_outbox(batch_size: int) -> DeliveryReport:
+    """Отправляет одну пачку писем, готовых к отправке."""
+    now = timezone.now()
+    with transaction.atomic():
+        pending = OutboxEmail.objects.filter(
+            sent_at__isnull=True,
+            next_attempt_at__lte=now,
+            attempts__lt=settings.EMAIL_OUTBOX_MAX_ATTEMPTS,
+        ).order_by('next_attempt_at', 'id')
+        if connection.features.has_select_for_update_skip_locked:
+            pending = pending.select_for_update(skip_locked=True)
+        emails = list(pending[:batch_size])
+        if not emails:
+            return DeliveryReport(0, 0)
+
+        sent, failed = [], []
+        mail_connection = get_connection(fail_silently=False)
+        try:
+            mail_connection.open()
+        except Exception as error:
+            # Без соединения откладывается вся пачка, а --loop работает
+            # дальше и повторит её после задержки.
+            for email in emails:
+                email.attempts += 1
+                schedule_retry(email, error, now)
+            failed = emails
+        else:
+            with mail_connection:
+                for email in emails:
+                    message = EmailMessage(
+                        email.subject,
+                        email.body,
+                        email.from_email,
+                        [email.to],
+                        connection=mail_connection,
+                    )
+                    email.attempts += 1
+                    try:
+                        message.send()
+                    except Exception as error:
+                        schedule_retry(email, error, now)
+                        failed.append(email)
+                    else:
+                        email.sent_at = timezone.now()
+                        sent.append(email)
+
+        OutboxEmail.objects.bulk_update(sent, ['attempts', 'sent_at'])
+        OutboxEmail.objects.bulk_update(
+            failed,
+            ['attempts', 'last_error', 'next_attempt_at'],
+        )
+    return DeliveryReport(len(sent), len(failed))
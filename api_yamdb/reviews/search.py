@@ -0,0 +1,459 @@
+"""Полнотекстовый поиск произведений.
+
+Документ произведения - название, описание и тексты его отзывов. Каждый
+отзыв индексируется отдельно, поэтому запись отзыва обновляет только его
+собственную запись в индексе, сколько бы отзывов ни было у произведения.
+Если база - SQLite с FTS5, индекс хранится в виртуальных таблицах
+``reviews_title_search`` и ``reviews_review_search`` (миграции
+``0005_title_search`` и ``0007_review_search``) и ранжируется ``bm25``.
+На PostgreSQL те же таблицы хранят ``tsvector`` с индексом GIN (миграция
+``0010_title_search_postgresql``) и ранжируются ``ts_rank``: индекс общий
+для всех процессов и обновляется построчно. Иначе используется
+инвертированный индекс в памяти процесса.
+
+Все индексы обновляются сигналами (``reviews.signals``). Индекс в памяти,
+кроме того, сверяет версию области ``VERSION_SCOPE``, которую меняют
+только записи произведений, и перестраивается, если их изменил другой
+процесс. Отзывы, записанные другими процессами, попадают в него при
+следующем перестроении: иначе каждый отзыв перестраивал бы индекс во
+всех процессах.
+"""
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from django.db import connection, transaction
+from django.db.backends.utils import CursorWrapper
+
+from .models import Review, Title
+from .versions import ProcessIndex, bump_versions
+
+SEARCH_TABLE = 'reviews_title_search'
+REVIEW_SEARCH_TABLE = 'reviews_review_search'
+VERSION_SCOPE = 'search'
+# Веса полей: название и описание произведения.
+FIELD_WEIGHTS = (10.0, 2.0)
+REVIEW_WEIGHT = 1.0
+# Веса ts_rank для меток D, C, B, A не больше единицы: отзывы помечены D,
+# описание - B, название - A.
+TS_RANK_WEIGHTS = '{' + ', '.join(
+    str(weight / max(*FIELD_WEIGHTS, REVIEW_WEIGHT))
+    for weight in (REVIEW_WEIGHT, 0.0, FIELD_WEIGHTS[1], FIELD_WEIGHTS[0])
+) + '}'
+RANK_SQL = f"ts_rank('{TS_RANK_WEIGHTS}'::real[], document, query)"
+TITLE_VECTOR_SQL = (
+    "setweight(to_tsvector('simple', name), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+)
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.casefold())
+
+
+def documents_changed() -> None:
+    """Сообщает индексам других процессов, что произведения изменились."""
+    bump_versions([VERSION_SCOPE])
+
+
+class FtsIndex:
+    """Индекс в таблицах FTS5.
+
+    ``rowid`` строки произведения равен ``id`` произведения, строки
+    отзыва - ``id`` отзыва; у отзыва хранится ``title_id``, чтобы
+    складывать оценки по произведениям.
+    """
+
+    def update(self: 'FtsIndex', title_ids: Iterable[int]) -> None:
+        title_ids = list(title_ids)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Удаление первым берёт блокировку записи: строка читается
+            # после коммитов параллельных писателей и не затирает их.
+            self.delete(cursor, SEARCH_TABLE, title_ids)
+            titles = Title.objects.filter(pk__in=title_ids).values_list(
+                'pk',
+                'name',
+                'description',
+            )
+            cursor.executemany(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, name, description) '
+                'VALUES (%s, %s, %s)',
+                [
+                    (pk, name, description or '')
+                    for pk, name, description in titles
+                ],
+            )
+
+    def remove(self: 'FtsIndex', title_ids: Iterable[int]) -> None:
+        # Отзывы удаляются вместе с произведением и убираются из индекса
+        # своими сигналами.
+        with connection.cursor() as cursor:
+            self.delete(cursor, SEARCH_TABLE, list(title_ids))
+
+    def update_review(self: 'FtsIndex', review: Review) -> None:
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.delete(cursor, REVIEW_SEARCH_TABLE, [review.pk])
+            cursor.execute(
+                f'INSERT INTO {REVIEW_SEARCH_TABLE} (rowid, text, title_id) '
+                'VALUES (%s, %s, %s)',
+                [review.pk, review.text, review.title_id],
+            )
+
+    def remove_review(self: 'FtsIndex', review: Review) -> None:
+        with connection.cursor() as cursor:
+            self.delete(cursor, REVIEW_SEARCH_TABLE, [review.pk])
+
+    def rebuild(self: 'FtsIndex') -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(f'DELETE FROM {REVIEW_SEARCH_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, name, description) '
+                "SELECT id, name, coalesce(description, '') "
+                'FROM reviews_title',
+            )
+            cursor.execute(
+                f'INSERT INTO {REVIEW_SEARCH_TABLE} (rowid, text, title_id) '
+                'SELECT id, text, title_id FROM reviews_review',
+            )
+
+    def search(self: 'FtsIndex', query: str, limit: int) -> List[int]:
+        """Произведения, в документе которых есть все слова запроса.
+
+        Каждое слово ищется отдельно в названиях и описаниях и в отзывах;
+        произведение подходит, если нашлись все слова, а его оценка -
+        сумма ``bm25`` всех совпавших строк.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        weights = ', '.join(map(str, FIELD_WEIGHTS))
+        selects, params = [], []
+        for number, term in enumerate(terms):
+            selects += [
+                f'SELECT rowid AS title_id, {number} AS term, '
+                f'bm25({SEARCH_TABLE}, {weights}) AS score '
+                f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+                f'SELECT CAST(title_id AS INTEGER), {number}, '
+                f'bm25({REVIEW_SEARCH_TABLE}) * {REVIEW_WEIGHT} '
+                f'FROM {REVIEW_SEARCH_TABLE} '
+                f'WHERE {REVIEW_SEARCH_TABLE} MATCH %s',
+            ]
+            # title_id не индексируется, поэтому слово ищется по тексту.
+            params += [f'"{term}"', f'text : "{term}"']
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT title_id FROM ('
+                + ' UNION ALL '.join(selects)
+                + ') GROUP BY title_id HAVING COUNT(DISTINCT term) = %s '
+                'ORDER BY SUM(score), title_id LIMIT %s',
+                [*params, len(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def delete(cursor: CursorWrapper, table: str, ids: List[int]) -> None:
+        cursor.executemany(
+            f'DELETE FROM {table} WHERE rowid = %s',
+            [(pk,) for pk in ids],
+        )
+
+
+class PgIndex:
+    """Индекс в таблицах PostgreSQL со столбцом ``tsvector``.
+
+    Строка произведения хранит ``title_id``, строка отзыва - ``review_id``
+    и ``title_id``. Запись вставляется или заменяется одним ``INSERT ...
+    ON CONFLICT``, поэтому параллельные писатели не мешают друг другу.
+    Словарь ``simple`` не приводит слова к основе, как и ``tokenize``.
+    """
+
+    def update(self: 'PgIndex', title_ids: Iterable[int]) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (title_id, document) '
+                f'SELECT id, {TITLE_VECTOR_SQL} FROM reviews_title '
+                'WHERE id = ANY(%s::integer[]) '
+                'ON CONFLICT (title_id) '
+                'DO UPDATE SET document = EXCLUDED.document',
+                [list(title_ids)],
+            )
+
+    def remove(self: 'PgIndex', title_ids: Iterable[int]) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {SEARCH_TABLE} '
+                'WHERE title_id = ANY(%s::integer[])',
+                [list(title_ids)],
+            )
+
+    def update_review(self: 'PgIndex', review: Review) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {REVIEW_SEARCH_TABLE} '
+                '(review_id, title_id, document) '
+                "VALUES (%s, %s, setweight(to_tsvector('simple', %s), 'D')) "
+                'ON CONFLICT (review_id) '
+                'DO UPDATE SET document = EXCLUDED.document',
+                [review.pk, review.title_id, review.text],
+            )
+
+    def remove_review(self: 'PgIndex', review: Review) -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {REVIEW_SEARCH_TABLE} WHERE review_id = %s',
+                [review.pk],
+            )
+
+    def rebuild(self: 'PgIndex') -> None:
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+            cursor.execute(f'DELETE FROM {REVIEW_SEARCH_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (title_id, document) '
+                f'SELECT id, {TITLE_VECTOR_SQL} FROM reviews_title',
+            )
+            cursor.execute(
+                f'INSERT INTO {REVIEW_SEARCH_TABLE} '
+                '(review_id, title_id, document) '
+                "SELECT id, title_id, setweight(to_tsvector('simple', text), "
+                "'D') FROM reviews_review",
+            )
+
+    def search(self: 'PgIndex', query: str, limit: int) -> List[int]:
+        """Произведения, в документе которых есть все слова запроса.
+
+        Слова сопоставляются так же, как в ``FtsIndex.search``, а оценка
+        произведения - сумма ``ts_rank`` совпавших строк.
+        """
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        selects, params = [], []
+        for number, term in enumerate(terms):
+            selects += [
+                f'SELECT title_id, {number} AS term, '
+                f'{RANK_SQL} AS score '
+                f"FROM {SEARCH_TABLE}, plainto_tsquery('simple', %s) query "
+                'WHERE document @@ query',
+                f'SELECT title_id, {number}, {RANK_SQL} '
+                f'FROM {REVIEW_SEARCH_TABLE}, '
+                "plainto_tsquery('simple', %s) query "
+                'WHERE document @@ query',
+            ]
+            params += [term, term]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT title_id FROM ('
+                + ' UNION ALL '.join(selects)
+                + ') matches GROUP BY title_id '
+                'HAVING COUNT(DISTINCT term) = %s '
+                'ORDER BY SUM(score) DESC, title_id LIMIT %s',
+                [*params, len(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class MemoryIndex(ProcessIndex):
+    """Инвертированный индекс в памяти процесса.
+
+    ``postings`` хранит для каждого слова взвешенные частоты по
+    произведениям - сумму по названию, описанию и отзывам. ``titles`` и
+    ``reviews`` хранят слова каждого произведения и отзыва, чтобы вычесть
+    их при обновлении. Поиск пересекает списки, начиная с самого
+    короткого, и ранжирует по сумме ``tf * idf``.
+    """
+
+    version_sources = (VERSION_SCOPE,)
+
+    def __init__(self: 'MemoryIndex') -> None:
+        super().__init__()
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        self.titles: Dict[int, Counter] = {}
+        self.reviews: Dict[int, Tuple[int, Counter]] = {}
+        self.title_reviews: Dict[int, Set[int]] = defaultdict(set)
+
+    def update(self: 'MemoryIndex', title_ids: Iterable[int]) -> None:
+        if not self.built:
+            return
+        title_ids = list(title_ids)
+        titles = {
+            pk: (name, description or '')
+            for pk, name, description in Title.objects.filter(
+                pk__in=title_ids,
+            ).values_list('pk', 'name', 'description')
+        }
+        with self.lock:
+            for pk in title_ids:
+                self.discard_title(pk)
+                if pk in titles:
+                    self.add_title(pk, titles[pk])
+        self.changed()
+
+    def remove(self: 'MemoryIndex', title_ids: Iterable[int]) -> None:
+        if not self.built:
+            return
+        with self.lock:
+            for pk in title_ids:
+                self.discard_title(pk)
+                for review_id in list(self.title_reviews.pop(pk, ())):
+                    self.discard_review(review_id)
+        self.changed()
+
+    def update_review(self: 'MemoryIndex', review: Review) -> None:
+        if not self.built:
+            return
+        with self.lock:
+            self.discard_review(review.pk)
+            self.add_review(review.pk, review.title_id, review.text)
+
+    def remove_review(self: 'MemoryIndex', review: Review) -> None:
+        if not self.built:
+            return
+        with self.lock:
+            self.discard_review(review.pk)
+
+    def load(self: 'MemoryIndex') -> Callable[[], None]:
+        titles = [
+            (pk, (name, description or ''))
+            for pk, name, description in Title.objects.values_list(
+                'pk',
+                'name',
+                'description',
+            ).iterator()
+        ]
+        reviews = list(
+            Review.objects.values_list('pk', 'title_id', 'text').iterator(),
+        )
+
+        def replace() -> None:
+            self.postings = defaultdict(dict)
+            self.titles = {}
+            self.reviews = {}
+            self.title_reviews = defaultdict(set)
+            for pk, fields in titles:
+                self.add_title(pk, fields)
+            for pk, title_id, text in reviews:
+                self.add_review(pk, title_id, text)
+
+        return replace
+
+    def search(self: 'MemoryIndex', query: str, limit: int) -> List[int]:
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        self.ensure_current()
+        with self.lock:
+            postings = sorted(
+                (self.postings.get(term, {}) for term in terms),
+                key=len,
+            )
+            matches = set(postings[0])
+            for posting in postings[1:]:
+                matches.intersection_update(posting)
+            total = len(self.titles)
+            scores = {
+                pk: sum(
+                    posting[pk] * math.log(1 + total / len(posting))
+                    for posting in postings
+                )
+                for pk in matches
+            }
+        return sorted(scores, key=lambda pk: (-scores[pk], pk))[:limit]
+
+    def add_title(
+        self: 'MemoryIndex',
+        pk: int,
+        fields: Tuple[str, str],
+    ) -> None:
+        document = Counter()
+        for text, weight in zip(fields, FIELD_WEIGHTS):
+            for term in tokenize(text):
+                document[term] += weight
+        self.titles[pk] = document
+        self.apply(pk, document, 1)
+
+    def discard_title(self: 'MemoryIndex', pk: int) -> None:
+        document = self.titles.pop(pk, None)
+        if document is not None:
+            self.apply(pk, document, -1)
+
+    def add_review(
+        self: 'MemoryIndex',
+        pk: int,
+        title_id: int,
+        text: str,
+    ) -> None:
+        document = Counter(
+            {
+                term: count * REVIEW_WEIGHT
+                for term, count in Counter(tokenize(text)).items()
+            },
+        )
+        self.reviews[pk] = (title_id, document)
+        self.title_reviews[title_id].add(pk)
+        self.apply(title_id, document, 1)
+
+    def discard_review(self: 'MemoryIndex', pk: int) -> None:
+        title_id, document = self.reviews.pop(pk, (None, None))
+        if document is None:
+            return
+        self.title_reviews[title_id].discard(pk)
+        if not self.title_reviews[title_id]:
+            del self.title_reviews[title_id]
+        self.apply(title_id, document, -1)
+
+    def apply(
+        self: 'MemoryIndex',
+        title_id: int,
+        document: Counter,
+        sign: int,
+    ) -> None:
+        """Прибавляет или вычитает слова документа у произведения."""
+        for term, frequency in document.items():
+            posting = self.postings[term]
+            value = posting.get(title_id, 0.0) + sign * frequency
+            if value > 0:
+                posting[title_id] = value
+            else:
+                posting.pop(title_id, None)
+                if not posting:
+                    del self.postings[term]
+
+
+_index: Optional[Union[FtsIndex, PgIndex, MemoryIndex]] = None
+_index_lock = threading.Lock()
+
+
+def search_index() -> Union[FtsIndex, PgIndex, MemoryIndex]:
+    """Индекс в базе, если миграция его создала, иначе индекс в памяти."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if SEARCH_TABLE not in connection.introspection.table_names():
+                    _index = MemoryIndex()
+                elif connection.vendor == 'sqlite':
+                    _index = FtsIndex()
+                elif connection.vendor == 'postgresql':
+                    _index = PgIndex()
+                else:
+                    _index = MemoryIndex()
+    return _index
+
+
+def search_titles(query: str, limit: int) -> List[int]:
+    """``id`` найденных произведений от более к менее релевантным."""
+    return search_index().search(query, limit)
@@ -0,0 +1,195 @@
+from typing import Any, List, Type
+
+from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .autocomplete import autocomplete_index, names_changed
+from .models import (
+    Categorie,
+    Comment,
+    Genre,
+    Review,
+    Title,
+    TitleReviewSummary,
+    User,
+)
+from .search import documents_changed, search_index
+from .versions import bump_versions
+
+DEPENDENT_MODELS = {
+    Categorie: (Categorie,),
+    Genre: (Genre,),
+    Title: (Title,),
+    Title.genre.through: (Title.genre.through, Title),
+    Review: (Review, Title),
+    Comment: (Comment,),
+}
+
+
+@receiver(post_save, sender=Review)
+def update_rating_on_review_save(
+    sender: Type[Review],
+    instance: Review,
+    created: bool,
+    **kwargs: Any,
+) -> None:
+    titles = Title.objects.filter(pk=instance.title_id)
+    summaries = TitleReviewSummary.objects
+    if created:
+        titles.apply_review_delta(instance.score, 1)
+        summaries.review_added(instance)
+    elif instance._loaded_score is None:
+        titles.rebuild_ratings()
+        summaries.rebuild([instance.title_id])
+    elif instance.score != instance._loaded_score:
+        titles.apply_review_delta(instance.score - instance._loaded_score, 0)
+        summaries.score_changed(instance, instance._loaded_score)
+    instance._loaded_score = instance.score
+
+
+@receiver(post_delete, sender=Review)
+def update_rating_on_review_delete(
+    sender: Type[Review],
+    instance: Review,
+    **kwargs: Any,
+) -> None:
+    titles = Title.objects.filter(pk=instance.title_id)
+    summaries = TitleReviewSummary.objects
+    if instance._loaded_score is None:
+        titles.rebuild_ratings()
+        if summaries.filter(title_id=instance.title_id).exists():
+            summaries.rebuild([instance.title_id])
+    else:
+        titles.apply_review_delta(-instance._loaded_score, -1)
+        summaries.review_deleted(instance, instance._loaded_score)
+
+
+@receiver(post_save, sender=Title)
+def create_review_summary(
+    sender: Type[Title],
+    instance: Title,
+    created: bool,
+    **kwargs: Any,
+) -> None:
+    if created:
+        TitleReviewSummary.objects.create(title=instance)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+@receiver(m2m_changed)
+def bump_model_versions(
+    sender: Type[models.Model],
+    **kwargs: Any,
+) -> None:
+    if kwargs.get('action', 'post_').startswith('post_'):
+        if sender in DEPENDENT_MODELS:
+            bump_versions(DEPENDENT_MODELS[sender])
+
+
+@receiver(post_save, sender=User)
+def bump_user_version(
+    sender: Type[User],
+    instance: User,
+    created: bool,
+    **kwargs: Any,
+) -> None:
+    """Версия ``User`` меняется, только если сменился ``username``.
+
+    Из полей пользователя в ответы попадает лишь ``username`` автора
+    отзыва или комментария. Новый пользователь ещё ничего не написал, а
+    код подтверждения, роль и пароль в ответах не видны.
+    """
+    if not created and instance.username != instance._loaded_username:
+        bump_versions([User])
+    instance._loaded_username = instance.username
+
+
+@receiver(post_delete, sender=User)
+def bump_user_version_on_delete(
+    sender: Type[User],
+    **kwargs: Any,
+) -> None:
+    bump_versions([User])
+
+
+@receiver(post_save, sender=Title)
+def update_search_index(
+    sender: Type[Title],
+    instance: Title,
+    **kwargs: Any,
+) -> None:
+    documents_changed()
+    search_index().update([instance.pk])
+
+
+@receiver(post_delete, sender=Title)
+def remove_from_search_index(
+    sender: Type[Title],
+    instance: Title,
+    **kwargs: Any,
+) -> None:
+    documents_changed()
+    search_index().remove([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+def update_review_in_search_index(
+    sender: Type[Review],
+    instance: Review,
+    **kwargs: Any,
+) -> None:
+    search_index().update_review(instance)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_search_index(
+    sender: Type[Review],
+    instance: Review,
+    **kwargs: Any,
+) -> None:
+    search_index().remove_review(instance)
+
+
+@receiver(post_save, sender=Title)
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=Categorie)
+def update_autocomplete(
+    sender: Type[models.Model],
+    instance: models.Model,
+    **kwargs: Any,
+) -> None:
+    names_changed()
+    autocomplete_index.update(instance)
+
+
+@receiver(post_delete, sender=Title)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Categorie)
+def remove_from_autocomplete(
+    sender: Type[models.Model],
+    instance: models.Model,
+    **kwargs: Any,
+) -> None:
+    names_changed()
+    autocomplete_index.remove(instance)
+
+
+def titles_bulk_saved(titles: List[Title]) -> None:
+    """То, что сделали бы сигналы, для записи через ``bulk_create``.
+
+    ``bulk_create``, ``bulk_update`` и ``bulk_create`` связей с жанрами
+    сигналов не отправляют, поэтому версии, индексы и пустые сводки
+    отзывов новых произведений обновляются здесь.
+    """
+    bump_versions(DEPENDENT_MODELS[Title.genre.through])
+    TitleReviewSummary.objects.bulk_create(
+        (TitleReviewSummary(title_id=title.pk) for title in titles),
+        ignore_conflicts=True,
+    )
+    documents_changed()
+    search_index().update(title.pk for title in titles)
+    names_changed()
+    for title in titles:
+        autocomplete_index.update(title)
@@ -0,0 +1,138 @@
+"""Счётчики версий моделей для инвалидации кешей.
+
+Версия модели хранится в таблице ``ModelVersion`` и меняется при каждой
+записи в её таблицу (см. ``reviews.signals``). Ключи кешей строятся с
+учётом версий, поэтому после записи старые значения просто перестают
+находиться. Значение версии - момент последнего изменения в
+наносекундах, но не меньше прежнего значения плюс один: по версии можно
+отдавать ``Last-Modified``, а одновременные записи не теряют увеличений.
+У данных, которые ещё не менялись, версия ``0``: чтение версий ничего
+не записывает.
+
+Вместо модели можно передать строку - имя области для данных, которые
+меняются не при каждой записи в таблицу (например, только названия).
+
+Таблица общая для всех воркеров и читается всегда с основной базы.
+Версия меняется в той же транзакции, что и данные, поэтому другие
+запросы видят новую версию одновременно с новыми данными. Внутри
+``version_snapshot`` уже прочитанные версии берутся из него, и
+обработка запроса читает таблицу версий один раз.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, Iterator, Optional, Type, Union
+
+from django.apps import apps
+from django.db import models, router, transaction
+
+KEY_TEMPLATE = 'model-version:{}'
+
+VersionSource = Union[Type[models.Model], str]
+
+snapshot: ContextVar[Optional[Dict[str, int]]] = ContextVar(
+    'version_snapshot',
+    default=None,
+)
+
+
+def version_key(model: VersionSource) -> str:
+    if isinstance(model, str):
+        return KEY_TEMPLATE.format(model)
+    return KEY_TEMPLATE.format(model._meta.label_lower)
+
+
+def version_table() -> models.QuerySet:
+    # Модуль импортируется и до django.setup() (в процессах пула
+    # ``reviews.importer``), поэтому модель берётся из реестра.
+    model = apps.get_model('reviews', 'ModelVersion')
+    return model.objects.using(router.db_for_write(model))
+
+
+def get_versions(model_classes: Iterable[VersionSource]) -> Dict[str, int]:
+    keys = {version_key(model) for model in model_classes}
+    known = snapshot.get()
+    if known is None:
+        known = {}
+    missing = sorted(keys - known.keys())
+    if missing:
+        known.update(version_table().current(missing))
+    return {key: known[key] for key in keys}
+
+
+def bump_versions(model_classes: Iterable[VersionSource]) -> None:
+    keys = [version_key(model) for model in model_classes]
+    if keys:
+        version_table().bump(keys, time.time_ns())
+        known = snapshot.get()
+        if known is not None:
+            for key in keys:
+                known.pop(key, None)
+
+
+@contextmanager
+def version_snapshot(known: Dict[str, int]) -> Iterator[None]:
+    """Переиспользует версии ``known`` до конца блока."""
+    token = snapshot.set(dict(known))
+    try:
+        yield
+    finally:
+        snapshot.reset(token)
+
+
+class ProcessIndex:
+    """Структура в памяти процесса, сверяемая с версиями.
+
+    Наследник задаёт ``version_sources`` и ``load()``. ``ensure_current``
+    перестраивает структуру, если версии изменились. Правки, внесённые в
+    процессе сигналами, отмечаются ``changed()``: после коммита версии
+    запоминаются заново, и собственные записи не вызывают перестроения.
+    Пока такая сверка ждёт коммита, новые правки её не дублируют. Если
+    транзакция откатится или структуру перестроит другой поток, версии
+    не совпадут и она будет перестроена при следующем обращении.
+    """
+
+    version_sources: Iterable[VersionSource] = ()
+
+    def __init__(self: 'ProcessIndex') -> None:
+        self.lock = threading.RLock()
+        self.versions: Optional[Dict[str, int]] = None
+        self.generation = 0
+        self.sync_pending = False
+
+    @property
+    def built(self: 'ProcessIndex') -> bool:
+        return self.versions is not None
+
+    def load(self: 'ProcessIndex') -> Callable[[], None]:
+        """Читает данные и возвращает функцию, заменяющую содержимое."""
+        raise NotImplementedError
+
+    def rebuild(self: 'ProcessIndex') -> None:
+        versions = get_versions(self.version_sources)
+        replace = self.load()
+        with self.lock:
+            replace()
+            self.versions = versions
+            self.generation += 1
+            self.sync_pending = False
+
+    def ensure_current(self: 'ProcessIndex') -> None:
+        if self.versions != get_versions(self.version_sources):
+            self.rebuild()
+
+    def changed(self: 'ProcessIndex') -> None:
+        with self.lock:
+            if self.sync_pending:
+                return
+            self.sync_pending = True
+            generation = self.generation
+
+        def sync() -> None:
+            with self.lock:
+                self.sync_pending = False
+                if self.built and self.generation == generation:
+                    self.versions = get_versions(self.version_sources)
+
+        transaction.on_commit(sync)
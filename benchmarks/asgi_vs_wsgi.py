@@ -0,0 +1,235 @@
+"""Запросы в секунду: синхронные представления под WSGI против асинхронных
+под ASGI.
+
+Запуск из корня репозитория::
+
+    python benchmarks/asgi_vs_wsgi.py --endpoint reviews --concurrency 16
+
+Сравниваются одни и те же данные: ``/api/v1/<путь>`` обслуживает
+WSGI-обработчик, ``/api/v1/async/<путь>`` - ASGI-обработчик. По
+умолчанию запросы идут внутри процесса через тестовые клиенты Django:
+``Client`` в потоках и ``AsyncClient`` в задачах одного цикла событий.
+С ``--servers`` скрипт запускает настоящие серверы ``gunicorn`` (потоки)
+и ``uvicorn`` на той же временной базе и нагружает их по HTTP; оба
+пакета нужно установить отдельно. К каждому запросу добавляется
+уникальный параметр, чтобы не мерить кеш ответов.
+"""
+import argparse
+import asyncio
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, List, Tuple
+from urllib.parse import urlencode
+
+from common import (
+    PROJECT_DIR,
+    rebuild_summaries,
+    seed,
+    setup_django,
+)
+
+ENDPOINTS = {
+    'titles': 'titles/',
+    'title': 'titles/{title}/',
+    'reviews': 'titles/{title}/reviews/',
+    'comments': 'titles/{title}/reviews/{review}/comments/',
+}
+WSGI_PORT = 8601
+ASGI_PORT = 8602
+
+
+def endpoint_paths(name: str) -> Tuple[str, str]:
+    """Пути синхронного и асинхронного вариантов эндпоинта."""
+    from reviews.models import Review
+
+    review = Review.objects.order_by('pk').first()
+    path = ENDPOINTS[name].format(title=review.title_id, review=review.pk)
+    return f'/api/v1/{path}', f'/api/v1/async/{path}'
+
+
+def unique_url(path: str, worker: int, number: int) -> str:
+    return f'{path}?{urlencode({"_": f"{worker}-{number}"})}'
+
+
+def run_threads(
+    worker: Callable[[int, float], int],
+    concurrency: int,
+    seconds: float,
+) -> int:
+    deadline = time.monotonic() + seconds
+    done = [0] * concurrency
+
+    def target(idx: int) -> None:
+        done[idx] = worker(idx, deadline)
+
+    threads = [
+        threading.Thread(target=target, args=(idx,))
+        for idx in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(done)
+
+
+def wsgi_in_process(path: str, args: argparse.Namespace) -> int:
+    from django.db import connection
+    from django.test import Client
+
+    def worker(idx: int, deadline: float) -> int:
+        client = Client()
+        number = 0
+        while time.monotonic() < deadline:
+            response = client.get(unique_url(path, idx, number))
+            assert response.status_code == 200, response.status_code
+            number += 1
+        connection.close()
+        return number
+
+    return run_threads(worker, args.concurrency, args.seconds)
+
+
+def asgi_in_process(path: str, args: argparse.Namespace) -> int:
+    from django.test import AsyncClient
+
+    async def worker(idx: int, deadline: float) -> int:
+        client = AsyncClient()
+        number = 0
+        while time.monotonic() < deadline:
+            response = await client.get(unique_url(path, idx, number))
+            assert response.status_code == 200, response.status_code
+            number += 1
+        return number
+
+    async def run() -> int:
+        deadline = time.monotonic() + args.seconds
+        return sum(
+            await asyncio.gather(
+                *(worker(idx, deadline) for idx in range(args.concurrency)),
+            ),
+        )
+
+    return asyncio.run(run())
+
+
+def over_http(port: int, path: str, args: argparse.Namespace) -> int:
+    def worker(idx: int, deadline: float) -> int:
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        number = 0
+        while time.monotonic() < deadline:
+            connection.request('GET', unique_url(path, idx, number))
+            response = connection.getresponse()
+            response.read()
+            assert response.status == 200, response.status
+            number += 1
+        connection.close()
+        return number
+
+    return run_threads(worker, args.concurrency, args.seconds)
+
+
+def wait_for_port(port: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Сервер на порту {port} не запустился.')
+
+
+def start_servers(
+    db_path: str,
+    args: argparse.Namespace,
+) -> List[subprocess.Popen]:
+    env = dict(
+        os.environ,
+        DB_NAME=db_path,
+        DJANGO_SETTINGS_MODULE='api_yamdb.settings',
+    )
+    commands = [
+        [
+            sys.executable, '-m', 'gunicorn', 'api_yamdb.wsgi',
+            '--chdir', str(PROJECT_DIR),
+            '--threads', str(args.concurrency),
+            '--bind', f'127.0.0.1:{WSGI_PORT}',
+        ],
+        [
+            sys.executable, '-m', 'uvicorn', 'api_yamdb.asgi:application',
+            '--app-dir', str(PROJECT_DIR),
+            '--port', str(ASGI_PORT),
+            '--log-level', 'warning',
+        ],
+    ]
+    servers = [subprocess.Popen(command, env=env) for command in commands]
+    try:
+        wait_for_port(WSGI_PORT)
+        wait_for_port(ASGI_PORT)
+    except RuntimeError:
+        stop_servers(servers)
+        raise
+    return servers
+
+
+def stop_servers(servers: List[subprocess.Popen]) -> None:
+    for server in servers:
+        server.terminate()
+    for server in servers:
+        server.wait()
+
+
+def report(label: str, requests: int, seconds: float) -> None:
+    print(f'{label:>5}: {requests} запросов, {requests / seconds:.1f} rps')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--endpoint', choices=ENDPOINTS, default='reviews')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--titles', type=int, default=1000)
+    parser.add_argument('--reviews', type=int, default=20)
+    parser.add_argument('--comments', type=int, default=5)
+    parser.add_argument(
+        '--servers',
+        action='store_true',
+        help='Нагружать gunicorn и uvicorn по HTTP.',
+    )
+    args = parser.parse_args()
+
+    db_path = setup_django()
+    from django.core.management import call_command
+    from django.db import connections
+
+    call_command('migrate', verbosity=0)
+    seed(args.reviews + 10, args.titles, args.reviews, args.comments)
+    rebuild_summaries()
+    sync_path, async_path = endpoint_paths(args.endpoint)
+    connections.close_all()
+    print(f'{sync_path} против {async_path}, {args.concurrency} клиентов')
+
+    if args.servers:
+        servers = start_servers(db_path, args)
+        try:
+            report('WSGI', over_http(WSGI_PORT, sync_path, args), args.seconds)
+            report(
+                'ASGI',
+                over_http(ASGI_PORT, async_path, args),
+                args.seconds,
+            )
+        finally:
+            stop_servers(servers)
+    else:
+        report('WSGI', wsgi_in_process(sync_path, args), args.seconds)
+        report('ASGI', asgi_in_process(async_path, args), args.seconds)
+
+
+if __name__ == '__main__':
+    main()
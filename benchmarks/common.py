@@ -0,0 +1,133 @@
+"""Общие части скриптов замеров: настройка Django и наполнение базы.
+
+Скрипты запускаются из корня репозитория и работают с отдельной
+временной базой SQLite, рабочая ``db.sqlite3`` не затрагивается.
+"""
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+from typing import Optional
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent / 'api_yamdb'
+
+
+def setup_django(db_path: Optional[str] = None) -> str:
+    """Настраивает Django на временную базу и возвращает путь к ней."""
+    if db_path is None:
+        db_path = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+    sys.path.insert(0, str(PROJECT_DIR))
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'api_yamdb.settings')
+
+    import django
+    from django.conf import settings
+
+    settings.DATABASES['default']['NAME'] = db_path
+    django.setup()
+    return db_path
+
+
+def seed(
+    users: int,
+    titles: int,
+    reviews_per_title: int,
+    comments_per_review: int,
+    batch_size: int = 2000,
+) -> None:
+    """Заполняет базу случайными данными заданного объёма.
+
+    Версии моделей не трогаются: записи идут через ``bulk_create``,
+    сигналы не срабатывают. Рейтинги пересчитываются в конце. Сводки
+    отзывов - нет: ``explain_indexes.py`` заполняет базу до миграции,
+    которая создаёт их таблицу, поэтому их строит ``rebuild_summaries``.
+    """
+    from reviews.models import (
+        Categorie,
+        Comment,
+        Genre,
+        Review,
+        Title,
+        User,
+    )
+
+    rng = random.Random(0)
+    roles = [choice for choice, _ in User.ROLE_CHOICES]
+    User.objects.bulk_create(
+        (
+            User(
+                username=f'user{idx}',
+                email=f'user{idx}@yamdb.fake',
+                role=rng.choice(roles),
+            )
+            for idx in range(users)
+        ),
+        batch_size=batch_size,
+    )
+    Categorie.objects.bulk_create(
+        Categorie(name=f'Категория {idx}', slug=f'category-{idx}')
+        for idx in range(20)
+    )
+    Genre.objects.bulk_create(
+        Genre(name=f'Жанр {idx}', slug=f'genre-{idx}') for idx in range(30)
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    category_ids = list(Categorie.objects.values_list('id', flat=True))
+    genre_ids = list(Genre.objects.values_list('id', flat=True))
+
+    Title.objects.bulk_create(
+        (
+            Title(
+                name=f'Произведение {idx}',
+                year=rng.randint(1900, 2020),
+                category_id=rng.choice(category_ids),
+            )
+            for idx in range(titles)
+        ),
+        batch_size=batch_size,
+    )
+    title_ids = list(Title.objects.values_list('id', flat=True))
+    Title.genre.through.objects.bulk_create(
+        (
+            Title.genre.through(title_id=title_id, genre_id=genre_id)
+            for title_id in title_ids
+            for genre_id in rng.sample(genre_ids, 2)
+        ),
+        batch_size=batch_size,
+    )
+
+    per_title = min(reviews_per_title, len(user_ids))
+    Review.objects.bulk_create(
+        (
+            Review(
+                title_id=title_id,
+                author_id=author_id,
+                text='Отзыв',
+                score=rng.randint(1, 10),
+            )
+            for title_id in title_ids
+            for author_id in rng.sample(user_ids, per_title)
+        ),
+        batch_size=batch_size,
+    )
+    review_ids = list(Review.objects.values_list('id', flat=True))
+    Comment.objects.bulk_create(
+        (
+            Comment(
+                review_id=review_id,
+                author_id=rng.choice(user_ids),
+                text='Комментарий',
+            )
+            for review_id in review_ids
+            for _ in range(comments_per_review)
+        ),
+        batch_size=batch_size,
+    )
+    Title.objects.rebuild_ratings()
+
+
+def rebuild_summaries() -> None:
+    """Сводки отзывов для данных ``seed``; нужны все миграции."""
+    from reviews.models import TitleReviewSummary
+
+    TitleReviewSummary.objects.rebuild()
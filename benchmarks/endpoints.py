@@ -0,0 +1,473 @@
+"""Задержка, число запросов к базе и выделения памяти по эндпоинтам API.
+
+Запуск из корня репозитория::
+
+    python benchmarks/endpoints.py --titles 1000 --reviews 10 --comments 3 \\
+        --save baseline.json
+    python benchmarks/endpoints.py --titles 1000 --reviews 10 --comments 3 \\
+        --compare baseline.json
+
+База заполняется так же, как данные ``static/data``: пользователи,
+категории, жанры, произведения с жанрами, ``--reviews`` отзывов на
+произведение и ``--comments`` комментариев на отзыв. Каждый эндпоинт из
+``api/urls.py`` вызывается ``--iterations`` раз тестовым клиентом DRF;
+для него печатаются p50/p95/p99 задержки, медиана числа запросов к базе
+(без прагм, которые выполняются при открытии соединения) и медиана пика
+выделенной памяти по ``tracemalloc`` (отдельным проходом, чтобы
+трассировка не искажала задержку). Весь замер повторяется ``--repeats``
+раз, и в отчёт попадают медианы показателей по повторам.
+
+К GET-запросам добавляется уникальный параметр, чтобы мерить обработку
+запроса, а не кеш ответов; ``--cached`` это отключает. С ``--compare``
+скрипт завершается с кодом 1, если число запросов выросло, задержка p95
+или память выросли больше допуска или появились ошибки. Допуск - большее
+из доли от базового значения и абсолютного порога: на быстрых эндпоинтах
+доля от долей миллисекунды меньше шума измерений.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from common import rebuild_summaries, seed, setup_django
+
+Context = Dict[str, Any]
+
+
+class Case(NamedTuple):
+    name: str
+    method: str
+    path: Callable[[Context, int], str]
+    status: int = 200
+    auth: bool = False
+    body: Optional[Callable[[Context, int], Any]] = None
+
+
+def title_path(suffix: str = '') -> Callable[[Context, int], str]:
+    return lambda ctx, i: f'/api/v1/titles/{ctx["title"]}/{suffix}'
+
+
+def review_path(suffix: str = '') -> Callable[[Context, int], str]:
+    return lambda ctx, i: (
+        f'/api/v1/titles/{ctx["title"]}/reviews/{ctx["review"]}/{suffix}'
+    )
+
+
+def fixed(path: str) -> Callable[[Context, int], str]:
+    return lambda ctx, i: path
+
+
+CASES = (
+    Case('categories', 'get', fixed('/api/v1/categories/')),
+    Case('genres', 'get', fixed('/api/v1/genres/')),
+    Case('titles', 'get', fixed('/api/v1/titles/')),
+    Case('titles-filter', 'get', fixed('/api/v1/titles/?genre=genre-1')),
+    Case('titles-search', 'get', fixed('/api/v1/titles/?search=1')),
+    Case('title', 'get', title_path()),
+    Case('reviews', 'get', title_path('reviews/')),
+    Case('reviews-cursor', 'get', title_path('reviews/?pagination=cursor')),
+    Case('review', 'get', review_path()),
+    Case('comments', 'get', review_path('comments/')),
+    Case(
+        'comment',
+        'get',
+        lambda ctx, i: (
+            f'/api/v1/titles/{ctx["title"]}/reviews/{ctx["review"]}/'
+            f'comments/{ctx["comment"]}/'
+        ),
+    ),
+    Case('autocomplete', 'get', fixed('/api/v1/autocomplete/?q=прои')),
+    Case('users', 'get', fixed('/api/v1/users/'), auth=True),
+    Case('users-me', 'get', fixed('/api/v1/users/me/'), auth=True),
+    Case('export', 'get', fixed('/api/v1/export/titles/'), auth=True),
+    Case('async-titles', 'get', fixed('/api/v1/async/titles/')),
+    Case(
+        'async-title',
+        'get',
+        lambda ctx, i: f'/api/v1/async/titles/{ctx["title"]}/',
+    ),
+    Case(
+        'async-reviews',
+        'get',
+        lambda ctx, i: f'/api/v1/async/titles/{ctx["title"]}/reviews/',
+    ),
+    Case(
+        'async-comments',
+        'get',
+        lambda ctx, i: (
+            f'/api/v1/async/titles/{ctx["title"]}/reviews/{ctx["review"]}/'
+            'comments/'
+        ),
+    ),
+    Case(
+        'signup',
+        'post',
+        fixed('/api/v1/auth/signup/'),
+        body=lambda ctx, i: {
+            'username': f'bench{ctx["run"]}x{i}',
+            'email': f'bench{ctx["run"]}x{i}@yamdb.fake',
+        },
+    ),
+    Case(
+        'review-create',
+        'post',
+        lambda ctx, i: (
+            f'/api/v1/titles/{ctx["titles"][i % len(ctx["titles"])]}/'
+            'reviews/'
+        ),
+        status=201,
+        auth=True,
+        body=lambda ctx, i: {'text': 'Отзыв', 'score': 7},
+    ),
+    Case(
+        'comment-create',
+        'post',
+        review_path('comments/'),
+        status=201,
+        auth=True,
+        body=lambda ctx, i: {'text': 'Комментарий'},
+    ),
+    Case(
+        'title-update',
+        'patch',
+        title_path(),
+        auth=True,
+        body=lambda ctx, i: {'description': f'Описание {i}'},
+    ),
+    Case(
+        'titles-bulk',
+        'post',
+        fixed('/api/v1/titles/bulk/'),
+        status=201,
+        auth=True,
+        body=lambda ctx, i: [
+            {
+                'id': ctx['title'],
+                'name': 'Произведение 0',
+                'year': 1990 + i % 30,
+                'category': 'category-0',
+                'genre': ['genre-0', 'genre-1'],
+            },
+        ],
+    ),
+)
+
+
+class QueryCounter:
+    """Считает SQL-запросы одного HTTP-запроса.
+
+    Обёртка ставится на соединения текущего потока только на время
+    запроса; асинхронные эндпоинты выполняют запросы в этом же потоке.
+    Прагмы ``reviews.db`` при открытии соединения не считаются: иначе
+    число запросов зависело бы от того, открылось ли новое соединение.
+    """
+
+    def __init__(self: 'QueryCounter') -> None:
+        self.count = 0
+
+    def __call__(
+        self: 'QueryCounter',
+        execute: Callable[..., Any],
+        sql: str,
+        params: Any,
+        many: bool,
+        context: Dict[str, Any],
+    ) -> Any:
+        if not sql.lstrip().upper().startswith('PRAGMA'):
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def measure(self: 'QueryCounter') -> Iterator[None]:
+        from django.db import connections
+
+        self.count = 0
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield
+
+
+def prepare_context() -> Context:
+    from api.serializers import MyTokenObtainPairSerializer
+    from reviews.models import Comment, Title, User
+
+    admin = User.objects.create(
+        username='bench-admin',
+        email='bench-admin@yamdb.fake',
+        role='admin',
+    )
+    comment = Comment.objects.select_related('review').order_by('pk').first()
+    token = MyTokenObtainPairSerializer.get_token(admin).access_token
+    return {
+        'run': time.time_ns(),
+        'title': comment.review.title_id,
+        'review': comment.review_id,
+        'comment': comment.pk,
+        'titles': list(Title.objects.order_by('pk').values_list(
+            'pk',
+            flat=True,
+        )),
+        'token': str(token),
+    }
+
+
+def make_request(client: Any, case: Case, ctx: Context, idx: int) -> int:
+    # Повторы замера не должны повторять запись того же отзыва.
+    idx += ctx['offset']
+    path = case.path(ctx, idx)
+    if case.method == 'get' and not ctx['cached']:
+        path += ('&' if '?' in path else '?') + f'_={ctx["run"]}-{idx}'
+    kwargs = {}
+    if case.body is not None:
+        kwargs.update(data=case.body(ctx, idx), format='json')
+    if case.auth:
+        kwargs['HTTP_AUTHORIZATION'] = f'Bearer {ctx["token"]}'
+    response = getattr(client, case.method)(path, **kwargs)
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+    return response.status_code
+
+
+def percentile(values: List[float], percent: int) -> float:
+    if len(values) < 2:
+        return values[0]
+    return statistics.quantiles(values, n=100, method='inclusive')[
+        percent - 1
+    ]
+
+
+def measure_latency(
+    client: Any,
+    case: Case,
+    ctx: Context,
+    counter: QueryCounter,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    first_warmup = args.iterations + args.alloc_iterations
+    for idx in range(first_warmup, first_warmup + args.warmup):
+        make_request(client, case, ctx, idx)
+    timings, queries, errors = [], [], 0
+    for idx in range(args.iterations):
+        with counter.measure():
+            started = time.perf_counter()
+            status = make_request(client, case, ctx, idx)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(counter.count)
+        errors += status != case.status
+    return {
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': statistics.median(queries),
+        'errors': errors,
+    }
+
+
+def measure_allocations(
+    client: Any,
+    case: Case,
+    ctx: Context,
+    args: argparse.Namespace,
+) -> float:
+    peaks = []
+    tracemalloc.start()
+    try:
+        for idx in range(args.alloc_iterations):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            make_request(client, case, ctx, args.iterations + idx)
+            peaks.append(tracemalloc.get_traced_memory()[1] - current)
+    finally:
+        tracemalloc.stop()
+    return round(statistics.median(peaks) / 1024, 1)
+
+
+def run_cases(
+    args: argparse.Namespace,
+    ctx: Context,
+) -> Dict[str, Dict[str, Any]]:
+    from rest_framework.test import APIClient
+
+    counter = QueryCounter()
+    client = APIClient()
+    results = {}
+    for case in CASES:
+        if args.only and case.name not in args.only:
+            continue
+        result = measure_latency(client, case, ctx, counter, args)
+        result['alloc_kib'] = measure_allocations(client, case, ctx, args)
+        results[case.name] = result
+    return results
+
+
+def run_repeats(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    """Медианы показателей по ``--repeats`` замерам; ошибки суммируются."""
+    ctx = prepare_context()
+    ctx['cached'] = args.cached
+    per_repeat = args.iterations + args.alloc_iterations + args.warmup
+    runs = []
+    for repeat in range(args.repeats):
+        ctx['offset'] = repeat * per_repeat
+        runs.append(run_cases(args, ctx))
+    results = {}
+    for name in runs[0]:
+        samples = [run[name] for run in runs]
+        results[name] = {
+            key: (
+                sum(sample[key] for sample in samples)
+                if key == 'errors'
+                else round(
+                    statistics.median(sample[key] for sample in samples),
+                    3,
+                )
+            )
+            for key in samples[0]
+        }
+        result = results[name]
+        print(
+            f'{name:<15} p50 {result["p50_ms"]:8.2f} мс  '
+            f'p95 {result["p95_ms"]:8.2f} мс  '
+            f'p99 {result["p99_ms"]:8.2f} мс  '
+            f'запросов {result["queries"]:>4}  '
+            f'память {result["alloc_kib"]:8.1f} КиБ  '
+            f'ошибок {result["errors"]}',
+        )
+    return results
+
+
+def exceeds(old: float, new: float, tolerance: float, floor: float) -> bool:
+    """Вырос ли показатель больше доли ``tolerance`` и порога ``floor``."""
+    return new > old + max(old * tolerance, floor)
+
+
+def compare(
+    baseline: Dict[str, Any],
+    report: Dict[str, Any],
+    args: argparse.Namespace,
+) -> List[str]:
+    """Список регрессий относительно сохранённого замера."""
+    if baseline['dataset'] != report['dataset']:
+        print('Внимание: размер данных отличается от базового замера.')
+    regressions = []
+    for name, old in baseline['endpoints'].items():
+        new = report['endpoints'].get(name)
+        if new is None:
+            continue
+        if new['errors']:
+            regressions.append(f'{name}: ошибок {new["errors"]}')
+        if new['queries'] > old['queries']:
+            regressions.append(
+                f'{name}: запросов {old["queries"]} -> {new["queries"]}',
+            )
+        if exceeds(
+            old['p95_ms'],
+            new['p95_ms'],
+            args.latency_tolerance,
+            args.latency_floor,
+        ):
+            regressions.append(
+                f'{name}: p95 {old["p95_ms"]} -> {new["p95_ms"]} мс',
+            )
+        if exceeds(
+            old['alloc_kib'],
+            new['alloc_kib'],
+            args.alloc_tolerance,
+            args.alloc_floor,
+        ):
+            regressions.append(
+                f'{name}: память {old["alloc_kib"]} -> '
+                f'{new["alloc_kib"]} КиБ',
+            )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--titles', type=int, default=1000)
+    parser.add_argument('--reviews', type=int, default=10)
+    parser.add_argument('--comments', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--alloc-iterations', type=int, default=10)
+    parser.add_argument(
+        '--repeats',
+        type=int,
+        default=3,
+        help='Число повторов замера; в отчёт попадают медианы.',
+    )
+    parser.add_argument('--cached', action='store_true')
+    parser.add_argument(
+        '--only',
+        nargs='+',
+        choices=[case.name for case in CASES],
+        help='Замерить только эти эндпоинты.',
+    )
+    parser.add_argument('--save', help='Записать замер в JSON-файл.')
+    parser.add_argument('--compare', help='Сравнить с замером из файла.')
+    parser.add_argument(
+        '--latency-tolerance',
+        type=float,
+        default=0.25,
+        help='Допустимый рост p95, доля.',
+    )
+    parser.add_argument(
+        '--latency-floor',
+        type=float,
+        default=1.0,
+        help='Допустимый рост p95 не меньше этого числа миллисекунд.',
+    )
+    parser.add_argument(
+        '--alloc-tolerance',
+        type=float,
+        default=0.1,
+        help='Допустимый рост памяти, доля.',
+    )
+    parser.add_argument(
+        '--alloc-floor',
+        type=float,
+        default=16.0,
+        help='Допустимый рост памяти не меньше этого числа КиБ.',
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    setup_django()
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    seed(args.reviews + 10, args.titles, args.reviews, args.comments)
+    rebuild_summaries()
+    report = {
+        'dataset': {
+            'titles': args.titles,
+            'reviews': args.reviews,
+            'comments': args.comments,
+            'iterations': args.iterations,
+            'repeats': args.repeats,
+            'cached': args.cached,
+        },
+        'endpoints': run_repeats(args),
+    }
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compare(json.load(file), report, args)
+        for regression in regressions:
+            print(f'Регрессия: {regression}')
+        if regressions:
+            sys.exit(1)
+        print('Регрессий нет.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Планы и время горячих запросов до и после миграции с индексами.
+
+Запуск из корня репозитория::
+
+    python benchmarks/explain_indexes.py --titles 5000
+
+Скрипт создаёт временную базу, применяет миграции до
+``0003_outboxemail``, заполняет её, печатает ``EXPLAIN`` и время каждого
+запроса, затем применяет ``0004_hot_path_indexes`` и повторяет замеры.
+"""
+import argparse
+import time
+from typing import Callable, Dict, List, Tuple
+
+from common import seed, setup_django
+
+BEFORE = '0003_outboxemail'
+AFTER = '0004_hot_path_indexes'
+
+
+def hot_queries() -> List[Tuple[str, Callable]]:
+    from reviews.models import Comment, Review, Title, User
+
+    title = Title.objects.order_by('pk')[Title.objects.count() // 2]
+    review = Review.objects.filter(title=title).first()
+    return [
+        (
+            'Отзывы произведения, страница курсора',
+            lambda: Review.objects.filter(title=title).order_by(
+                '-pub_date',
+                '-id',
+            )[:6],
+        ),
+        (
+            'Комментарии к отзыву, страница курсора',
+            lambda: Comment.objects.filter(review=review).order_by(
+                '-pub_date',
+                '-id',
+            )[:6],
+        ),
+        (
+            'Произведения по году',
+            lambda: Title.objects.filter(year=title.year),
+        ),
+        (
+            'Произведения по названию',
+            lambda: Title.objects.filter(name=title.name),
+        ),
+        (
+            'Произведения категории за год',
+            lambda: Title.objects.filter(
+                category__slug=title.category.slug,
+                year=title.year,
+            ),
+        ),
+        (
+            'Пользователи с ролью',
+            lambda: User.objects.filter(role=User.ROLE_MODERATOR),
+        ),
+    ]
+
+
+def measure(repeat: int) -> Dict[str, float]:
+    from django.db import connection
+
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+    timings = {}
+    for name, build in hot_queries():
+        queryset = build()
+        print(f'\n{name}\n{queryset.explain()}')
+        started = time.perf_counter()
+        for _ in range(repeat):
+            list(build())
+        timings[name] = (time.perf_counter() - started) / repeat * 1000
+        print(f'{timings[name]:.3f} мс на запрос')
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--titles', type=int, default=2000)
+    parser.add_argument('--reviews', type=int, default=10)
+    parser.add_argument('--comments', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+
+    call_command('migrate', 'reviews', BEFORE, verbosity=0)
+    seed(args.users, args.titles, args.reviews, args.comments)
+
+    print(f'=== До индексов ({BEFORE}) ===')
+    before = measure(args.repeat)
+    call_command('migrate', 'reviews', AFTER, verbosity=0)
+    print(f'\n=== После индексов ({AFTER}) ===')
+    after = measure(args.repeat)
+
+    print('\n=== Итог, мс на запрос ===')
+    for name in before:
+        print(f'{before[name]:9.3f} -> {after[name]:9.3f}  {name}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Конкурентная запись отзывов в SQLite: журнал delete против WAL.
+
+Запуск из корня репозитория::
+
+    python benchmarks/sqlite_wal.py --writers 4 --readers 4 --seconds 5
+
+Для каждого режима журнала создаётся своя временная база. Потоки-писатели
+создают отзывы через ORM (с сигналами рейтинга и индексов), читатели
+листают произведения с отзывами. Печатается число операций и ошибок
+``database is locked``.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from common import rebuild_summaries, seed, setup_django
+
+JOURNAL_MODES = ('delete', 'wal')
+
+
+def prepare_database(mode: str, args: argparse.Namespace) -> str:
+    """Создаёт и заполняет базу с нужным журналом, возвращает режим."""
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.db import connection, connections
+
+    connections.close_all()
+    settings.SQLITE_PRAGMAS['journal_mode'] = mode
+    settings.DATABASES['default']['NAME'] = os.path.join(
+        tempfile.mkdtemp(),
+        f'{mode}.sqlite3',
+    )
+    settings.DATABASES['default']['OPTIONS']['timeout'] = args.timeout
+    connections['default'].settings_dict.update(settings.DATABASES['default'])
+    call_command('migrate', verbosity=0)
+    seed(args.writers + 10, args.titles, 1, 0)
+    rebuild_summaries()
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        actual = cursor.fetchone()[0]
+    connections.close_all()
+    return actual
+
+
+def write_reviews(author_id: int, deadline: float, stats: Counter) -> None:
+    from django.db import OperationalError, connection
+
+    from reviews.models import Review, Title
+
+    titles = Title.objects.exclude(reviews__author_id=author_id)
+    for title_id in titles.values_list('pk', flat=True):
+        if time.monotonic() > deadline:
+            break
+        try:
+            Review.objects.create(
+                title_id=title_id,
+                author_id=author_id,
+                text='Отзыв под нагрузкой',
+                score=7,
+            )
+            stats['writes'] += 1
+        except OperationalError:
+            stats['locked'] += 1
+    connection.close()
+
+
+def read_titles(deadline: float, stats: Counter) -> None:
+    from django.db import OperationalError, connection
+
+    from reviews.models import Title
+
+    while time.monotonic() < deadline:
+        try:
+            list(
+                Title.objects.order_by('-rating').prefetch_related(
+                    'reviews',
+                )[:20],
+            )
+            stats['reads'] += 1
+        except OperationalError:
+            stats['locked'] += 1
+    connection.close()
+
+
+def run_mode(mode: str, args: argparse.Namespace) -> Counter:
+    from reviews.models import User
+
+    actual = prepare_database(mode, args)
+    author_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+    deadline = time.monotonic() + args.seconds
+    # У каждого потока свой счётчик, суммируются после завершения.
+    counters = []
+    threads = []
+    for author_id in author_ids[:args.writers]:
+        counters.append(Counter())
+        threads.append(
+            threading.Thread(
+                target=write_reviews,
+                args=(author_id, deadline, counters[-1]),
+            ),
+        )
+    for _ in range(args.readers):
+        counters.append(Counter())
+        threads.append(
+            threading.Thread(
+                target=read_titles,
+                args=(deadline, counters[-1]),
+            ),
+        )
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats = sum(counters, Counter())
+    print(
+        f'{mode:>7} (PRAGMA journal_mode={actual}): '
+        f'записей {stats["writes"]}, чтений {stats["reads"]}, '
+        f'ошибок блокировки {stats["locked"]}',
+    )
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--titles', type=int, default=2000)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=1,
+        help='Ожидание блокировки SQLite, в секундах.',
+    )
+    args = parser.parse_args()
+
+    setup_django()
+    for mode in JOURNAL_MODES:
+        run_mode(mode, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,15 @@
+import pytest
+from django.core.cache import cache, caches
+
+from api.authentication import clear_user_cache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    caches['shared'].clear()
+    clear_user_cache()
+    yield
+    cache.clear()
+    caches['shared'].clear()
+    clear_user_cache()
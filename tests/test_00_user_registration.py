@@ -2,7 +2,10 @@ from http import HTTPStatus
 
 import pytest
 from django.core import mail
+from django.core.management import call_command
+from django.db import connection
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
 from tests.utils import (
     invalid_data_for_user_patch_and_creation,
     invalid_data_for_username_and_email_fields,
@@ -108,6 +111,11 @@ class Test00UserRegistration:
         }
 
         response = client.post(self.url_signup, data=valid_data)
+        assert len(mail.outbox) == outbox_before_count, (
+            f'Проверьте, что эндпоинт `{self.url_signup}` не отправляет '
+            'письмо в ходе запроса, а ставит его в очередь.'
+        )
+        call_command('send_outbox')
         outbox_after = mail.outbox  # email outbox after user create
 
         assert response.status_code != HTTPStatus.NOT_FOUND, (
@@ -157,6 +165,7 @@ class Test00UserRegistration:
         response = admin_client.post(
             self.url_admin_create_user, data=valid_data
         )
+        call_command('send_outbox')
         outbox_after = mail.outbox
 
         assert response.status_code != HTTPStatus.NOT_FOUND, (
@@ -362,3 +371,45 @@ class Test00UserRegistration:
             'пользователя, созданного администратором,  возвращает ответ '
             'со статусом 200.'
         )
+
+    def signup_user_queries(self, client, data):
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(self.url_signup, data=data)
+        assert response.status_code == HTTPStatus.OK
+        return [
+            query['sql'] for query in context.captured_queries
+            if '"reviews_user"' in query['sql']
+        ]
+
+    def test_signup_minimal_writes(self, client, django_user_model):
+        valid_data = {
+            'email': 'test_email@yamdb.fake',
+            'username': 'valid_username_1',
+        }
+        queries = self.signup_user_queries(client, valid_data)
+        assert [query.split()[0] for query in queries] == [
+            'SELECT',
+            'INSERT',
+        ], (
+            f'Проверьте, что регистрация через `{self.url_signup}` делает '
+            'один запрос на поиск пользователя и один INSERT.'
+        )
+        first_code = django_user_model.objects.get().confirmation_code
+        assert first_code
+
+        queries = self.signup_user_queries(client, valid_data)
+        assert [query.split()[0] for query in queries] == [
+            'SELECT',
+            'UPDATE',
+        ], (
+            f'Проверьте, что повторный запрос к `{self.url_signup}` делает '
+            'один запрос на поиск пользователя и один UPDATE.'
+        )
+        assert 'confirmation_code' in queries[1]
+        assert '"email"' not in queries[1], (
+            'Проверьте, что при повторной регистрации обновляется только '
+            '`confirmation_code`.'
+        )
+        assert (
+            django_user_model.objects.get().confirmation_code != first_code
+        )
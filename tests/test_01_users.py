@@ -1,6 +1,12 @@
 from http import HTTPStatus
 
 import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.authentication import _user_cache, cached_user
+from api.serializers import MyTokenObtainPairSerializer
 from tests.utils import (
     check_pagination,
     invalid_data_for_user_patch_and_creation,
@@ -562,3 +568,80 @@ class Test01UserAPI:
             'Проверьте, что PATCH-запрос к `/api/v1/users/me/` с ключом '
             '`role` не изменяет роль пользователя.'
         )
+
+    def user_queries(self, client, url):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(url)
+        assert response.status_code == HTTPStatus.OK
+        return [
+            query['sql'] for query in context.captured_queries
+            if 'reviews_user' in query['sql']
+        ]
+
+    def test_11_01_token_claims_skip_user_query(self, admin):
+        token = MyTokenObtainPairSerializer.get_token(admin).access_token
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        assert not self.user_queries(client, '/api/v1/categories/'), (
+            'Проверьте, что токен с `username` и `role` в claims не требует '
+            'запроса пользователя из базы.'
+        )
+        response = client.post(
+            '/api/v1/categories/',
+            data={'name': 'Фильмы', 'slug': 'films'},
+        )
+        assert response.status_code == HTTPStatus.CREATED, (
+            'Проверьте, что роль из claims токена учитывается в правах.'
+        )
+
+        response = client.get('/api/v1/users/me/')
+        assert response.json()['email'] == admin.email, (
+            'Проверьте, что `/api/v1/users/me/` возвращает профиль из базы.'
+        )
+
+        admin.is_active = False
+        admin.save()
+        response = client.post(
+            '/api/v1/categories/',
+            data={'name': 'Книги', 'slug': 'books'},
+        )
+        assert response.status_code == HTTPStatus.UNAUTHORIZED, (
+            'Проверьте, что деактивированный пользователь теряет право '
+            'записи, не дожидаясь истечения токена.'
+        )
+        admin.delete()
+        response = client.delete('/api/v1/categories/films/')
+        assert response.status_code == HTTPStatus.UNAUTHORIZED, (
+            'Проверьте, что удалённый пользователь теряет право записи, не '
+            'дожидаясь истечения токена.'
+        )
+
+    def test_11_02_user_cache_invalidated_on_save(self, user_client, user):
+        url = '/api/v1/categories/'
+        assert self.user_queries(user_client, url)
+        assert not self.user_queries(user_client, url), (
+            'Проверьте, что пользователь кешируется между запросами.'
+        )
+        user.bio = 'new bio'
+        user.save()
+        assert self.user_queries(user_client, url), (
+            'Проверьте, что сохранение пользователя сбрасывает кеш.'
+        )
+
+    def test_11_03_user_cache_is_bounded(self, settings, django_user_model):
+        settings.AUTH_USER_CACHE_MAX_SIZE = 2
+        users = [
+            django_user_model.objects.create(
+                username=f'cached{idx}', email=f'cached{idx}@a.fake'
+            )
+            for idx in range(3)
+        ]
+        cached_user(users[0].pk)
+        cached_user(users[1].pk)
+        cached_user(users[0].pk)
+        cached_user(users[2].pk)
+        assert list(_user_cache) == [users[0].pk, users[2].pk], (
+            'Проверьте, что кеш пользователей ограничен '
+            '`AUTH_USER_CACHE_MAX_SIZE` и вытесняет давно не '
+            'использованные записи.'
+        )
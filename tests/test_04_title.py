@@ -1,11 +1,19 @@
 from http import HTTPStatus
 
 import pytest
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import CaptureQueriesContext
+from reviews import search
+from reviews.models import Review, Title
+from reviews.versions import bump_versions
 from tests.utils import (
     check_pagination,
     check_permissions,
+    check_query_count,
     create_categories,
     create_genre,
+    create_single_review,
     create_titles,
 )
 
@@ -336,3 +344,395 @@ class Test04TitleAPI:
             titles,
             HTTPStatus.FORBIDDEN,
         )
+
+    def test_06_titles_query_count(self, client, admin_client):
+        titles, categories, genres = create_titles(admin_client)
+        check_query_count(client, '/api/v1/titles/', 4)
+        check_query_count(client, f'/api/v1/titles/{titles[0]["id"]}/', 3)
+
+        for idx in range(5):
+            admin_client.post(
+                '/api/v1/titles/',
+                data={
+                    'name': f'Произведение {idx}',
+                    'year': 2000 + idx,
+                    'genre': [genre['slug'] for genre in genres],
+                    'category': categories[idx % 2]['slug'],
+                },
+            )
+        response = check_query_count(client, '/api/v1/titles/', 4)
+        assert len(response.json()['results']) == 5, (
+            'Проверьте, что ответ на GET-запрос к `/api/v1/titles/` '
+            'содержит полную страницу произведений.'
+        )
+
+    def test_07_titles_count_is_cached(self, client, admin_client):
+        titles, categories, genres = create_titles(admin_client)
+        check_query_count(client, '/api/v1/titles/', 4)
+        response = check_query_count(client, '/api/v1/titles/?page=1', 3)
+        assert response.json()['count'] == len(titles)
+
+        admin_client.post(
+            '/api/v1/titles/',
+            data={
+                'name': 'Новое произведение',
+                'year': 2000,
+                'genre': [genres[0]['slug']],
+                'category': categories[0]['slug'],
+            },
+        )
+        response = check_query_count(client, '/api/v1/titles/', 4)
+        assert response.json()['count'] == len(titles) + 1, (
+            'Проверьте, что после добавления произведения закешированное '
+            'значение `count` сбрасывается.'
+        )
+        response = check_query_count(
+            client, f'/api/v1/titles/?genre={genres[0]["slug"]}', 4
+        )
+        assert response.json()['count'] == 2, (
+            'Проверьте, что `count` кешируется отдельно для каждого фильтра.'
+        )
+
+    def test_08_titles_response_cache(self, client, admin_client):
+        titles, _, _ = create_titles(admin_client)
+        url = f'/api/v1/titles/{titles[0]["id"]}/'
+        check_query_count(client, '/api/v1/titles/', 4)
+        check_query_count(client, '/api/v1/titles/', 1)
+        check_query_count(client, url, 3)
+        response = check_query_count(client, url, 1)
+        assert response.json()['name'] == titles[0]['name']
+
+        admin_client.patch(url, data={'name': 'Новое название'})
+        response = check_query_count(client, url, 3)
+        assert response.json()['name'] == 'Новое название', (
+            'Проверьте, что изменение произведения сбрасывает кеш ответа.'
+        )
+        admin_client.delete('/api/v1/genres/comedy/')
+        response = check_query_count(client, url, 3)
+        assert [genre['slug'] for genre in response.json()['genre']] == [
+            'horror'
+        ], (
+            'Проверьте, что удаление жанра сбрасывает кеш ответа '
+            'для произведений.'
+        )
+
+    def test_08_titles_response_cache_host(self, client, admin_client):
+        create_titles(admin_client)
+        url = '/api/v1/titles/'
+        plain = check_query_count(client, url, 4)
+        check_query_count(client, url, 1)
+
+        for extra in ({'secure': True}, {'HTTP_HOST': 'mirror.yamdb.fake'}):
+            response = check_query_count(client, url, 3, **extra)
+            assert response['ETag'] != plain['ETag'], (
+                'Проверьте, что кеш ответа и `ETag` различают схему и хост '
+                'запроса: ссылки пагинации в ответе абсолютные.'
+            )
+        assert 'Accept' in plain['Vary'], (
+            'Проверьте, что ответ с `ETag` содержит `Vary: Accept`.'
+        )
+
+    @pytest.mark.parametrize('backend', ['fts', 'memory'])
+    def test_09_titles_search(
+        self, client, admin_client, user_client, monkeypatch, backend
+    ):
+        if backend == 'memory':
+            monkeypatch.setattr(search, '_index', search.MemoryIndex())
+        titles, _, _ = create_titles(admin_client)
+        terminator, die_hard = titles[0]['id'], titles[1]['id']
+        create_single_review(user_client, die_hard, 'Лучше, чем Терминатор', 9)
+
+        def found(query):
+            response = client.get('/api/v1/titles/', {'search': query})
+            assert response.status_code == HTTPStatus.OK
+            return [title['id'] for title in response.json()['results']]
+
+        assert found('терминатор') == [terminator, die_hard], (
+            'Проверьте, что `?search=` ищет по названию и текстам отзывов и '
+            'ставит совпадение в названии выше.'
+        )
+        assert found('be back') == [terminator], (
+            'Проверьте, что `?search=` ищет по описанию произведения.'
+        )
+        assert found('крепкий терминатор') == [die_hard], (
+            'Проверьте, что `?search=` требует совпадения всех слов.'
+        )
+        assert found('бэтмен') == []
+        with CaptureQueriesContext(connection) as queries:
+            found('терминатор')
+        assert not [
+            query for query in queries if 'CASE WHEN' in query['sql']
+        ], (
+            'Проверьте, что порядок результатов поиска задаётся одним '
+            'параметром, а не `CASE` с условием на каждое произведение.'
+        )
+
+        reviews_url = f'/api/v1/titles/{terminator}/reviews/'
+        with CaptureQueriesContext(connection) as queries:
+            review = create_single_review(
+                user_client, terminator, 'Крепкий сюжет', 8
+            ).json()
+        assert not [
+            query for query in queries
+            if '"reviews_review"."text"' in query['sql']
+        ], (
+            'Проверьте, что запись отзыва индексирует только сам отзыв, '
+            'не перечитывая остальные отзывы произведения.'
+        )
+        assert found('крепкий сюжет') == [terminator]
+        user_client.patch(
+            f'{reviews_url}{review["id"]}/', data={'text': 'Скучный финал'}
+        )
+        assert found('сюжет') == [] and found('финал') == [terminator], (
+            'Проверьте, что индекс обновляется при изменении отзыва.'
+        )
+        if backend == 'memory':
+            generation = search._index.generation
+            bump_versions([Review, Title])
+            found('финал')
+            assert search._index.generation == generation, (
+                'Проверьте, что запись отзыва в другом процессе не '
+                'перестраивает индекс в памяти целиком.'
+            )
+        user_client.delete(f'{reviews_url}{review["id"]}/')
+        assert found('финал') == [], (
+            'Проверьте, что удалённый отзыв пропадает из поиска.'
+        )
+
+        admin_client.patch(
+            f'/api/v1/titles/{die_hard}/',
+            data={'name': 'Бэтмен'},
+        )
+        admin_client.delete(f'/api/v1/titles/{terminator}/')
+        assert found('бэтмен') == [die_hard], (
+            'Проверьте, что индекс обновляется при изменении произведения.'
+        )
+        assert found('терминатор') == [die_hard], (
+            'Проверьте, что удалённое произведение пропадает из поиска.'
+        )
+
+    def test_10_autocomplete(self, client, admin_client):
+        url = '/api/v1/autocomplete/'
+        titles, _, _ = create_titles(admin_client)
+        response = client.get(url, {'q': 'ор'})
+        assert response.status_code == HTTPStatus.OK, (
+            f'Эндпоинт `{url}` не найден. Проверьте настройки в *urls.py*.'
+        )
+        assert response.json() == [
+            {'type': 'title', 'name': 'Крепкий орешек', 'id': titles[1]['id']},
+        ], (
+            f'Проверьте, что `{url}` находит названия по началу любого слова.'
+        )
+
+        response = check_query_count(client, f'{url}?q=К', 1)
+        assert [item['name'] for item in response.json()] == [
+            'Книги',
+            'Комедия',
+            'Крепкий орешек',
+        ], (
+            f'Проверьте, что `{url}` читает из базы только версию индекса '
+            'и ставит короткие названия выше.'
+        )
+        response = check_query_count(client, f'{url}?q=К&type=genre', 1)
+        assert response.json() == [
+            {'type': 'genre', 'name': 'Комедия', 'slug': 'comedy'},
+        ]
+
+        admin_client.post(
+            '/api/v1/genres/',
+            data={'name': 'Кино', 'slug': 'cinema'},
+        )
+        admin_client.delete('/api/v1/genres/comedy/')
+        response = check_query_count(client, f'{url}?q=к&limit=2', 1)
+        assert [item['name'] for item in response.json()] == [
+            'Кино',
+            'Книги',
+        ], (
+            f'Проверьте, что `{url}` учитывает изменения без перестроения '
+            'индекса.'
+        )
+        assert client.get(url, {'q': 'к', 'limit': 0}).status_code == (
+            HTTPStatus.BAD_REQUEST
+        )
+
+    def test_11_titles_bulk(self, client, admin_client, user_client):
+        url = '/api/v1/titles/bulk/'
+        create_genre(admin_client)
+        create_categories(admin_client)
+        check_query_count(client, '/api/v1/titles/', 2)
+
+        def items(count, start=0):
+            return [
+                {
+                    'name': f'Сериал {idx}',
+                    'year': 2000 + idx % 20,
+                    'category': 'films',
+                    'genre': ['horror', 'drama'],
+                }
+                for idx in range(start, start + count)
+            ]
+
+        response = user_client.post(url, data=items(2), format='json')
+        assert response.status_code == HTTPStatus.FORBIDDEN
+
+        # Строки версий заводятся первой записью, дальше их только меняют.
+        bump_versions([Title, Title.genre.through, 'search', 'autocomplete'])
+        query_counts = []
+        for count, start in ((2, 0), (20, 2)):
+            with CaptureQueriesContext(connection) as context:
+                response = admin_client.post(
+                    url,
+                    data=items(count, start),
+                    format='json',
+                )
+            assert response.status_code == HTTPStatus.CREATED, (
+                f'Проверьте, что POST-запрос администратора к `{url}` с '
+                'корректными данными возвращает ответ со статусом 201.'
+            )
+            assert len(response.json()) == count
+            query_counts.append(len(context))
+        assert query_counts[0] == query_counts[1], (
+            f'Проверьте, что число SQL-запросов `{url}` не зависит от числа '
+            f'произведений: {query_counts}.'
+        )
+
+        response = client.get('/api/v1/titles/', {'genre': 'drama'})
+        assert response.json()['count'] == 22, (
+            'Проверьте, что пакетная запись сбрасывает кеши и создаёт связи '
+            'с жанрами.'
+        )
+        first = response.json()['results'][0]
+
+        response = admin_client.post(
+            url,
+            data=[
+                {
+                    'id': first['id'],
+                    'name': 'Новое имя',
+                    'year': 1999,
+                    'category': 'books',
+                    'genre': ['comedy'],
+                },
+                {'name': 'Без года', 'category': 'films', 'genre': []},
+                {'name': 'Фильм', 'year': 2000, 'category': 'nope',
+                 'genre': ['horror', 'unknown']},
+            ],
+            format='json',
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        errors = response.json()
+        assert errors[0] == {} and 'year' in errors[1], (
+            'Проверьте, что ошибки возвращаются списком по индексам.'
+        )
+        assert set(errors[2]) == {'category', 'genre'}
+        assert client.get('/api/v1/titles/').json()['count'] == 22, (
+            'Проверьте, что при ошибке ничего не записывается.'
+        )
+
+        response = admin_client.post(
+            url,
+            data=[
+                {
+                    'id': first['id'],
+                    'name': 'Новое имя',
+                    'year': 1999,
+                    'category': 'books',
+                    'genre': ['comedy'],
+                },
+            ],
+            format='json',
+        )
+        assert response.status_code == HTTPStatus.CREATED
+        title = client.get(f'/api/v1/titles/{first["id"]}/').json()
+        assert title['name'] == 'Новое имя'
+        assert title['category']['slug'] == 'books'
+        assert [genre['slug'] for genre in title['genre']] == ['comedy']
+        assert [
+            item['id']
+            for item in client.get(
+                '/api/v1/titles/', {'search': 'новое'},
+            ).json()['results']
+        ] == [first['id']], (
+            'Проверьте, что пакетная запись обновляет поисковый индекс.'
+        )
+
+    def test_12_async_titles(self, client, admin_client):
+        titles, _, _ = create_titles(admin_client)
+        url = '/api/v1/async/titles/'
+        response = client.get(url)
+        assert response.status_code == HTTPStatus.OK, (
+            f'Проверьте, что GET-запрос к `{url}` возвращает ответ '
+            'со статусом 200.'
+        )
+        assert response.json() == client.get('/api/v1/titles/').json(), (
+            f'Проверьте, что `{url}` возвращает те же данные, что и '
+            '`/api/v1/titles/`.'
+        )
+        data = client.get(url, {'genre': 'drama'}).json()
+        assert [item['id'] for item in data['results']] == [
+            titles[1]['id']
+        ], f'Проверьте, что `{url}` поддерживает фильтры списка.'
+        for params in ({'search': 'терминатор'}, {'ordering': '-year'}):
+            assert client.get(url, params).json() == client.get(
+                '/api/v1/titles/', params
+            ).json(), (
+                f'Проверьте, что `{url}` поддерживает `search` и `ordering` '
+                'так же, как `/api/v1/titles/`.'
+            )
+        opened = []
+
+        def count_connection(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        connection_created.connect(count_connection)
+        try:
+            client.get(url)
+        finally:
+            connection_created.disconnect(count_connection)
+        assert not opened, (
+            f'Проверьте, что `{url}` выполняет запросы в общем потоке '
+            'синхронного кода, не открывая новых соединений.'
+        )
+
+        detail = f'{url}{titles[0]["id"]}/'
+        assert client.get(detail).json() == client.get(
+            f'/api/v1/titles/{titles[0]["id"]}/'
+        ).json(), (
+            f'Проверьте, что `{url}{{title_id}}/` возвращает те же данные, '
+            'что и `/api/v1/titles/{title_id}/`.'
+        )
+        assert client.get(f'{url}0/').status_code == HTTPStatus.NOT_FOUND
+        assert client.get(url, {'page': 2}).status_code == (
+            HTTPStatus.NOT_FOUND
+        )
+        assert admin_client.post(url).status_code == (
+            HTTPStatus.METHOD_NOT_ALLOWED
+        ), f'Проверьте, что `{url}` принимает только запросы на чтение.'
+
+    def test_13_titles_bulk_ids(self, admin_client):
+        titles, _, _ = create_titles(admin_client)
+        admin_client.delete(f'/api/v1/titles/{titles[1]["id"]}/')
+        response = admin_client.post(
+            '/api/v1/titles/bulk/',
+            data=[
+                {'name': f'Фильм {idx}', 'year': 2000, 'category': 'films',
+                 'genre': ['drama']}
+                for idx in range(3)
+            ],
+            format='json',
+        )
+        assert response.status_code == HTTPStatus.CREATED
+        created = response.json()
+        assert all(item['id'] > titles[1]['id'] for item in created), (
+            'Проверьте, что пакетная запись не выдаёт заново id удалённых '
+            'произведений.'
+        )
+        assert {
+            item['id']: item['name'] for item in created
+        } == dict(
+            Title.objects.filter(
+                pk__in=[item['id'] for item in created]
+            ).values_list('pk', 'name')
+        ), (
+            'Проверьте, что пакетная запись возвращает id созданных строк.'
+        )
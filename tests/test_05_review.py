@@ -1,10 +1,19 @@
 from http import HTTPStatus
+from importlib import import_module
 
 import pytest
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
 from django.db.utils import IntegrityError
+from django.test.utils import CaptureQueriesContext
+from api.serializers import ReviewsSerializer
+from reviews.db import replica_reads
+from reviews.models import ModelVersion, Review, Title, TitleReviewSummary
+from reviews.versions import bump_versions, version_key
 from tests.utils import (
     check_fields,
     check_pagination,
+    check_query_count,
     create_reviews,
     create_single_review,
     create_titles,
@@ -403,3 +412,421 @@ class Test05ReviewAPI:
                 f'Проверьте, что DELETE-запрос {role} к чужому отзыву через '
                 f'`{url_template}` удаляет отзыв.'
             )
+
+    def test_06_title_rating_follows_reviews(
+        self, admin_client, admin, user_client, user
+    ):
+        titles, _, _ = create_titles(admin_client)
+        title_url = f'/api/v1/titles/{titles[0]["id"]}/'
+        reviews_url = f'{title_url}reviews/'
+
+        assert admin_client.get(title_url).json()['rating'] is None, (
+            'Проверьте, что у произведения без отзывов поле `rating` '
+            'равно `None`.'
+        )
+
+        create_single_review(admin_client, titles[0]['id'], 'admin', 4)
+        review = create_single_review(user_client, titles[0]['id'], 'u', 9)
+        assert admin_client.get(title_url).json()['rating'] == 6, (
+            'Проверьте, что после добавления отзывов поле `rating` '
+            'произведения пересчитывается.'
+        )
+
+        user_client.patch(
+            f'{reviews_url}{review.json()["id"]}/', data={'score': 10}
+        )
+        assert admin_client.get(title_url).json()['rating'] == 7, (
+            'Проверьте, что после изменения оценки поле `rating` '
+            'произведения пересчитывается.'
+        )
+
+        user_client.delete(f'{reviews_url}{review.json()["id"]}/')
+        assert admin_client.get(title_url).json()['rating'] == 4, (
+            'Проверьте, что после удаления отзыва поле `rating` '
+            'произведения пересчитывается.'
+        )
+
+    def test_07_reviews_cursor_pagination(
+        self, client, admin_client, django_user_model
+    ):
+        titles, _, _ = create_titles(admin_client)
+        django_user_model.objects.bulk_create(
+            django_user_model(username=f'author{idx}', email=f'{idx}@a.fake')
+            for idx in range(12)
+        )
+        authors = django_user_model.objects.filter(username__startswith='a')
+        Review.objects.bulk_create(
+            Review(title_id=titles[0]['id'], author=author, text='t', score=5)
+            for author in authors
+        )
+        expected_ids = list(
+            Review.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True
+            )
+        )
+        url = (
+            f'http://testserver/api/v1/titles/{titles[0]["id"]}/reviews/'
+            '?pagination=cursor'
+        )
+
+        pages = []
+        while url:
+            data = client.get(url).json()
+            assert set(data) == {'count', 'next', 'previous', 'results'}, (
+                'Проверьте, что курсорная пагинация сохраняет формат ответа.'
+            )
+            assert data['count'] is None
+            pages.append(data)
+            url = data['next']
+        assert [
+            review['id'] for page in pages for review in page['results']
+        ] == expected_ids, (
+            'Проверьте, что курсорная пагинация по `(pub_date, id)` '
+            'возвращает каждый отзыв ровно один раз.'
+        )
+        assert pages[0]['previous'] is None
+
+        data = client.get(pages[-1]['previous']).json()
+        assert data['results'] == pages[-2]['results'], (
+            'Проверьте, что ссылка `previous` курсорной пагинации ведёт '
+            'на предыдущую страницу.'
+        )
+
+        data = client.get(
+            f'/api/v1/titles/{titles[0]["id"]}/reviews/'
+            '?pagination=cursor&count=true'
+        ).json()
+        assert data['count'] == len(expected_ids)
+
+    def test_08_reviews_conditional_get(
+        self, client, admin_client, user_client, django_user_model
+    ):
+        titles, _, _ = create_titles(admin_client)
+        url = f'/api/v1/titles/{titles[0]["id"]}/reviews/'
+
+        response = client.get(url)
+        etag = response.get('ETag')
+        assert etag and response.get('Last-Modified'), (
+            f'Проверьте, что ответ на GET-запрос к `{url}` содержит '
+            'заголовки `ETag` и `Last-Modified`.'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == HTTPStatus.NOT_MODIFIED, (
+            f'Проверьте, что GET-запрос к `{url}` с актуальным '
+            '`If-None-Match` возвращает ответ со статусом 304.'
+        )
+        assert [query['sql'] for query in queries] == [
+            queries[0]['sql']
+        ] and 'reviews_modelversion' in queries[0]['sql'], (
+            'Проверьте, что ответ 304 формируется одним чтением версий, '
+            'без запросов к таблицам данных.'
+        )
+        response = client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+
+        create_single_review(user_client, titles[0]['id'], 'new review', 7)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == HTTPStatus.OK, (
+            f'Проверьте, что после добавления отзыва GET-запрос к `{url}` '
+            'со старым `If-None-Match` возвращает ответ со статусом 200.'
+        )
+        assert response['ETag'] != etag
+        assert len(response.json()['results']) == 1
+        assert ModelVersion.objects.filter(
+            key=version_key(Review),
+        ).exists(), (
+            'Проверьте, что версии моделей хранятся в общей для воркеров '
+            'таблице `ModelVersion`.'
+        )
+
+        etag = response['ETag']
+        user = django_user_model.objects.get(username='TestUser')
+        user.generate_confirmation_code()
+        user.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == HTTPStatus.NOT_MODIFIED, (
+            'Проверьте, что сохранение пользователя без смены `username` '
+            'не сбрасывает `ETag` отзывов.'
+        )
+        user.username = 'RenamedUser'
+        user.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == HTTPStatus.OK, (
+            'Проверьте, что смена `username` автора сбрасывает `ETag` '
+            'отзывов.'
+        )
+        assert response.json()['results'][0]['author'] == 'RenamedUser'
+
+        response = client.get(url, HTTP_IF_NONE_MATCH='*')
+        assert response.status_code == HTTPStatus.NOT_MODIFIED
+        response = client.get(
+            f'/api/v1/titles/{titles[1]["id"] + 100}/reviews/',
+            HTTP_IF_NONE_MATCH='*'
+        )
+        assert response.status_code == HTTPStatus.NOT_FOUND, (
+            'Проверьте, что `If-None-Match: *` для несуществующего '
+            'произведения возвращает ответ со статусом 404.'
+        )
+        response = client.get(
+            f'/api/v1/titles/{titles[1]["id"] + 100}/', HTTP_IF_NONE_MATCH='*'
+        )
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_09_async_reviews_and_comments(
+        self, client, admin_client, django_user_model
+    ):
+        titles, _, _ = create_titles(admin_client)
+        django_user_model.objects.bulk_create(
+            django_user_model(username=f'author{idx}', email=f'{idx}@a.fake')
+            for idx in range(7)
+        )
+        authors = django_user_model.objects.filter(username__startswith='a')
+        Review.objects.bulk_create(
+            Review(title_id=titles[0]['id'], author=author, text='t', score=5)
+            for author in authors
+        )
+        review = Review.objects.order_by('id').first()
+        review.comment.create(author=authors[0], text='c')
+        url = f'/api/v1/async/titles/{titles[0]["id"]}/reviews/'
+
+        first = client.get(url).json()
+        second = client.get(first['next']).json()
+        assert first['count'] == second['count'] == 7
+        assert second['next'] is None
+        assert client.get(second['previous']).json() == first, (
+            'Проверьте, что ссылки `next` и `previous` асинхронного списка '
+            'отзывов ведут на соседние страницы.'
+        )
+        expected = sorted(
+            client.get(
+                f'/api/v1/titles/{titles[0]["id"]}/reviews/'
+            ).json()['results']
+            + client.get(
+                f'/api/v1/titles/{titles[0]["id"]}/reviews/?page=2'
+            ).json()['results'],
+            key=lambda item: item['id'],
+        )
+        assert first['results'] + second['results'] == expected, (
+            f'Проверьте, что `{url}` возвращает те же отзывы, что и '
+            '`/api/v1/titles/{title_id}/reviews/`.'
+        )
+        assert client.get(
+            f'/api/v1/async/titles/{titles[1]["id"] + 100}/reviews/'
+        ).status_code == HTTPStatus.NOT_FOUND
+
+        comments_url = f'{url}{review.id}/comments/'
+        assert client.get(comments_url).json() == client.get(
+            f'/api/v1/titles/{titles[0]["id"]}/reviews/{review.id}/comments/'
+        ).json(), (
+            f'Проверьте, что `{comments_url}` возвращает те же данные, что '
+            'и синхронный список комментариев.'
+        )
+        assert client.get(
+            f'/api/v1/async/titles/{titles[1]["id"]}/reviews/'
+            f'{review.id}/comments/'
+        ).status_code == HTTPStatus.NOT_FOUND, (
+            'Проверьте, что комментарии к отзыву другого произведения '
+            'возвращают ответ со статусом 404.'
+        )
+
+    def test_10_title_review_summary(
+        self, client, admin_client, admin, user_client, user,
+        django_user_model, settings
+    ):
+        titles, _, _ = create_titles(admin_client)
+        url = f'/api/v1/titles/{titles[0]["id"]}/summary/'
+        empty = check_query_count(client, url, 1).json()
+        assert empty == {
+            'title': titles[0]['id'],
+            'count': 0,
+            'score_sum': 0,
+            'histogram': [0] * 10,
+            'latest_reviews': [],
+        }, (
+            f'Проверьте, что `{url}` у произведения без отзывов возвращает '
+            'пустую сводку.'
+        )
+
+        create_single_review(admin_client, titles[0]['id'], 'admin', 4)
+        review = create_single_review(user_client, titles[0]['id'], 'u', 9)
+        summary = client.get(url).json()
+        assert (summary['count'], summary['score_sum']) == (2, 13)
+        assert summary['histogram'] == [0, 0, 0, 1, 0, 0, 0, 0, 1, 0], (
+            'Проверьте, что `histogram` сводки считает отзывы по оценкам.'
+        )
+        assert [item['text'] for item in summary['latest_reviews']] == [
+            'u', 'admin'
+        ], (
+            'Проверьте, что `latest_reviews` начинается с новых отзывов.'
+        )
+
+        reviews_url = f'/api/v1/titles/{titles[0]["id"]}/reviews/'
+        user_client.patch(
+            f'{reviews_url}{review.json()["id"]}/', data={'score': 10}
+        )
+        summary = client.get(url).json()
+        assert summary['histogram'][8:] == [0, 1], (
+            'Проверьте, что изменение оценки переносит отзыв в другой '
+            'столбец `histogram`.'
+        )
+        assert summary['score_sum'] == 14
+
+        user_client.delete(f'{reviews_url}{review.json()["id"]}/')
+        summary = client.get(url).json()
+        assert (summary['count'], summary['score_sum']) == (1, 4)
+        assert summary['histogram'][9] == 0
+        assert [item['author'] for item in summary['latest_reviews']] == [
+            admin.username
+        ], (
+            'Проверьте, что удалённый отзыв пропадает из `latest_reviews`.'
+        )
+
+        for idx in range(7):
+            Review.objects.create(
+                title_id=titles[0]['id'],
+                author=django_user_model.objects.create(
+                    username=f'summary{idx}', email=f'summary{idx}@a.fake'
+                ),
+                text=f'r{idx}',
+                score=idx + 1,
+            )
+        summary = check_query_count(client, url, 2).json()
+        assert summary['count'] == 8
+        assert [item['text'] for item in summary['latest_reviews']] == [
+            f'r{idx}' for idx in range(6, 1, -1)
+        ], (
+            'Проверьте, что `latest_reviews` хранит только последние '
+            'отзывы.'
+        )
+
+        TitleReviewSummary.objects.filter(title_id=titles[0]['id']).delete()
+        assert client.get(url).json() == summary, (
+            'Проверьте, что отсутствующая сводка пересчитывается по '
+            'отзывам.'
+        )
+
+        TitleReviewSummary.objects.filter(title_id=titles[0]['id']).delete()
+        settings.DATABASE_REPLICAS = ['replica1']
+        token = replica_reads.set(True)
+        try:
+            TitleReviewSummary.objects.rebuild([titles[0]['id']])
+        finally:
+            replica_reads.reset(token)
+            settings.DATABASE_REPLICAS = []
+        assert client.get(url).json() == summary, (
+            'Проверьте, что пересчёт сводки в запросе с чтением с реплики '
+            'читает и пишет основную базу.'
+        )
+
+        TitleReviewSummary.objects.all().delete()
+        backfill = import_module(
+            'reviews.migrations.0008_backfill_title_review_summaries'
+        )
+        state = MigrationExecutor(connection).loader.project_state(
+            ('reviews', '0008_backfill_title_review_summaries')
+        )
+        with connection.schema_editor() as schema_editor:
+            backfill.fill_summaries(state.apps, schema_editor)
+        filled = TitleReviewSummary.objects.get(title_id=titles[0]['id'])
+        assert (filled.histogram, filled.latest) == (
+            summary['histogram'],
+            [item['id'] for item in summary['latest_reviews']],
+        ), (
+            'Проверьте, что миграция заполняет сводки для существующих '
+            'отзывов по моделям своего состояния.'
+        )
+        assert client.get(
+            f'/api/v1/titles/{titles[1]["id"] + 100}/summary/'
+        ).status_code == HTTPStatus.NOT_FOUND
+
+    def test_11_review_create_queries(
+        self, admin_client, user_client, admin,
+    ):
+        titles, _, _ = create_titles(admin_client)
+        url = f'/api/v1/titles/{titles[0]["id"]}/reviews/'
+        data = {'text': 'Отзыв', 'score': 5}
+        user_client.get(url)
+        # Строка версии отзывов заводится первой записью.
+        bump_versions([Review])
+
+        core_paths = {
+            HTTPStatus.CREATED: [
+                'SELECT "reviews_user"',
+                'SELECT "reviews_title"',
+                'INSERT INTO "reviews_review"',
+                'UPDATE "reviews_title"',
+            ],
+            HTTPStatus.BAD_REQUEST: [
+                'SELECT "reviews_user"',
+                'SELECT "reviews_title"',
+                'INSERT INTO "reviews_review"',
+                'SELECT (1) AS "a"',
+            ],
+        }
+        side_effects = {
+            'reviews_titlereviewsummary': [
+                'UPDATE "reviews_titlereviewsummary"',
+            ],
+            'reviews_modelversion': ['UPDATE "reviews_modelversion"'],
+            'reviews_review_search': [
+                'DELETE FROM reviews_review_search',
+                'INSERT INTO reviews_review_search',
+            ],
+        }
+
+        def matches(statements, expected, match):
+            return len(statements) == len(expected) and all(
+                match(sql, part) for sql, part in zip(statements, expected)
+            )
+
+        for expected_status, expected_core in core_paths.items():
+            with CaptureQueriesContext(connection) as queries:
+                response = user_client.post(url, data=data)
+            assert response.status_code == expected_status
+            statements = [
+                query['sql'] for query in queries
+                if not query['sql'].startswith(
+                    ('BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT')
+                )
+            ]
+            core = [
+                sql for sql in statements
+                if not any(table in sql for table in side_effects)
+            ]
+            assert matches(core, expected_core, str.startswith), (
+                'Проверьте, что POST-запрос к '
+                '`/api/v1/titles/{title_id}/reviews/` с ответом '
+                f'{expected_status} читает только автора и один раз '
+                'произведение и записывает отзыв и рейтинг, без отдельной '
+                'проверки уже оставленного отзыва: ' + '; '.join(core)
+            )
+            for table, expected in side_effects.items():
+                found = [sql for sql in statements if table in sql]
+                if expected_status != HTTPStatus.CREATED:
+                    expected = []
+                assert matches(
+                    found, expected, lambda sql, part: part in sql
+                ), (
+                    'Проверьте, что запись отзыва обновляет сводку одним '
+                    '`UPDATE`, а версию и поисковый индекс - без лишних '
+                    f'запросов к `{table}`: ' + '; '.join(found)
+                )
+
+        assert response.json() == {
+            'non_field_errors': ['Отзыв можно оставить единожды']
+        }, (
+            'Проверьте, что повторный отзыв автора на произведение '
+            'возвращает прежнюю ошибку.'
+        )
+        assert Review.objects.filter(title_id=titles[0]['id']).count() == 1
+
+        with pytest.raises(IntegrityError):
+            ReviewsSerializer().create({
+                'author': admin,
+                'title': Title.objects.get(pk=titles[0]['id']),
+                'text': None,
+                'score': 5,
+            })
@@ -4,6 +4,7 @@ import pytest
 from tests.utils import (
     check_fields,
     check_pagination,
+    check_query_count,
     create_comments,
     create_reviews,
     create_single_comment,
@@ -422,3 +423,50 @@ class Test06CommentAPI:
             'Проверьте, что DELETE-запрос неавторизованного пользователя к '
             f'`{url}` возвращает ответ со статусом 401.'
         )
+
+    def test_07_comments_scoped_to_title(
+        self, client, admin_client, admin, user_client, user,
+        moderator_client, moderator
+    ):
+        author_map = {
+            admin: admin_client,
+            user: user_client,
+            moderator: moderator_client,
+        }
+        comments, reviews, titles = create_comments(admin_client, author_map)
+        url = (
+            f'/api/v1/titles/{titles[0]["id"]}/reviews/{reviews[0]["id"]}/'
+            'comments/'
+        )
+        data = check_query_count(client, url, 3).json()
+        assert {item['author'] for item in data['results']} == {
+            author.username for author in author_map
+        }, (
+            f'Проверьте, что `{url}` возвращает авторов комментариев, '
+            'получая их вместе с комментариями.'
+        )
+
+        empty_url = (
+            f'/api/v1/titles/{titles[0]["id"]}/reviews/{reviews[1]["id"]}/'
+            'comments/'
+        )
+        assert client.get(empty_url).json()['results'] == [], (
+            'Проверьте, что у отзыва без комментариев список пуст.'
+        )
+
+        foreign_url = (
+            f'/api/v1/titles/{titles[1]["id"]}/reviews/{reviews[0]["id"]}/'
+            'comments/'
+        )
+        assert client.get(foreign_url).status_code == HTTPStatus.NOT_FOUND, (
+            'Проверьте, что GET-запрос к комментариям отзыва другого '
+            'произведения возвращает ответ со статусом 404.'
+        )
+        assert client.get(
+            f'{foreign_url}{comments[0]["id"]}/'
+        ).status_code == HTTPStatus.NOT_FOUND
+        response = user_client.post(foreign_url, data={'text': 'Текст'})
+        assert response.status_code == HTTPStatus.NOT_FOUND, (
+            'Проверьте, что POST-запрос к комментариям отзыва другого '
+            'произведения возвращает ответ со статусом 404.'
+        )
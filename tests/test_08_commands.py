@@ -0,0 +1,463 @@
+import csv
+import json
+import logging
+import shutil
+import warnings
+from datetime import datetime
+from http import HTTPStatus
+from pathlib import Path
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError
+from django.http import HttpResponse
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.instrumentation import RequestMetricsMiddleware, clear_flagged
+from api.metrics import MmapFile, sample_key
+from reviews.models import (
+    Categorie,
+    Comment,
+    Genre,
+    OutboxEmail,
+    Review,
+    Title,
+    User,
+)
+from reviews.db import PrimaryReplicaRouter, ReplicaRoutingMiddleware
+from reviews.importer import CsvImporter
+from reviews.outbox import enqueue_email
+from tests.utils import create_titles
+
+
+class FailingEmailBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('SMTP недоступен')
+
+
+class UnreachableEmailBackend(EmailBackend):
+    def open(self):
+        raise ConnectionRefusedError('SMTP не принимает соединения')
+
+
+@pytest.mark.django_db(transaction=True)
+class Test08Commands:
+    def test_01_load_csv(self):
+        call_command('load_csv', batch_size=10, workers=1)
+
+        expected_counts = (
+            (User, 5),
+            (Categorie, 3),
+            (Genre, 15),
+            (Title, 32),
+            (Title.genre.through, 42),
+            (Review, 72),
+            (Comment, 3),
+        )
+        for model, count in expected_counts:
+            assert model.objects.count() == count, (
+                'Проверьте, что команда `load_csv` загружает все строки '
+                f'в таблицу модели `{model.__name__}`.'
+            )
+
+        title = Title.objects.get(pk=1)
+        assert title.rating_count == title.reviews.count(), (
+            'Проверьте, что команда `load_csv` пересчитывает рейтинги '
+            'загруженных произведений.'
+        )
+        assert str(Review.objects.get(pk=1).pub_date.year) == '2019', (
+            'Проверьте, что команда `load_csv` сохраняет `pub_date` из CSV.'
+        )
+        assert Title.objects.create(name='new', year=2000).pk > 32, (
+            'Проверьте, что после загрузки данных новые объекты получают '
+            'свободные идентификаторы.'
+        )
+
+    @pytest.mark.parametrize('fast', (False, True))
+    def test_02_load_csv_rejects_bad_rows(self, tmp_path, fast):
+        data_path = Path(settings.BASE_DIR) / 'static' / 'data'
+        for csv_file in data_path.glob('*.csv'):
+            shutil.copy(csv_file, tmp_path)
+        with open(tmp_path / 'review.csv', 'a', encoding='utf-8') as file:
+            file.write('\n1000,2,"Слишком высокая оценка",100,11,2020-01-01\n')
+            file.write('1001,1,"Повторный отзыв",100,5,2020-01-01\n')
+            file.write('1002,999,"Нет произведения",100,5,2020-01-01\n')
+        with open(tmp_path / 'titles.csv', 'a', encoding='utf-8') as file:
+            file.write(f'\n1000,Из будущего,{datetime.now().year + 1},1\n')
+        rejects = tmp_path / 'rejects.csv'
+
+        call_command(
+            'load_csv',
+            path=tmp_path,
+            batch_size=16,
+            workers=2,
+            fast=fast,
+            rejects=rejects,
+        )
+
+        assert Review.objects.count() == 72, (
+            'Проверьте, что команда `load_csv` отбрасывает некорректные '
+            'отзывы и загружает остальные.'
+        )
+        assert Title.objects.count() == 32, (
+            'Проверьте, что команда `load_csv` не загружает произведения '
+            'из будущего.'
+        )
+        with open(rejects, encoding='utf-8') as file:
+            assert len(file.readlines()) == 5, (
+                'Проверьте, что команда `load_csv` записывает отброшенные '
+                'строки в файл `--rejects`.'
+            )
+
+    def test_02_load_csv_missing_column(self, tmp_path):
+        data_path = Path(settings.BASE_DIR) / 'static' / 'data'
+        for csv_file in data_path.glob('*.csv'):
+            shutil.copy(csv_file, tmp_path)
+        with open(tmp_path / 'review.csv', 'w', encoding='utf-8') as file:
+            file.write('id,title_id,text,author,pub_date\n')
+            file.write('1,1,"Без оценки",100,2020-01-01\n')
+
+        with pytest.raises(CommandError, match='review.csv - score'):
+            call_command('load_csv', path=tmp_path, workers=2)
+        assert Title.objects.count() == 0, (
+            'Проверьте, что команда `load_csv` проверяет заголовки CSV '
+            'до начала загрузки.'
+        )
+
+    @pytest.mark.parametrize('fast', (False, True))
+    def test_02_load_csv_failed_insert(self, tmp_path, fast, monkeypatch):
+        data_path = Path(settings.BASE_DIR) / 'static' / 'data'
+        for csv_file in data_path.glob('*.csv'):
+            shutil.copy(csv_file, tmp_path)
+        with open(tmp_path / 'titles.csv', 'a', encoding='utf-8') as file:
+            file.write('\n1000,Не записанное,2000,1\n')
+        with open(tmp_path / 'review.csv', 'a', encoding='utf-8') as file:
+            file.write('\n1000,1000,"Отзыв на него",100,5,2020-01-01\n')
+        insert = CsvImporter.insert
+
+        def failing_insert(self, table, rows):
+            if table.filename == 'titles.csv' and any(
+                values[0] == 1000 for values in rows
+            ):
+                raise IntegrityError('CHECK constraint failed')
+            insert(self, table, rows)
+
+        monkeypatch.setattr(CsvImporter, 'insert', failing_insert)
+
+        call_command(
+            'load_csv', path=tmp_path, batch_size=16, workers=1, fast=fast,
+        )
+
+        assert (Title.objects.count(), Review.objects.count()) == (32, 72), (
+            'Проверьте, что команда `load_csv` отбрасывает строки, '
+            'ссылающиеся на строку, которую не удалось записать, и не '
+            'прерывает загрузку при COMMIT.'
+        )
+
+    def test_03_export(self, tmp_path):
+        call_command('load_csv', workers=1)
+        output = tmp_path / 'review.csv'
+
+        call_command('export', 'reviews', output=str(output))
+
+        with open(output, encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file))
+        source = Path(settings.BASE_DIR) / 'static' / 'data' / 'review.csv'
+        with open(source, encoding='utf-8', newline='') as file:
+            expected = list(csv.DictReader(file))
+        expected = {row['id']: row for row in expected}
+        assert sorted(row['id'] for row in rows) == sorted(expected), (
+            'Проверьте, что команда `export` выгружает все отзывы в формате '
+            '`static/data/review.csv`.'
+        )
+        assert rows[0] == {
+            key: value.replace('\r\n', '\n')
+            for key, value in expected[rows[0]['id']].items()
+        }, (
+            'Проверьте, что команда `export` сохраняет колонки и значения '
+            'из `static/data/review.csv`.'
+        )
+
+    def test_04_export_api(self, client, admin_client, tmp_path):
+        call_command('load_csv', workers=1)
+        url = '/api/v1/export/comments/'
+
+        response = client.get(url)
+        assert response.status_code == HTTPStatus.UNAUTHORIZED, (
+            f'Проверьте, что `{url}` недоступен неавторизованным '
+            'пользователям.'
+        )
+
+        response = admin_client.get(
+            url, {'output': 'ndjson', 'since': '2020-01-13T00:00:00Z'}
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.streaming, (
+            f'Проверьте, что `{url}` отдаёт выгрузку потоково.'
+        )
+        rows = [
+            json.loads(line)
+            for line in b''.join(response.streaming_content).splitlines()
+        ]
+        assert [row['id'] for row in rows] == [1, 2, 3]
+        assert set(rows[0]) == {'id', 'review_id', 'text', 'author', 'pub_date'}
+
+        response = admin_client.get(url, {'since': '2030-01-01T00:00:00Z'})
+        assert b''.join(response.streaming_content).splitlines() == [
+            b'id,review_id,text,author,pub_date'
+        ], (
+            'Проверьте, что параметр `since` отбирает записи по `pub_date`.'
+        )
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            response = admin_client.get(
+                url, {'output': 'ndjson', 'since': '2020-01-13T00:00:00'}
+            )
+            lines = b''.join(response.streaming_content).splitlines()
+        assert len(lines) == 3, (
+            'Проверьте, что дата `since` без часового пояса считается '
+            'датой в текущем поясе.'
+        )
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            response = admin_client.get(
+                url, {'output': 'ndjson', 'since': '2020-01-13'}
+            )
+            lines = b''.join(response.streaming_content).splitlines()
+        assert len(lines) == 3, (
+            'Проверьте, что дата `since` без времени считается полночью '
+            'этого дня в текущем поясе.'
+        )
+        output = tmp_path / 'comments.csv'
+        call_command(
+            'export', 'comments', since='2030-01-01', output=str(output),
+        )
+        assert output.read_text(encoding='utf-8').splitlines() == [
+            'id,review_id,text,author,pub_date'
+        ], (
+            'Проверьте, что команда `export` принимает `--since` в виде '
+            'даты без времени.'
+        )
+
+        for since in ('2023-02-30T00:00:00', '2023-02-30', 'вчера'):
+            response = admin_client.get(url, {'since': since})
+            assert response.status_code == HTTPStatus.BAD_REQUEST, (
+                f'Проверьте, что `{url}` отвечает 400 на неверную дату '
+                f'`since={since}`.'
+            )
+        with pytest.raises(CommandError):
+            call_command('export', 'comments', since='2023-02-30T00:00:00')
+
+    def test_05_send_outbox_retries(self, settings):
+        for idx in range(3):
+            enqueue_email('Тема', 'Текст', f'user{idx}@yamdb.fake')
+
+        settings.EMAIL_BACKEND = (
+            'tests.test_08_commands.FailingEmailBackend'
+        )
+        call_command('send_outbox', batch_size=2)
+        assert not mail.outbox
+        failed = OutboxEmail.objects.filter(sent_at__isnull=True)
+        assert failed.count() == 3
+        assert all(
+            email.attempts == 1 and email.next_attempt_at > timezone.now()
+            for email in failed
+        ), (
+            'Проверьте, что неудачная отправка откладывает повтор.'
+        )
+
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+        call_command('send_outbox')
+        assert not mail.outbox, (
+            'Проверьте, что письмо не отправляется раньше времени повтора.'
+        )
+
+        failed.update(next_attempt_at=timezone.now())
+        call_command('send_outbox', batch_size=2)
+        assert sorted(message.to[0] for message in mail.outbox) == [
+            f'user{idx}@yamdb.fake' for idx in range(3)
+        ]
+        assert not OutboxEmail.objects.filter(sent_at__isnull=True).exists()
+
+    def test_05_01_send_outbox_connection_error(self, settings):
+        email = enqueue_email('Тема', 'Текст', 'user@yamdb.fake')
+        settings.EMAIL_BACKEND = (
+            'tests.test_08_commands.UnreachableEmailBackend'
+        )
+        call_command('send_outbox')
+
+        email.refresh_from_db()
+        assert email.sent_at is None and email.attempts == 1, (
+            'Проверьте, что ошибка соединения с почтовым сервером не '
+            'прерывает `send_outbox` и засчитывается как попытка.'
+        )
+        assert email.next_attempt_at > timezone.now()
+        assert 'ConnectionRefusedError' in email.last_error
+
+    def test_06_replica_routing(self, settings, rf, user, admin):
+        settings.DATABASE_REPLICAS = ['replica1']
+        router = PrimaryReplicaRouter()
+        routed = []
+
+        def view(request):
+            routed.append(router.db_for_read(Title))
+            return HttpResponse()
+
+        def auth(user):
+            return {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}'}
+
+        middleware = ReplicaRoutingMiddleware(view)
+        middleware(rf.get('/api/v1/titles/', **auth(user)))
+        middleware(rf.post('/api/v1/titles/', **auth(user)))
+        middleware(rf.get('/api/v1/titles/', **auth(user)))
+        middleware(rf.get('/api/v1/titles/', **auth(admin)))
+        middleware(rf.get('/api/v1/titles/', REMOTE_ADDR='10.0.0.2'))
+        assert routed == [
+            'replica1', 'default', 'default', 'replica1', 'replica1'
+        ], (
+            'Проверьте, что GET-запросы читают с реплики, а после записи '
+            'пользователь читает с основной базы.'
+        )
+        assert router.db_for_read(Title) == 'default', (
+            'Проверьте, что вне HTTP-запросов чтение идёт с основной базы.'
+        )
+        assert router.db_for_write(Title) == 'default'
+
+        routed.clear()
+        with override_settings(
+            CACHES={
+                **settings.CACHES,
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.'
+                    'LocMemCache',
+                    'LOCATION': 'another-worker',
+                },
+            }
+        ):
+            middleware(rf.get('/api/v1/titles/', **auth(user)))
+        assert routed == ['default'], (
+            'Проверьте, что закрепление за основной базой хранится в общем '
+            'кеше, который видят другие воркеры, и переживает обновление '
+            'токена.'
+        )
+
+        middleware(rf.post('/api/v1/auth/signup/', REMOTE_ADDR='10.0.0.3'))
+        routed.clear()
+        middleware(rf.get('/api/v1/titles/', REMOTE_ADDR='10.0.0.3'))
+        assert routed == ['default'], (
+            'Проверьте, что анонимный клиент закрепляется по IP-адресу.'
+        )
+
+        async def async_view(request):
+            routed.append(router.db_for_read(Title))
+            return HttpResponse()
+
+        caches['shared'].clear()
+        routed.clear()
+        middleware = async_to_sync(ReplicaRoutingMiddleware(async_view))
+        middleware(rf.get('/api/v1/titles/', **auth(user)))
+        middleware(rf.post('/api/v1/titles/', **auth(user)))
+        middleware(rf.get('/api/v1/titles/', **auth(user)))
+        assert routed == ['replica1', 'default', 'default'], (
+            'Проверьте, что `ReplicaRoutingMiddleware` так же работает в '
+            'асинхронной цепочке middleware.'
+        )
+
+    def test_07_request_metrics(
+        self, settings, client, admin_client, caplog, rf
+    ):
+        settings.REQUEST_METRICS_SAMPLE_RATE = 1
+        titles, _, _ = create_titles(admin_client)
+        url = f'/api/v1/titles/{titles[0]["id"]}/reviews/'
+        with caplog.at_level(logging.INFO, logger='api.instrumentation'):
+            response = client.get(url)
+        timing = response.get('Server-Timing', '')
+        for metric in ('db;dur=', 'serialize;dur=', 'view;dur=', 'total;dur='):
+            assert metric in timing, (
+                'Проверьте, что замеренный запрос получает заголовок '
+                f'`Server-Timing` с метрикой `{metric}`.'
+            )
+        record = json.loads(caplog.records[-1].getMessage())
+        assert record['endpoint'] == 'GET api:api:review-list'
+        assert record['queries'] > 0 and f'"{record["queries"]} queries"' in (
+            timing
+        ), 'Проверьте, что число SQL-запросов попадает в лог и заголовок.'
+        assert record['duplicates'] == []
+
+        def view(request):
+            for _ in range(3):
+                list(Title.objects.filter(pk__in=[1, 2]))
+            return HttpResponse()
+
+        middleware = RequestMetricsMiddleware(view)
+        caplog.clear()
+        with caplog.at_level(logging.INFO, logger='api.instrumentation'):
+            middleware(rf.get('/n-plus-one/'))
+            middleware(rf.get('/n-plus-one/'))
+        warnings = [
+            record for record in caplog.records
+            if record.levelno == logging.WARNING
+        ]
+        assert len(warnings) == 1, (
+            'Проверьте, что повторяющийся запрос отмечается как N+1 один '
+            'раз для эндпоинта.'
+        )
+        clear_flagged()
+
+        settings.REQUEST_METRICS_SAMPLE_RATE = 0
+        assert 'Server-Timing' not in client.get(url), (
+            'Проверьте, что запросы вне выборки не замеряются.'
+        )
+
+    def test_08_metrics(self, settings, client, admin_client, tmp_path):
+        settings.METRICS_DIR = str(tmp_path)
+        create_titles(admin_client)
+        client.get('/api/v1/titles/')
+        client.get('/api/v1/titles/')
+        MmapFile(tmp_path / '999999-1.db').add(
+            sample_key(
+                'yamdb_http_requests_total',
+                {
+                    'view': 'TitlesViewSet.list',
+                    'method': 'GET',
+                    'status': '200',
+                },
+            ),
+            3,
+        )
+
+        response = client.get('/metrics')
+        assert response.status_code == HTTPStatus.OK
+        assert response['Content-Type'].startswith('text/plain')
+        body = response.content.decode()
+        expected = (
+            'yamdb_http_requests_total{method="GET",status="200",'
+            'view="TitlesViewSet.list"} 5.0',
+            'yamdb_http_requests_total{method="POST",status="201",'
+            'view="TitlesViewSet.create"} 2.0',
+            'yamdb_http_request_duration_seconds_bucket{'
+            'view="TitlesViewSet.list",le="+Inf"} 2.0',
+            'yamdb_db_queries_per_request_count{'
+            'view="TitlesViewSet.list"} 2.0',
+            'yamdb_cache_hit_ratio{cache="response"} 0.5',
+        )
+        for line in expected:
+            assert line in body.splitlines(), (
+                'Проверьте, что `/metrics` складывает значения всех '
+                f'процессов и содержит строку `{line}`.'
+            )
+
+        settings.METRICS_TOKEN = 'secret'
+        assert client.get('/metrics').status_code == HTTPStatus.UNAUTHORIZED
+        assert client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer secret'
+        ).status_code == HTTPStatus.OK
@@ -1,5 +1,8 @@
 from http import HTTPStatus
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 check_name_and_slug_patterns = (
     (
         {'name': 'a' * 256 + 'simbols', 'slug': 'longname'},
@@ -291,3 +294,18 @@ def check_fields(obj_type, url_pattern, obj, expected_data, detail=False):
         f'данные {obj_types[obj_type]}{results_in_msg}. Поле `id` не '
         'найдено или не является целым числом.'
     )
+
+
+def check_query_count(client, url, expected_count, **extra):
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url, **extra)
+    assert response.status_code == HTTPStatus.OK, (
+        f'Проверьте, что GET-запрос к `{url}` возвращает ответ со статусом '
+        '200.'
+    )
+    assert len(queries) == expected_count, (
+        f'Проверьте, что GET-запрос к `{url}` выполняет {expected_count} '
+        f'SQL-запрос(а) к базе данных, а не {len(queries)}: '
+        + '; '.join(query['sql'] for query in queries)
+    )
+    return response